@@ -0,0 +1,332 @@
+'''
+Descripttion: 评论分析批处理脚本
+在 2_construct_chains.py 的评论分析链(analysis_chain) + 自动回复链(reply_chain) 基础上，
+提供一个命令行批处理模式：
+1. 从 CSV 或 JSONL 文件中流式读取评论，不会一次性把整个文件读进内存。
+2. 用 asyncio + 信号量控制并发，同时在飞的请求数不超过 --concurrency。
+3. 结果按批增量写入 JSONL 或 Parquet，输出文件本身就是检查点：
+   重新运行时会先读取已经写出的行ID并跳过，崩溃后不会重复计费。
+4. 运行结束后报告吞吐(rows/s)和每千行的花费。
+用法示例:
+    python 2_batch_review_runner.py reviews.csv -o results.jsonl --concurrency 16
+    python 2_batch_review_runner.py reviews.jsonl -o results.parquet --text-field content --id-field review_id
+'''
+import os
+import sys
+import csv
+import json
+import time
+import asyncio
+import argparse
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI
+from langchain_community.chat_models.tongyi import ChatTongyi
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.output_parsers import StrOutputParser
+from langchain.output_parsers import ResponseSchema, StructuredOutputParser
+from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
+
+from token_usage import iter_token_usage
+
+load_dotenv(override=True)
+
+ARK_API_KEY = os.getenv("ARK_API_KEY")
+dashscope_api_key = os.getenv("DASHSCOPE_API_KEY")
+
+# 每千tokens的价格(元)，格式为 (输入价格, 输出价格)，仅用于估算成本，请以官方价格为准
+MODEL_PRICES = {
+    "qwen-max": (0.0024, 0.0096),
+    "deepseek-r1-250120": (0.004, 0.016),
+}
+
+
+# --- 1. 构建与 2_construct_chains.py 相同的两条链 ---
+def build_chains():
+    """构建评论分析链和回复生成链"""
+    if not ARK_API_KEY:
+        raise ValueError("请设置环境变量 ARK_API_KEY")
+    if not dashscope_api_key:
+        raise ValueError("请设置环境变量 DASHSCOPE_API_KEY")
+
+    chatARK = ChatOpenAI(
+        model="deepseek-r1-250120",
+        api_key=ARK_API_KEY,
+        base_url="https://ark.cn-beijing.volces.com/api/v3",
+        temperature=0.7,
+        streaming=False,
+    )
+    chatQwen = ChatTongyi(
+        model="qwen-max",
+        dashscope_api_key=dashscope_api_key
+    )
+
+    response_schemas = [
+        ResponseSchema(
+            name="sentiment",
+            description="这篇评论的情感是积极(positive), 消极(negative)还是中性(neutral)?"
+        ),
+        ResponseSchema(
+            name="summary",
+            description="用一句话简短总结这篇评论的主要观点。"
+        ),
+        ResponseSchema(
+            name="suggested_action",
+            description="作为客服，针对这条评论，我们应该采取什么后续行动？例如：'联系用户解决问题' 或 '感谢用户的支持'。"
+        ),
+    ]
+    output_parser = StructuredOutputParser.from_response_schemas(response_schemas)
+    prompt = PromptTemplate(
+        template="请分析以下的用户评论。\n{format_instructions}\n评论内容: {review}",
+        input_variables=["review"],
+        partial_variables={"format_instructions": output_parser.get_format_instructions()}
+    )
+    analysis_chain = prompt | chatQwen | output_parser
+
+    reply_template = """
+你是一名专业的客服。请根据以下信息，草拟一条礼貌、专业的回复评论。
+
+评论信息：
+评论概括: {summary}
+评论情感: {sentiment}
+回复建议：{suggested_action}
+
+请在回复中根据评论的评论概括、评论情感、回复建议为客户提供相应的回复，不需要任何注释信息。
+"""
+    reply_prompt = ChatPromptTemplate.from_template(reply_template)
+    reply_chain = reply_prompt | chatARK | StrOutputParser()
+
+    # 单行失败时自动重试几次，网络抖动不至于让整行作废
+    return (
+        analysis_chain.with_retry(stop_after_attempt=3),
+        reply_chain.with_retry(stop_after_attempt=3),
+    )
+
+
+# --- 2. 成本统计 ---
+class CostTracker(BaseCallbackHandler):
+    """
+    统计某个模型的token用量，并按 MODEL_PRICES 估算花费；多个线程共用同一个实例。
+    """
+    def __init__(self, model_name: str):
+        super().__init__()
+        self.model_name = model_name
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self._lock = threading.Lock()
+
+    def on_llm_end(self, response, **kwargs: Any) -> None:
+        for input_tokens, output_tokens in iter_token_usage(response):
+            with self._lock:
+                self.input_tokens += input_tokens
+                self.output_tokens += output_tokens
+
+    @property
+    def cost(self) -> float:
+        price_in, price_out = MODEL_PRICES.get(self.model_name, (0.0, 0.0))
+        return self.input_tokens / 1000 * price_in + self.output_tokens / 1000 * price_out
+
+
+# --- 3. 输入读取：按行流式读取CSV/JSONL ---
+def iter_reviews(path: str, text_field: str, id_field: Optional[str]) -> Iterator[Tuple[str, str]]:
+    """
+    逐行产出 (行ID, 评论文本)。
+    如果指定了 id_field 且该列存在，则用它作为行ID，否则使用行号。
+    """
+    if path.endswith(".csv"):
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            for line_no, row in enumerate(csv.DictReader(f)):
+                row_id = row.get(id_field) if id_field else None
+                yield str(row_id if row_id not in (None, "") else line_no), row.get(text_field) or ""
+    elif path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f):
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                row_id = row.get(id_field) if id_field else None
+                yield str(row_id if row_id not in (None, "") else line_no), row.get(text_field) or ""
+    else:
+        raise ValueError(f"不支持的输入格式: {path}，只支持 .csv 和 .jsonl")
+
+
+# --- 4. 结果写入：增量写JSONL/Parquet，同时作为检查点 ---
+class ResultWriter:
+    """
+    增量写出结果。
+    - JSONL: 追加写入，每次 flush 后 fsync，确保已写出的行在崩溃后依然存在。
+    - Parquet: 输出路径是一个目录，每次 flush 写一个 part 文件，可直接用 pandas/pyarrow 按目录读取。
+    已写出的结果就是检查点，load_done_ids() 用它们恢复进度。
+    write() 会在线程中调用(fsync 和 Parquet 编码可能要几十毫秒)，用锁保证多次写入不会交错。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.is_parquet = path.endswith(".parquet")
+        if not self.is_parquet and not path.endswith(".jsonl"):
+            raise ValueError(f"不支持的输出格式: {path}，只支持 .jsonl 和 .parquet")
+        if self.is_parquet:
+            os.makedirs(path, exist_ok=True)
+            self._part = len([p for p in os.listdir(path) if p.endswith(".parquet")])
+
+    def load_done_ids(self) -> Set[str]:
+        """读取已经完成的行ID"""
+        done = set()
+        if self.is_parquet:
+            import pyarrow.parquet as pq
+            for name in sorted(os.listdir(self.path)):
+                if name.endswith(".parquet"):
+                    table = pq.read_table(os.path.join(self.path, name), columns=["id"])
+                    done.update(table.column("id").to_pylist())
+        elif os.path.exists(self.path):
+            valid_bytes = 0
+            with open(self.path, "rb") as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise json.JSONDecodeError("缺少换行符", "", 0)
+                        done.add(json.loads(line)["id"])
+                    except (json.JSONDecodeError, KeyError, UnicodeDecodeError):
+                        # 上次崩溃时写了一半的行，截断掉
+                        break
+                    valid_bytes += len(line)
+            if valid_bytes < os.path.getsize(self.path):
+                with open(self.path, "r+b") as f:
+                    f.truncate(valid_bytes)
+        return done
+
+    def write(self, rows: List[Dict[str, Any]]):
+        if not rows:
+            return
+        with self._lock:
+            self._write(rows)
+
+    def _write(self, rows: List[Dict[str, Any]]):
+        if self.is_parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            part_path = os.path.join(self.path, f"part-{self._part:05d}.parquet")
+            # 先写临时文件再改名，避免崩溃时留下损坏的 part 文件
+            pq.write_table(pa.Table.from_pylist(rows), part_path + ".tmp")
+            os.replace(part_path + ".tmp", part_path)
+            self._part += 1
+        else:
+            with open(self.path, "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+
+# --- 5. 批处理主逻辑 ---
+async def run_batch(args) -> Dict[str, Any]:
+    analysis_chain, reply_chain = build_chains()
+    analysis_cost = CostTracker("qwen-max")
+    reply_cost = CostTracker("deepseek-r1-250120")
+
+    writer = ResultWriter(args.output)
+    done_ids = writer.load_done_ids()
+    if done_ids:
+        print(f"检测到已完成 {len(done_ids)} 行，将从断点继续。")
+
+    error_path = args.output.rstrip("/") + ".errors.jsonl"
+    buffer: List[Dict[str, Any]] = []
+    stats = {"ok": 0, "failed": 0, "skipped": 0}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    pending = set()
+    submitted = 0
+    start = time.perf_counter()
+    write_lock = asyncio.Lock()
+
+    async def flush():
+        # 在线程里写出并 fsync，事件循环上正在进行的请求不会被磁盘IO卡住；
+        # 锁保证按顺序一次只写一批，行在拿到锁之后才从缓冲区取出，被中断时仍留在缓冲区里由最后的写出处理
+        async with write_lock:
+            rows = buffer[:]
+            buffer.clear()
+            await asyncio.to_thread(writer.write, rows)
+
+    async def process(row_id: str, review: str):
+        try:
+            analysis = await analysis_chain.ainvoke(
+                {"review": review}, config={"callbacks": [analysis_cost]}
+            )
+            reply = await reply_chain.ainvoke(
+                analysis, config={"callbacks": [reply_cost]}
+            )
+            buffer.append({"id": row_id, "review": review, **analysis, "reply": reply})
+            stats["ok"] += 1
+        except Exception as e:
+            # 失败的行不写入结果文件，下次运行时会自动重试
+            stats["failed"] += 1
+            with open(error_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"id": row_id, "error": str(e)}, ensure_ascii=False) + "\n")
+        finally:
+            semaphore.release()
+
+        if len(buffer) >= args.flush_every:
+            await flush()
+            finished = stats["ok"] + stats["failed"]
+            elapsed = time.perf_counter() - start
+            print(f"已处理 {finished} 行，失败 {stats['failed']} 行，{finished / elapsed:.2f} rows/s")
+
+    try:
+        for row_id, review in iter_reviews(args.input, args.text_field, args.id_field):
+            if row_id in done_ids or not review.strip():
+                stats["skipped"] += 1
+                continue
+            if args.limit and submitted >= args.limit:
+                break
+            # 信号量在这里获取、在 process 结束时释放，读取速度会被限制在处理速度上，内存占用保持恒定
+            await semaphore.acquire()
+            task = asyncio.create_task(process(row_id, review))
+            submitted += 1
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.gather(*pending)
+    finally:
+        # 无论正常结束还是被 Ctrl+C 中断，都把缓冲区里已完成的行写出去
+        writer.write(buffer)
+        buffer.clear()
+
+    elapsed = time.perf_counter() - start
+    processed = stats["ok"]
+    total_cost = analysis_cost.cost + reply_cost.cost
+    return {
+        **stats,
+        "elapsed_s": round(elapsed, 2),
+        "rows_per_s": round(processed / elapsed, 3) if elapsed else 0.0,
+        "input_tokens": analysis_cost.input_tokens + reply_cost.input_tokens,
+        "output_tokens": analysis_cost.output_tokens + reply_cost.output_tokens,
+        "cost": round(total_cost, 4),
+        "cost_per_1k_rows": round(total_cost / processed * 1000, 4) if processed else 0.0,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="批量运行评论分析和自动回复链")
+    parser.add_argument("input", help="输入文件，.csv 或 .jsonl")
+    parser.add_argument("-o", "--output", required=True, help="输出文件，.jsonl 或 .parquet(目录)")
+    parser.add_argument("--text-field", default="review", help="评论文本所在的列名")
+    parser.add_argument("--id-field", default="id", help="行ID所在的列名，不存在时使用行号")
+    parser.add_argument("--concurrency", type=int, default=8, help="同时在飞的评论数量上限")
+    parser.add_argument("--flush-every", type=int, default=50, help="每处理多少行写出一次结果")
+    parser.add_argument("--limit", type=int, default=0, help="本次最多处理多少行，0 表示不限制")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        report = asyncio.run(run_batch(args))
+    except KeyboardInterrupt:
+        print("\n已中断，已完成的结果均已写出，重新运行即可从断点继续。")
+        sys.exit(130)
+    print("\n--- 批处理完成 ---")
+    print(f"成功: {report['ok']} 行 | 失败: {report['failed']} 行 | 跳过: {report['skipped']} 行")
+    print(f"耗时: {report['elapsed_s']}s | 吞吐: {report['rows_per_s']} rows/s")
+    print(f"tokens: 输入 {report['input_tokens']} / 输出 {report['output_tokens']}")
+    print(f"估算花费: {report['cost']} 元 | 每千行: {report['cost_per_1k_rows']} 元")
@@ -1,11 +1,20 @@
 import os
+import re
+import json
+import time
+import queue
+import threading
+from typing import AsyncIterator, Iterator
 from dotenv import load_dotenv 
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_community.chat_models.tongyi import ChatTongyi
+from langchain_core.exceptions import OutputParserException
 from langchain_core.output_parsers import StrOutputParser
 from langchain.output_parsers import BooleanOutputParser,ResponseSchema,StructuredOutputParser
 from langchain_core.prompts import ChatPromptTemplate,PromptTemplate
+from langchain_core.runnables import RunnableGenerator, RunnableLambda
+from langchain_core.runnables.utils import AddableDict
 
 load_dotenv(override=True)
 
@@ -123,8 +132,6 @@ final_reply = overall_chain.invoke({"review": customer_review})
 print(final_reply)
 
 # 可以自定义一个chain去查看结果—————————————————————————————————————————————————————————————————————————————-
-from langchain_core.runnables import RunnableLambda
-
 # 自定义一个chain用于打印中间结果
 def debug_print(x):
     print("debug_print显示的用户评论提取json:",x)
@@ -134,4 +141,449 @@ debug_chain = RunnableLambda(debug_print)
 
 overall_chain = analysis_chain | debug_chain | reply_chain
 final_reply = overall_chain.invoke({"review": customer_review})
-print(final_reply)
\ No newline at end of file
+print(final_reply)
+
+# 流式结构化解析：字段一旦完整就立刻输出，下游链可以提前开始——————————————————————————————————————————————————————
+# StructuredOutputParser 必须等模型完整输出后才解析，reply_chain 也只能等它结束后再启动。
+# 下面的扫描器逐块读取模型输出，每当JSON对象中的某个顶层字段闭合(遇到逗号或右花括号)，就立即把这个字段输出。
+
+
+class JsonFieldScanner:
+    """增量扫描JSON文本，返回已经完整的顶层字段"""
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0            # 下一个待扫描字符的位置
+        self.depth = 0          # 当前嵌套深度，1 表示处于顶层对象内部
+        self.in_string = False
+        self.escape = False
+        self.field_start = None  # 当前顶层字段在buffer中的起始位置
+        self.finished = False
+
+    def feed(self, text: str) -> list:
+        self.buffer += text
+        fields = []
+        while self.pos < len(self.buffer) and not self.finished:
+            ch = self.buffer[self.pos]
+            if self.depth == 0:
+                # 跳过 ```json 之类的前缀，直到遇到对象的左花括号
+                if ch == "{":
+                    self.depth = 1
+                    self.field_start = self.pos + 1
+            elif self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    fields.extend(self._close_field())
+                    self.finished = True
+            elif ch == "," and self.depth == 1:
+                fields.extend(self._close_field())
+                self.field_start = self.pos + 1
+            self.pos += 1
+        return fields
+
+    def _close_field(self) -> list:
+        segment = self.buffer[self.field_start:self.pos].strip()
+        if not segment:
+            return []
+        try:
+            return list(json.loads("{" + segment + "}").items())
+        except json.JSONDecodeError:
+            # 字段本身不合法时交给最终的兜底解析处理
+            return []
+
+
+def _chunk_text(chunk) -> str:
+    return chunk if isinstance(chunk, str) else chunk.content
+
+
+def _fallback_fields(text: str, emitted: dict) -> dict:
+    """流式扫描没拿到全部字段时，用原来的阻塞解析器兜底，只补齐缺失的字段"""
+    try:
+        parsed = output_parser.parse(text)
+    except OutputParserException:
+        # 模型确实漏掉了某个字段，已经输出的字段照常使用，缺失的由下游补默认值
+        return {}
+    return {k: v for k, v in parsed.items() if k not in emitted}
+
+
+def stream_fields(chunks: Iterator) -> Iterator[AddableDict]:
+    scanner, text, emitted = JsonFieldScanner(), "", {}
+    for chunk in chunks:
+        piece = _chunk_text(chunk)
+        text += piece
+        for key, value in scanner.feed(piece):
+            emitted[key] = value
+            yield AddableDict({key: value})
+    if len(emitted) < len(response_schemas):
+        missing = _fallback_fields(text, emitted)
+        if missing:
+            yield AddableDict(missing)
+
+
+async def astream_fields(chunks: AsyncIterator) -> AsyncIterator[AddableDict]:
+    scanner, text, emitted = JsonFieldScanner(), "", {}
+    async for chunk in chunks:
+        piece = _chunk_text(chunk)
+        text += piece
+        for key, value in scanner.feed(piece):
+            emitted[key] = value
+            yield AddableDict({key: value})
+    if len(emitted) < len(response_schemas):
+        missing = _fallback_fields(text, emitted)
+        if missing:
+            yield AddableDict(missing)
+
+
+# 每完成一个字段就输出一个只含该字段的字典；invoke 时这些字典会被合并成和 output_parser 相同的结果
+streaming_output_parser = RunnableGenerator(stream_fields, astream_fields)
+streaming_analysis_chain = prompt | chatQwen | streaming_output_parser
+
+REPLY_FIELDS = ("sentiment", "summary", "suggested_action")
+# 模型漏掉某个字段时用这些值补齐，否则 reply_chain 的提示词缺少变量会抛 KeyError
+REPLY_FIELD_DEFAULTS = {"sentiment": "neutral", "summary": "未提供", "suggested_action": "联系用户了解具体情况"}
+POSITIVE_REPLY = "非常感谢您的支持与认可！您的满意是我们前进的动力，期待继续为您提供优质的产品和服务。"
+
+
+def build_early_reply(short_circuit_positive: bool = False):
+    """
+    构造一个消费字段流的回复环节：
+    1. 三个字段一凑齐就启动 reply_chain，不再等分析模型输出结尾的 ``` 等剩余内容。
+    2. short_circuit_positive=True 时，情感一旦判定为 positive，直接返回固定的感谢回复，
+       并停止读取上游流，分析模型剩下的输出和回复模型的调用都省掉了。
+    """
+    def _should_short_circuit(fields: dict) -> bool:
+        return short_circuit_positive and str(fields.get("sentiment", "")).lower() == "positive"
+
+    def early_reply(field_stream: Iterator[dict]) -> Iterator[str]:
+        fields = {}
+        for part in field_stream:
+            fields.update(part)
+            if _should_short_circuit(fields):
+                yield POSITIVE_REPLY
+                return
+            if all(k in fields for k in REPLY_FIELDS):
+                break
+        yield from reply_chain.stream({**REPLY_FIELD_DEFAULTS, **fields})
+
+    async def aearly_reply(field_stream: AsyncIterator[dict]) -> AsyncIterator[str]:
+        fields = {}
+        async for part in field_stream:
+            fields.update(part)
+            if _should_short_circuit(fields):
+                yield POSITIVE_REPLY
+                return
+            if all(k in fields for k in REPLY_FIELDS):
+                break
+        async for token in reply_chain.astream({**REPLY_FIELD_DEFAULTS, **fields}):
+            yield token
+
+    return RunnableGenerator(early_reply, aearly_reply)
+
+
+streaming_overall_chain = streaming_analysis_chain | build_early_reply()
+short_circuit_overall_chain = streaming_analysis_chain | build_early_reply(short_circuit_positive=True)
+
+
+def measure_latency(chain, inputs: dict, runs: int = 3) -> dict:
+    """测量一条链的首个回复token延迟(TTFT)和总耗时，取多次运行的平均值"""
+    ttft, total = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        first = None
+        for _chunk in chain.stream(inputs):
+            if first is None:
+                first = time.perf_counter() - start
+        total.append(time.perf_counter() - start)
+        ttft.append(first if first is not None else total[-1])
+    return {"ttft_s": round(sum(ttft) / runs, 3), "total_s": round(sum(total) / runs, 3)}
+
+
+# 原来的 overall_chain 中 output_parser 是阻塞解析，stream 时首个token要等两个模型都开始输出后才出现
+blocking_chain = analysis_chain | reply_chain
+
+
+# 请求打包：把多条短句合并进一个请求判断语病——————————————————————————————————————————————————————————————————
+# prompt_qa_chain 每个句子单独发一次请求，只为拿回一个 yes/no，大量句子时请求开销远大于有效内容。
+# 打包模式把 N 个句子编号后放进同一个提示词，让模型返回一个按编号排列的JSON数组；
+# 打包结果解析失败或缺少某些编号时，只对缺失的句子退回到逐条调用 prompt_qa_chain。
+packed_prompt_template = ChatPromptTemplate([
+    ("system", "你是一个中文语法专家，请逐条判断用户提供的句子是否有语病。"),
+    ("user", "下面是带编号的句子：\n{numbered_sentences}\n"
+             "请按编号逐条判断，只返回一个JSON数组，不要其他说明。"
+             "数组元素形如 {{\"id\": 编号, \"verdict\": \"yes\"}}，yes 表示有语病，no 表示没有语病。"
+             "一共 {count} 条，不要遗漏任何编号。")
+])
+packed_qa_chain = packed_prompt_template | chatARK | StrOutputParser()
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：中文大约一个字一个token，其它字符大约四个一个token"""
+    cjk = len(re.findall(r"[一-鿿]", text))
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+def make_packs(sentences: list, batch_size: int, token_budget: int) -> list:
+    """按条数上限和token预算把句子切分成若干组，返回每组句子的下标列表"""
+    packs, current, current_tokens = [], [], 0
+    for i, sentence in enumerate(sentences):
+        # 每个编号槽位和对应的答案大约还要额外占用十几个token
+        tokens = estimate_tokens(sentence) + 16
+        if current and (len(current) >= batch_size or current_tokens + tokens > token_budget):
+            packs.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        packs.append(current)
+    return packs
+
+
+def parse_packed_verdicts(text: str, count: int) -> dict:
+    """解析打包返回的JSON数组，返回 {编号: 是否有语病}，只保留 1..count 范围内能识别的答案"""
+    match = re.search(r"\[.*\]", text, re.S)
+    if not match:
+        raise ValueError(f"打包结果中找不到JSON数组: {text}")
+    verdicts = {}
+    for item in json.loads(match.group(0)):
+        verdict = str(item.get("verdict", "")).strip().lower()
+        if verdict in ("yes", "true", "是"):
+            value = True
+        elif verdict in ("no", "false", "否"):
+            value = False
+        else:
+            continue
+        try:
+            slot = int(item.get("id"))
+        except (TypeError, ValueError):
+            continue
+        if 1 <= slot <= count:
+            verdicts[slot] = value
+    return verdicts
+
+
+def packed_grammar_check(sentences: list, batch_size: int = 20, token_budget: int = 1500,
+                         max_concurrency: int = 4, stats: dict = None) -> list:
+    """
+    打包判断一组句子是否有语病，返回与输入顺序一致的布尔值列表；逐条调用也失败的句子返回对应的异常对象。
+    :param batch_size: 每个请求最多打包多少个句子
+    :param token_budget: 每个请求中句子部分的token预算，长句子会让一组里的句子变少
+    :param stats: 传入一个字典时，会记录打包请求数和退回逐条调用的句子数
+    """
+    packs = make_packs(sentences, batch_size, token_budget)
+    inputs = [{
+        "numbered_sentences": "\n".join(f"{slot}. {sentences[i]}" for slot, i in enumerate(pack, start=1)),
+        "count": len(pack),
+    } for pack in packs]
+    outputs = packed_qa_chain.batch(inputs, config={"max_concurrency": max_concurrency}, return_exceptions=True)
+
+    results, fallback = [None] * len(sentences), []
+    for pack, output in zip(packs, outputs):
+        try:
+            if isinstance(output, Exception):
+                raise output
+            verdicts = parse_packed_verdicts(output, len(pack))
+        except Exception as e:
+            print(f"打包结果解析失败，退回逐条调用: {e}")
+            verdicts = {}
+        for slot, i in enumerate(pack, start=1):
+            if slot in verdicts:
+                results[i] = verdicts[slot]
+            else:
+                fallback.append(i)
+
+    if fallback:
+        # 一条句子失败不影响其他句子
+        fallback_outputs = prompt_qa_chain.batch(
+            [sentences[i] for i in fallback], config={"max_concurrency": max_concurrency}, return_exceptions=True
+        )
+        for i, value in zip(fallback, fallback_outputs):
+            results[i] = value
+
+    if stats is not None:
+        stats["requests"] = len(packs) + len(fallback)
+        stats["fallback"] = len(fallback)
+        stats["failed"] = sum(isinstance(r, Exception) for r in results)
+    return results
+
+
+def compare_packing(labeled: list, batch_size: int = 20, token_budget: int = 1500, max_concurrency: int = 4):
+    """对比逐条调用和打包调用的吞吐与准确率，labeled 为 (句子, 是否有语病) 列表"""
+    sentences = [s for s, _ in labeled]
+    labels = [label for _, label in labeled]
+
+    def accuracy(predictions):
+        return sum(p == label for p, label in zip(predictions, labels)) / len(labels)
+
+    start = time.perf_counter()
+    unpacked = prompt_qa_chain.batch(sentences, config={"max_concurrency": max_concurrency}, return_exceptions=True)
+    unpacked_time = time.perf_counter() - start
+
+    stats = {}
+    start = time.perf_counter()
+    packed = packed_grammar_check(sentences, batch_size, token_budget, max_concurrency, stats)
+    packed_time = time.perf_counter() - start
+
+    print(f"逐条调用: {len(sentences)} 个请求, {len(sentences) / unpacked_time:.2f} 句/秒, 准确率 {accuracy(unpacked):.2%}")
+    print(f"打包调用: {stats['requests']} 个请求(其中 {stats['fallback']} 句退回逐条), "
+          f"{len(sentences) / packed_time:.2f} 句/秒, 准确率 {accuracy(packed):.2%}")
+
+
+# (句子, 是否有语病)
+grammar_samples = [
+    ("中试基地自去年立项以来，就坚持见设与着商‘同步走’的战略。", True),
+    ("通过这次活动，使我们受到了深刻的教育。", True),
+    ("他的写作水平明显改进了。", True),
+    ("能否保持良好的心态，是考试取得好成绩的关键。", True),
+    ("大约有三百人左右参加了这次会议。", True),
+    ("今天天气很好，我们一起去公园散步。", False),
+    ("这本书内容丰富，语言生动。", False),
+    ("经过大家的共同努力，问题终于得到了解决。", False),
+    ("他每天早上都坚持锻炼身体。", False),
+    ("老师耐心地解答了同学们提出的问题。", False),
+]
+
+
+# 流水线执行：每个阶段独立的线程池 + 有界队列——————————————————————————————————————————————————————————————————
+# overall_chain.batch 会把整条链交给同一个线程池，每个线程依次跑完分析和回复两个阶段，
+# 两个阶段的并发度只能一起调，也无法保证 Qwen 和火山引擎两边同时保持忙碌。
+# PipelineExecutor 为每个阶段单独开一组工作线程，阶段之间用有界队列连接：
+# 下游处理不过来时队列会被填满，上游自然阻塞(背压)，内存占用保持有界。
+_STAGE_DONE = object()
+
+
+class PipelineExecutor:
+    def __init__(self, stages: list, queue_size: int = 8):
+        """
+        :param stages: [(阶段名, runnable, 并发数), ...]，按执行顺序排列
+        :param queue_size: 阶段之间队列的最大长度
+        """
+        self.stages = stages
+        self.queue_size = queue_size
+        self.busy_seconds = {name: 0.0 for name, _, _ in stages}
+
+    def _worker(self, index, runnable, in_queue, out_queue, remaining, lock):
+        name = self.stages[index][0]
+        while True:
+            item = in_queue.get()
+            if item is _STAGE_DONE:
+                break
+            seq, value = item
+            # 上游阶段已经失败的条目直接往下传，不再调用后面的阶段
+            if not isinstance(value, Exception):
+                start = time.perf_counter()
+                try:
+                    value = runnable.invoke(value)
+                except Exception as e:
+                    value = e
+                with lock:
+                    self.busy_seconds[name] += time.perf_counter() - start
+            out_queue.put((seq, value))
+        # 本阶段最后一个退出的线程负责通知下游阶段结束
+        with lock:
+            remaining[index] -= 1
+            last = remaining[index] == 0
+        if last:
+            next_workers = self.stages[index + 1][2] if index + 1 < len(self.stages) else 1
+            for _ in range(next_workers):
+                out_queue.put(_STAGE_DONE)
+
+    def run(self, inputs) -> list:
+        """按输入顺序返回每条输入的最终结果，失败的条目返回对应的异常对象"""
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        # 最后一个队列只用于收集结果，不设上限，避免结果收集成为瓶颈
+        queues.append(queue.Queue())
+        remaining = [concurrency for _, _, concurrency in self.stages]
+        lock = threading.Lock()
+
+        threads = []
+        for index, (_, runnable, concurrency) in enumerate(self.stages):
+            for _ in range(concurrency):
+                t = threading.Thread(
+                    target=self._worker,
+                    args=(index, runnable, queues[index], queues[index + 1], remaining, lock),
+                    daemon=True,
+                )
+                t.start()
+                threads.append(t)
+
+        feed_error = []
+
+        def feed():
+            try:
+                for seq, value in enumerate(inputs):
+                    queues[0].put((seq, value))  # 队列满时在这里阻塞
+            except BaseException as e:
+                # 例如输入迭代器读取失败；记录下来由 run() 重新抛出
+                feed_error.append(e)
+            finally:
+                # 无论是否出错都要通知各阶段结束，否则工作线程和 run() 会一直等待
+                for _ in range(self.stages[0][2]):
+                    queues[0].put(_STAGE_DONE)
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+
+        results = {}
+        while True:
+            item = queues[-1].get()
+            if item is _STAGE_DONE:
+                break
+            seq, value = item
+            results[seq] = value
+        feeder.join()
+        if feed_error:
+            raise feed_error[0]
+        return [results[seq] for seq in sorted(results)]
+
+
+def compare_pipeline(reviews: list, concurrency: int = 4):
+    """对比 overall_chain.batch 与按阶段流水线执行的吞吐"""
+    inputs = [{"review": review} for review in reviews]
+
+    start = time.perf_counter()
+    overall_chain.batch(inputs, config={"max_concurrency": concurrency}, return_exceptions=True)
+    batch_time = time.perf_counter() - start
+
+    pipeline = PipelineExecutor([
+        ("analysis", analysis_chain | debug_chain, concurrency),  # Qwen
+        ("reply", reply_chain, concurrency),                      # 火山引擎
+    ])
+    start = time.perf_counter()
+    pipeline.run(inputs)
+    pipeline_time = time.perf_counter() - start
+
+    print(f"Runnable.batch: {len(inputs) / batch_time:.2f} 条/秒, 耗时 {batch_time:.2f}s")
+    print(f"流水线执行: {len(inputs) / pipeline_time:.2f} 条/秒, 耗时 {pipeline_time:.2f}s, "
+          f"各阶段累计忙碌时间: {pipeline.busy_seconds}")
+
+
+# 文件中唯一的入口：下面的对比每项都要多次调用模型，只在直接运行本文件时执行，被其他脚本导入时不运行
+if __name__ == "__main__":
+    for name, review in [("消极评论", customer_review), ("积极评论", "这款新出的智能手表太棒了！电池续航能力超出了我的预期，能用整整三天。")]:
+        print(f"\n--- 延迟对比({name}) ---")
+        print("阻塞解析:", measure_latency(blocking_chain, {"review": review}))
+        print("流式解析:", measure_latency(streaming_overall_chain, {"review": review}))
+        print("流式解析+积极短路:", measure_latency(short_circuit_overall_chain, {"review": review}))
+
+    compare_packing(grammar_samples, batch_size=5)
+
+    compare_pipeline([
+        "我上周买的你们的‘星辰Pro’智能手表，用了没几天电池就不行了，一天都撑不住，太让人失望了。",
+        "这款新出的智能手表太棒了！电池续航能力超出了我的预期，能用整整三天。",
+        "表带做工一般，戴久了有点硌手，不过功能还算齐全。",
+        "客服响应很快，帮我解决了蓝牙连接不上的问题，点赞。",
+        "快递太慢了，等了一个星期才到，包装还有破损。",
+        "心率监测不准，跑步时经常显示异常数值。",
+        "屏幕很清晰，阳光下也能看清楚，很满意。",
+        "价格有点贵，但是整体体验不错。",
+    ])
@@ -7,18 +7,23 @@ LastEditors: Starry 1018485883@qq.com
 LastEditTime: 2025-07-18 18:43:37
 '''
 import os
-import requests
-import json
-from langchain_core.tools import tool
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
 from langchain_openai import ChatOpenAI
 from langchain_core.runnables import RunnableLambda
-from langchain_core.messages import SystemMessage
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, ToolMessage
 from langchain_core.prompts import ChatPromptTemplate,PromptTemplate
 from langchain_core.output_parsers.openai_tools import JsonOutputKeyToolsParser
 from langchain_core.output_parsers import StrOutputParser
 from langchain_community.tools.tavily_search import TavilySearchResults
 from dotenv import load_dotenv
 
+from search_cache import CachedSearchTool
+from weather_tool import get_weather, get_weather_batch, weather_cache
+
 load_dotenv(override=True)
 
 ARK_API_KEY = os.getenv("ARK_API_KEY")
@@ -41,33 +46,6 @@ chatModel = ChatOpenAI(
 
 debug_node = RunnableLambda(print_chain_out)
 
-@tool
-def get_weather(loc):
-    """
-    查询即时天气函数
-    :param loc: 必要参数，字符串类型，用于表示查询天气的具体城市名称，\
-    注意，中国的城市需要用对应城市的英文名称代替，例如如果需要查询北京市天气，则loc参数需要输入'Beijing'；
-    :return：OpenWeather API查询即时天气的结果，具体URL请求地址为：https://api.openweathermap.org/data/2.5/weather\
-    返回结果对象类型为解析之后的JSON格式对象，并用字符串形式进行表示，其中包含了全部重要的天气信息
-    """
-    # Step 1.构建请求
-    url = "https://api.openweathermap.org/data/2.5/weather"
-
-    # Step 2.设置查询参数
-    params = {
-        "q": loc,               
-        "appid": os.getenv("OPENWEATHER_API_KEY"),    # 输入API key
-        "units": "metric",            # 使用摄氏度而不是华氏度
-        "lang":"zh_cn"                # 输出语言为简体中文
-    }
-
-    # Step 3.发送GET请求
-    response = requests.get(url, params=params)
-    
-    # Step 4.解析响应
-    data = response.json()
-    return json.dumps(data)
-
 # 将自定义的python函数通过bind_tools绑定到大模型中
 tools = [get_weather]
 llm_with_tools = chatModel.bind_tools(tools)
@@ -100,6 +78,144 @@ overall_chain = query_weather_chain | response_chain
 
 print(overall_chain.invoke("请问今天南京的天气怎么样？"))
 
+# 批量查询多个城市的天气：同一批次里的城市并发请求，10分钟内查过的城市直接命中缓存
+print(get_weather_batch.invoke({"locs": ["Beijing", "Shanghai", "Nanjing"]}))
+
+# 并发执行模型返回的全部工具调用————————————————————————————————————————————————————————————————————————————————
+# 上面的链用了 first_tool_only=True，模型同时要北京和上海的天气时只会执行第一个调用。
+# 下面的调度器会把 AIMessage 中的所有 tool_calls 同时提交到线程池(或用 asyncio 并发)执行，
+# 每个工具有自己的超时时间，结果按 tool_calls 的原始顺序以 ToolMessage 的形式返回给模型。
+tool_pool = ThreadPoolExecutor(max_workers=8)
+
+
+def _tool_error_message(call: dict, error: str) -> ToolMessage:
+    return ToolMessage(content=error, tool_call_id=call["id"], name=call["name"], status="error")
+
+
+def build_tool_dispatcher(tools: list, timeouts: dict = None, default_timeout: float = 10.0, pool=None,
+                          queue_timeout: float = 60.0):
+    """
+    构建一个工具调度Runnable：输入 AIMessage，输出与 tool_calls 一一对应的 ToolMessage 列表。
+    :param timeouts: {工具名: 超时秒数}，未配置的工具使用 default_timeout
+    :param pool: 同步调用时使用的线程池，传入单线程的线程池即可退化为顺序执行
+    :param queue_timeout: 调用在线程池中排队等待的最长时间；排队的时间不计入工具自己的超时
+    """
+    tools_by_name = {t.name: t for t in tools}
+    timeouts = timeouts or {}
+    pool = pool or tool_pool
+
+    def submit(selected, call):
+        # began 在工具真正开始执行时才被设置，超时从这一刻开始计算
+        began = threading.Event()
+
+        def run():
+            began.at = time.monotonic()
+            began.set()
+            # 传入完整的 ToolCall 时，工具会直接返回带有 tool_call_id 的 ToolMessage
+            return selected.invoke(call)
+
+        return pool.submit(run), began
+
+    def dispatch(ai_message: AIMessage) -> list:
+        submitted = []
+        for call in ai_message.tool_calls:
+            selected = tools_by_name.get(call["name"])
+            submitted.append(submit(selected, call) if selected else None)
+
+        messages = []
+        for call, item in zip(ai_message.tool_calls, submitted):
+            if item is None:
+                messages.append(_tool_error_message(call, f"未知的工具: {call['name']}"))
+                continue
+            future, began = item
+            try:
+                # 线程池忙时调用会先排队，排队的时间不算在工具头上
+                if not began.wait(queue_timeout):
+                    raise FutureTimeoutError()
+                remaining = timeouts.get(call["name"], default_timeout) - (time.monotonic() - began.at)
+                messages.append(future.result(timeout=max(remaining, 0)))
+            except FutureTimeoutError:
+                future.cancel()
+                messages.append(_tool_error_message(call, f"工具 {call['name']} 调用超时"))
+            except Exception as e:
+                messages.append(_tool_error_message(call, f"工具 {call['name']} 调用出错: {e}"))
+        return messages
+
+    async def adispatch(ai_message: AIMessage) -> list:
+        async def run(call):
+            selected = tools_by_name.get(call["name"])
+            if selected is None:
+                return _tool_error_message(call, f"未知的工具: {call['name']}")
+            try:
+                return await asyncio.wait_for(
+                    selected.ainvoke(call), timeout=timeouts.get(call["name"], default_timeout)
+                )
+            except asyncio.TimeoutError:
+                return _tool_error_message(call, f"工具 {call['name']} 调用超时")
+            except Exception as e:
+                return _tool_error_message(call, f"工具 {call['name']} 调用出错: {e}")
+
+        # gather 返回的顺序与传入顺序一致
+        return list(await asyncio.gather(*(run(call) for call in ai_message.tool_calls)))
+
+    return RunnableLambda(dispatch, afunc=adispatch)
+
+
+multi_tools = [get_weather]
+llm_with_multi_tools = chatModel.bind_tools(multi_tools)
+tool_dispatcher = build_tool_dispatcher(multi_tools, timeouts={"get_weather": 8})
+
+
+def answer_with_parallel_tools(question: str, dispatcher=tool_dispatcher, max_rounds: int = 3) -> str:
+    """让模型一次性发出全部工具调用，并发执行后再把所有结果交回给模型生成回答"""
+    messages = [
+        SystemMessage(content="你是一个天气助手，需要查询多个城市时，请在一次回复中同时发出所有工具调用。"),
+        HumanMessage(content=question),
+    ]
+    for _ in range(max_rounds):
+        ai_message = llm_with_multi_tools.invoke(messages)
+        messages.append(ai_message)
+        if not ai_message.tool_calls:
+            return ai_message.content
+        messages.extend(dispatcher.invoke(ai_message))
+    return chatModel.invoke(messages).content
+
+
+def benchmark_multi_city(question: str, cities: list, runs: int = 3):
+    """
+    对比顺序执行与并发执行工具调用的延迟，每次运行前清空天气缓存，保证每次都真实请求。
+    端到端延迟主要由模型的往返决定，所以先用一条固定的、包含全部城市工具调用的 AIMessage 单独测量工具调度本身。
+    """
+    sequential = build_tool_dispatcher(multi_tools, timeouts={"get_weather": 8}, pool=ThreadPoolExecutor(max_workers=1))
+    dispatchers = [("顺序执行", sequential), ("并发执行", tool_dispatcher)]
+    ai_message = AIMessage(content="", tool_calls=[
+        {"name": "get_weather", "args": {"loc": city}, "id": f"call_{i}"} for i, city in enumerate(cities)
+    ])
+    for name, dispatcher in dispatchers:
+        elapsed = []
+        for _ in range(runs):
+            weather_cache.clear()
+            start = time.perf_counter()
+            dispatcher.invoke(ai_message)
+            elapsed.append(time.perf_counter() - start)
+        print(f"{name}: {len(cities)} 个工具调用的平均调度耗时 {sum(elapsed) / runs:.2f}s")
+    for name, dispatcher in dispatchers:
+        elapsed = []
+        for _ in range(runs):
+            weather_cache.clear()
+            start = time.perf_counter()
+            answer = answer_with_parallel_tools(question, dispatcher)
+            elapsed.append(time.perf_counter() - start)
+        print(f"{name}: 平均端到端延迟 {sum(elapsed) / runs:.2f}s, 回答: {answer}")
+
+
+print(answer_with_parallel_tools("请问今天北京和上海的天气怎么样？"))
+benchmark_multi_city("请分别告诉我北京、上海、广州和深圳今天的天气。", ["Beijing", "Shanghai", "Guangzhou", "Shenzhen"])
+
 # 官方提供的工具,用于Tavily检索网页并返回结果
-search = TavilySearchResults(max_result=5)
-print(search.invoke("盘古大模型是造假么"))
\ No newline at end of file
+# CachedSearchTool 会把结果按规范化后的查询词缓存到本地SQLite，相同的查询不再重复消耗网络往返和调用额度
+search = CachedSearchTool(search_tool=TavilySearchResults(max_result=5))
+print(search.invoke("盘古大模型是造假么"))
+# 第二次查询只差了标点，会直接命中缓存；同一会话内已经返回过的网页也不会再返回一遍
+print(search.invoke("盘古大模型是造假么？"))
+print("搜索缓存统计：", search.metrics)
\ No newline at end of file
@@ -6,20 +6,35 @@ Date: 2025-07-22 00:06:16
 LastEditors: Starry 1018485883@qq.com
 LastEditTime: 2025-08-05 14:49:18
 '''
+import os
+import sys
 import json
 import time
-import os
+import queue
+import atexit
+import signal
+import asyncio
+import weakref
+import argparse
+import threading
 from dotenv import load_dotenv
-from typing import Dict, Any
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, Any, List, Optional
+from pydantic import BaseModel, Field, ValidationError, model_validator
 
 from langchain.prompts import ChatPromptTemplate
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_openai import ChatOpenAI
 # NEW: 导入Agent和工具相关模块
-from langchain.agents import create_openai_tools_agent, AgentExecutor
+from langchain.agents import create_openai_tools_agent
 from langchain_community.tools.tavily_search import TavilySearchResults
 from langchain.tools import tool
 from langchain import hub
 
+from search_cache import CachedSearchTool, normalize_query
+from tool_memo import ToolMemo, MemoizingAgentExecutor
+from token_usage import iter_token_usage
+
 
 # --- 环境准备 ---
 load_dotenv(override=True)
@@ -36,10 +51,12 @@ ARK_API_KEY = os.getenv("ARK_API_KEY")
 
 # NEW: 1. 搜索工具
 # TavilySearchResults是一个封装好的、易于使用的搜索工具
-search_tool = TavilySearchResults(max_results=3)
-search_tool.name = "web_search" # 给工具一个简单明确的名称
+# 外面再包一层 CachedSearchTool：相同的查询只请求一次(包括并发中的相同查询)，结果持久化缓存，
+# 缓存由所有辩论共享；每场辩论通过 search_tool.session() 得到自己的搜索会话，已经返回过的网页只在本场辩论内不再重复返回
+search_tool = CachedSearchTool(search_tool=TavilySearchResults(max_results=3), name="web_search") # 给工具一个简单明确的名称
 
 # NEW: 2. Markdown文件写入工具
+# DebateManager 现在通过后台记录器 TranscriptWriter 写日志(见下文)，这个工具保留给需要自己写Markdown的Agent使用
 @tool
 def save_to_markdown(filename: str, content: str) -> str:
     """
@@ -76,6 +93,60 @@ referee_template = """
 referee_prompt = ChatPromptTemplate.from_template(referee_template)
 
 
+# --- 结构化评分 ---
+# 原来裁判对每位辩手单独评分一次，返回的文本要先去掉 ```json 再 json.loads，分数有时是整数、
+# 有时是按中文键给出的字典，解析失败时这一段的分数就丢了。
+# 现在每轮双方都发言之后，裁判通过一次工具调用(function calling)同时为双方评分：
+# - 输出按 RoundScores 校验，每一项必须是1-5分的整数，理由不能为空；
+# - 校验失败时把错误和原始输出交还给裁判修正，最多 SCORE_REPAIR_ATTEMPTS 次，仍然失败再退回逐段评分。
+# REFEREE_SCORING=speech 或 --per-speech-scoring 使用原来的逐段评分，--bench-scoring 对比两种方式。
+SCORING_MODES = ("round", "speech")
+REFEREE_SCORING = os.getenv("REFEREE_SCORING", "round")
+SCORE_REPAIR_ATTEMPTS = 2
+ROUND_SCORE_TASK = "请同时为本轮正方和反方辩手的陈述评分，通过 RoundScores 工具返回。"
+
+
+class SpeechScore(BaseModel):
+    logic: int = Field(ge=1, le=5, description="逻辑清晰度(1-5分)：论点是否条理清晰，推理过程是否严谨")
+    evidence: int = Field(ge=1, le=5, description="论据支撑力(1-5分)：是否使用了有效的事实、数据或例子来支持观点")
+    delivery: int = Field(ge=1, le=5, description="说服力与表达(1-5分)：语言是否流畅，表达是否有力")
+    reasoning: str = Field(min_length=1, description="评分理由")
+
+    @property
+    def total(self) -> int:
+        return self.logic + self.evidence + self.delivery
+
+
+# 逐段评分时裁判按提示返回 {"score": 总分, "reasoning": ...}，score 也可能是按三项给出的分数
+SPEECH_SCORE_ITEMS = {"逻辑清晰度": "logic", "论据支撑力": "evidence", "说服力与表达": "delivery"}
+
+
+class SpeechVerdict(BaseModel):
+    """逐段评分的结果：总分为三项之和，分项评分按 SpeechScore 校验"""
+    score: int = Field(ge=3, le=15, description="总分(15分制)")
+    reasoning: str = Field(default="无理由", min_length=1, description="评分理由")
+
+    @model_validator(mode="before")
+    @classmethod
+    def _sum_items(cls, data: Any) -> Any:
+        if isinstance(data, dict) and isinstance(data.get("score"), dict):
+            items = {field: data["score"].get(name) for name, field in SPEECH_SCORE_ITEMS.items()}
+            score = SpeechScore(**items, reasoning=data.get("reasoning") or "无理由")
+            data = {**data, "score": score.total}
+        return data
+
+
+class RoundScores(BaseModel):
+    """一轮辩论中正反双方陈述的评分"""
+    pro: SpeechScore = Field(description="正方本轮陈述的评分")
+    con: SpeechScore = Field(description="反方本轮陈述的评分")
+
+
+def build_round_scorer(llm):
+    # include_raw=True：校验失败时拿到原始输出和错误信息，用来让裁判修正
+    return referee_prompt | llm.with_structured_output(RoundScores, method="function_calling", include_raw=True)
+
+
 # MODIFIED: 辩手的提示，增加了使用工具的指令
 # 注意：我们不再直接使用这个模板，而是将其中的核心指令思想融入到Agent的提示中
 # 这里保留它用于理解，实际使用的是下面的 `hub.pull` 的提示
@@ -101,30 +172,25 @@ debater_agent_prompt_template = """
 # --- 初始化LLM和Agent ---
 
 # LLM模型实例
-referee_llm = ChatOpenAI(
-    base_url="https://ark.cn-beijing.volces.com/api/v3",
-    api_key=ARK_API_KEY,
-    model="ep-m-20250719172710-9zfxx",
-    # streaming=True, # 在Agent模式下，流式输出处理更复杂，暂时关闭以简化
-)
-
-pro_llm = ChatOpenAI(
-    base_url="https://ark.cn-beijing.volces.com/api/v3",
-    api_key=ARK_API_KEY,
-    model="ep-m-20250723164632-ctnnr",
-    # streaming=True, # 在Agent模式下，流式输出处理更复杂，暂时关闭以简化
-)
-
-con_llm = ChatOpenAI(
-    base_url="https://ark.cn-beijing.volces.com/api/v3",
-    api_key=ARK_API_KEY,
-    model="ep-m-20250411184749-5qknb",
-    # streaming=True, # 在Agent模式下，流式输出处理更复杂，暂时关闭以简化
-)
+def build_llm(model: str, **kwargs) -> ChatOpenAI:
+    """按模型接入点创建LLM，锦标赛模式(6_debate_tournament.py)用它为每个对阵创建模型"""
+    return ChatOpenAI(
+        base_url="https://ark.cn-beijing.volces.com/api/v3",
+        api_key=ARK_API_KEY,
+        model=model,
+        # 不需要 streaming=True：通过 astream_events 运行时(6_debate_sse.py 直播)模型会自动以流式输出
+        **kwargs
+    )
+
+
+referee_llm = build_llm("ep-m-20250719172710-9zfxx")
+pro_llm = build_llm("ep-m-20250723164632-ctnnr")
+con_llm = build_llm("ep-m-20250411184749-5qknb")
 
 
 # 裁判Agent保持不变，因为它不需要使用工具
 referee_agent = referee_prompt | referee_llm
+round_scorer = build_round_scorer(referee_llm)
 
 # NEW: 创建能够使用搜索工具的辩手Agent
 # 辩手需要一个专门的Agent提示，我们从LangChain Hub拉取一个标准模板
@@ -132,35 +198,489 @@ referee_agent = referee_prompt | referee_llm
 agent_prompt = hub.pull("hwchase17/openai-tools-agent")
 
 # 为正反方辩手分别创建Agent执行器
-# 他们共享同一个LLM和提示模板，但可以使用自己的工具集（虽然这里工具集也相同）
+# 他们共享同一个提示模板，但可以使用自己的工具集（虽然这里工具集也相同）。
+# 执行器由 DebateManager 为每场辩论单独创建，工具是这场辩论的搜索会话
 debater_tools = [search_tool]
-pro_debater_agent = create_openai_tools_agent(pro_llm, debater_tools, agent_prompt)
-con_debater_agent = create_openai_tools_agent(con_llm, debater_tools, agent_prompt)
 
-pro_agent_executor = AgentExecutor(agent=pro_debater_agent, tools=debater_tools, verbose=True)
-con_agent_executor = AgentExecutor(agent=con_debater_agent, tools=debater_tools, verbose=True)
+# 设置 TOOL_MEMO_SCOPE=run 或 session 后，辩手用相同(规范化后)的关键词重复搜索时直接复用上一次的工具输出，
+# 连搜索缓存和网页去重都不用再经过；记录工具 save_to_markdown 有副作用，永远不缓存
+TOOL_MEMO_SCOPE = os.getenv("TOOL_MEMO_SCOPE")
+
+
+# 每场辩论一个 ToolMemo，scope=session 时缓存在整场辩论内有效
+def build_debater_tool_memo() -> Optional[ToolMemo]:
+    if not TOOL_MEMO_SCOPE:
+        return None
+    return ToolMemo(
+        purity={"web_search": True, "save_to_markdown": False},
+        canonicalizers={
+            "web_search": lambda tool_input: normalize_query(
+                tool_input.get("query", "") if isinstance(tool_input, dict) else str(tool_input))
+        },
+        # 搜索成功时返回结果列表，搜索服务出错时返回错误说明的文本
+        cacheable={"web_search": lambda observation: isinstance(observation, list)},
+        scope=TOOL_MEMO_SCOPE,
+    )
+
+
+def build_debater_executor(llm, verbose: bool = True, tools: list = debater_tools,
+                           tool_memo: Optional[ToolMemo] = None) -> MemoizingAgentExecutor:
+    debater_agent = create_openai_tools_agent(llm, tools, agent_prompt)
+    return MemoizingAgentExecutor(agent=debater_agent, tools=tools, verbose=verbose, tool_memo=tool_memo)
+
+
+default_debater_llms = {"pro": pro_llm, "con": con_llm}
 
 
 # MODIFIED: 增强的DebateManager
+# 原来的流程完全串行：正方发言 -> 裁判评分 -> sleep(2) -> 反方发言 -> 裁判评分 -> sleep(1)，大部分时间都在等待。
+# 现在去掉了固定的 sleep，并提供异步调度(arun_debate)：
+# 1. 双方立场确定后，立即并行预取双方开场的搜索结果，反方的搜索在正方发言时就已经完成。
+# 2. 裁判的评分与下一位辩手的准备和发言同时进行(按轮评分时与下一轮正方的发言重叠)。
+# 3. 记录顺序保持确定：评分总是在下一段发言之前写入记录和历史；
+#    辩手看到的历史不包含上一段发言的评分(它可能还在进行中)，这一点与调度快慢无关。
+SIDE_NAMES = {"pro": "正方", "con": "反方"}
+
+# --- 结构化的辩论历史 ---
+# 原来的 history 是一个不断追加的字符串，每次调用裁判和辩手都要完整发送一遍，总的输入token随轮数平方增长。
+# 现在按发言保存为结构化的 Turn，每次调用只拿到一个有界的视图：
+# - 最近 HISTORY_WINDOW 段发言(包括对手最新的一段)原文；
+# - 更早的轮次使用每轮生成一次、缓存起来的摘要。
+# 摘要在一轮结束后生成，等到需要用它时早已完成，不会出现在关键路径上。
+HISTORY_WINDOW = 2
+
+summary_prompt = ChatPromptTemplate.from_template("""
+请用不超过150字概括下面这一轮辩论：双方各自的核心论点、引用的关键证据，以及裁判的评分。
+# 辩论总议题: {topic}
+# 第 {round_num} 轮:
+{turns}
+""")
+summary_chain = summary_prompt | referee_llm
+
+# --- 推测式搜索预取 ---
+# 辩手的每段发言通常是：一次LLM往返决定搜索词 -> 一次搜索往返 -> 再一次LLM往返写发言。
+# 开启预取(--prefetch N 或 DEBATE_PREFETCH_QUERIES=N)后，异步调度在上一位辩手还在发言时，
+# 根据议题、下一位辩手的立场和对手最新的论点生成 N 个可能的搜索词并提前搜索，结果放进下一位辩手的输入里。
+# 预取的搜索同样经过 CachedSearchTool，辩手之后再用相同的词搜索时直接命中缓存。
+# 第一轮沿用开场预取(用立场本身作为搜索词)；串行流程没有可以重叠的时间，不做预取。
+PREFETCH_QUERIES = int(os.getenv("DEBATE_PREFETCH_QUERIES", "0"))
+# 生成搜索词时只需要对手论点的开头部分，控制这次调用的输入
+PREFETCH_ARGUMENT_CHARS = 600
+
+query_prompt = ChatPromptTemplate.from_template("""
+你在为一位辩手准备资料。请给出这位辩手下一段发言最可能需要的 {n} 个网页搜索关键词，
+用来支撑己方立场并反驳对手最新的论点。只返回JSON字符串数组，例如 ["关键词1", "关键词2"]。
+# 辩论总议题: {topic}
+# 辩手的立场: {stance}
+# 对手最新的论点:
+{opponent_argument}
+""")
+query_chain = query_prompt | referee_llm
+
+
+@dataclass
+class Turn:
+    round_num: int
+    side: str
+    argument: str
+    score: Optional[int] = None
+    reasoning: str = ""
+
+    def render(self) -> str:
+        text = f"第{self.round_num}轮 - {SIDE_NAMES[self.side]}: {self.argument}\n"
+        if self.score is not None:
+            text += f"裁判评分({SIDE_NAMES[self.side]}): {self.score}/15, 理由: {self.reasoning}\n"
+        return text
+
+
+class DebateHistory:
+    def __init__(self, topic: str):
+        self.topic = topic
+        self.header = ""
+        self.turns: List[Turn] = []
+        self.summaries: Dict[int, str] = {}
+
+    def set_stances(self, pro_stance: str, con_stance: str):
+        self.header = f"# 辩论议题：{self.topic}\n\n**正方立场**: {pro_stance}\n**反方立场**: {con_stance}\n"
+
+    def add_argument(self, round_num: int, side: str, argument: str) -> Turn:
+        turn = Turn(round_num, side, argument)
+        self.turns.append(turn)
+        return turn
+
+    def round_turns(self, round_num: int) -> List[Turn]:
+        return [turn for turn in self.turns if turn.round_num == round_num]
+
+    def rounds_needing_summary(self, window: int = HISTORY_WINDOW) -> List[int]:
+        """生成视图之前必须已经有摘要的轮次"""
+        first_round = self.turns[-window].round_num if len(self.turns) >= window else 1
+        return [r for r in range(1, first_round) if r not in self.summaries]
+
+    def find(self, round_num: int, side: str) -> Optional[Turn]:
+        return next((t for t in self.turns if t.round_num == round_num and t.side == side), None)
+
+    def view(self, window: int = HISTORY_WINDOW, upto: Optional[int] = None) -> str:
+        """有界视图：更早轮次的摘要 + 最近 window 段发言的原文；upto 表示只看前 upto 段发言时的视图"""
+        turns = self.turns[:upto] if upto is not None else self.turns
+        recent = turns[-window:] if window else []
+        first_round = recent[0].round_num if recent else (turns[-1].round_num + 1 if turns else 1)
+        parts = [self.header]
+        for round_num in range(1, first_round):
+            if round_num in self.summaries:
+                parts.append(f"第{round_num}轮摘要: {self.summaries[round_num]}\n")
+            else:
+                # 摘要生成失败时退回原文，保证信息不丢失
+                parts.extend(turn.render() for turn in self.round_turns(round_num))
+        parts.extend(turn.render() for turn in recent)
+        return "\n".join(parts)
+
+    def __len__(self):
+        return len(self.turns)
+
+
+# --- 每次调用的token统计 ---
+class TokenUsage(BaseCallbackHandler):
+    """
+    统计一次逻辑调用(一段发言、一次评分、一次摘要)的token用量和耗时；一段发言可能包含多次LLM调用。
+    """
+    def __init__(self, call: str, round_num: int):
+        super().__init__()
+        self.call = call
+        self.round_num = round_num
+        self.llm_calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.seconds = 0.0  # 所有LLM请求的耗时之和
+        self._started: Dict[Any, float] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs: Any) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs: Any) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id=None, **kwargs: Any) -> None:
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            self.seconds += time.perf_counter() - started
+        for input_tokens, output_tokens in iter_token_usage(response):
+            self.llm_calls += 1
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"call": self.call, "round": self.round_num, "llm_calls": self.llm_calls, "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens, "seconds": round(self.seconds, 3)}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "TokenUsage":
+        usage = cls(data["call"], data["round"])
+        usage.llm_calls, usage.seconds = data["llm_calls"], data["seconds"]
+        usage.input_tokens, usage.output_tokens = data["input_tokens"], data["output_tokens"]
+        return usage
+
+
+class SearchRecorder(BaseCallbackHandler):
+    """记录辩手在一段发言中实际发出的搜索词，用来计算预取命中率"""
+
+    def __init__(self, tool_name: str):
+        self.tool_name = tool_name
+        self.queries: List[str] = []
+
+    def on_tool_start(self, serialized, input_str, *, inputs=None, **kwargs):
+        if (serialized or {}).get("name") == self.tool_name:
+            self.queries.append(inputs.get("query", input_str) if isinstance(inputs, dict) else input_str)
+
+
+# --- 后台记录器 ---
+# 原来每条记录都要经过 save_to_markdown 工具：打开文件、追加、关闭，而且都在辩论主流程的关键路径上。
+# TranscriptWriter 只把记录放进内存队列就立即返回，由后台线程批量写入：
+# - 攒够 batch_size 条或者等待超过 flush_interval 秒就写一次；
+# - fsync 策略：never(交给操作系统)、batch(每批写完都fsync，默认)、close(只在关闭时fsync)；
+# - Markdown 之外同时写一份结构化的 JSONL 记录，每行一个事件(立场、轮次开始、发言、评分、裁决)；
+# - 正常结束、未捕获的异常(atexit)和 SIGTERM(转换成 SystemExit)时都会把队列里的内容写完。
+#   SIGKILL 或断电无法处理，fsync=batch 时最多丢失最后一批。
+# - snapshot 把检查点放进同一个队列：先写完它之前的记录，再原子替换检查点文件，检查点永远不会领先于记录。
+FSYNC_POLICIES = ("never", "batch", "close")
+TRANSCRIPT_FSYNC = os.getenv("DEBATE_TRANSCRIPT_FSYNC", "batch")
+_FLUSH, _CLOSE, _SNAPSHOT = object(), object(), object()
+_open_writers: "weakref.WeakSet[TranscriptWriter]" = weakref.WeakSet()
+
+
+class TranscriptWriter:
+    def __init__(self, markdown_path: str, jsonl_path: Optional[str] = None, batch_size: int = 32,
+                 flush_interval: float = 0.5, fsync: str = "batch"):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync 只能是 {FSYNC_POLICIES} 之一，而不是 '{fsync}'")
+        self.markdown_path = markdown_path
+        self.jsonl_path = jsonl_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.error: Optional[BaseException] = None
+        # --resume 时记录追加到原来的JSONL，编号接着最后一条记录继续，而不是从 1 重新开始
+        self._seq, self._partial_line = self._last_seq(jsonl_path)
+        self._closed = False
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(target=self._worker, name=f"transcript-{markdown_path}", daemon=True)
+        self._thread.start()
+        _open_writers.add(self)
+
+    @staticmethod
+    def _last_seq(jsonl_path: Optional[str], tail_bytes: int = 65536) -> tuple:
+        """返回 (已有JSONL中最后一条完整记录的编号, 文件是否以写了一半的行结尾)，只读取文件末尾"""
+        if not jsonl_path or not os.path.exists(jsonl_path):
+            return 0, False
+        with open(jsonl_path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(f.tell() - tail_bytes, 0))
+            tail = f.read()
+        partial = bool(tail) and not tail.endswith(b"\n")
+        for line in reversed(tail.split(b"\n")):
+            try:
+                return int(json.loads(line)["seq"]), partial
+            except (ValueError, KeyError, TypeError):
+                # 空行、被截断的行(进程被杀时写了一半)或者读取范围开头不完整的行
+                continue
+        return 0, partial
+
+    def write(self, markdown: str, event: Dict[str, Any]):
+        """放进队列后立即返回"""
+        if self._closed:
+            raise RuntimeError(f"记录器 {self.markdown_path} 已经关闭")
+        self._seq += 1
+        self._queue.put((markdown, {"seq": self._seq, "ts": round(time.time(), 3), **event}))
+
+    def snapshot(self, path: str, state: Dict[str, Any]):
+        """state 在调用线程里序列化，之后的修改不影响已经排队的检查点"""
+        if self._closed:
+            raise RuntimeError(f"记录器 {self.markdown_path} 已经关闭")
+        self._queue.put((_SNAPSHOT, (path, json.dumps(state, ensure_ascii=False, separators=(",", ":")))))
+
+    def flush(self):
+        """阻塞到目前为止放进队列的记录全部写入文件"""
+        if self._closed:
+            return
+        done = threading.Event()
+        self._queue.put((_FLUSH, done))
+        # 后台线程意外退出(例如文件打不开)时不再有人设置 done，不能无限等下去
+        while not done.wait(0.2):
+            if not self._thread.is_alive():
+                return
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put((_CLOSE, None))
+        self._thread.join()
+        _open_writers.discard(self)
+
+    def _write_batch(self, files: list, batch: list):
+        markdown_file, jsonl_file = files
+        markdown_file.write("".join(markdown + "\n\n" for markdown, _ in batch))
+        markdown_file.flush()
+        if jsonl_file is not None:
+            # default=str：事件里混进无法序列化的对象(例如模型返回的消息)时写成字符串，而不是让整批记录失败
+            jsonl_file.write("".join(json.dumps(event, ensure_ascii=False, default=str) + "\n" for _, event in batch))
+            jsonl_file.flush()
+        if self.fsync == "batch":
+            for f in files:
+                if f is not None:
+                    os.fsync(f.fileno())
+
+    def _write_snapshot(self, path: str, data: str):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+            f.flush()
+            if self.fsync != "never":
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _worker(self):
+        try:
+            self._run_worker()
+        except BaseException as e:
+            self.error = e
+            print(f"[记录器] {self.markdown_path} 的后台写入线程异常退出: {e}")
+
+    def _run_worker(self):
+        files = [open(self.markdown_path, "a", encoding="utf-8"),
+                 open(self.jsonl_path, "a", encoding="utf-8") if self.jsonl_path else None]
+        if files[1] is not None and self._partial_line:
+            # 上次被中断时最后一行只写了一半，先换行，新的记录不要接在它后面
+            files[1].write("\n")
+        try:
+            while True:
+                item = self._queue.get()
+                batch, control = [], None
+                deadline = time.monotonic() + self.flush_interval
+                while True:
+                    if item[0] is _FLUSH or item[0] is _CLOSE or item[0] is _SNAPSHOT:
+                        control = item
+                        break
+                    batch.append(item)
+                    remaining = deadline - time.monotonic()
+                    if len(batch) >= self.batch_size or remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                if batch:
+                    try:
+                        self._write_batch(files, batch)
+                    except Exception as e:
+                        # 记录失败不应该中断辩论，保存错误，关闭时再报告
+                        self.error = e
+                        print(f"[记录器] 写入 {self.markdown_path} 失败: {e}")
+                if control is None:
+                    continue
+                if control[0] is _FLUSH:
+                    control[1].set()
+                    continue
+                if control[0] is _SNAPSHOT:
+                    try:
+                        self._write_snapshot(*control[1])
+                    except Exception as e:
+                        self.error = e
+                        print(f"[记录器] 写入检查点 {control[1][0]} 失败: {e}")
+                    continue
+                if self.fsync == "close":
+                    for f in files:
+                        if f is not None:
+                            os.fsync(f.fileno())
+                return
+        finally:
+            for f in files:
+                if f is not None:
+                    f.close()
+
+
+@atexit.register
+def _close_open_writers():
+    for writer in list(_open_writers):
+        writer.close()
+
+
+def install_signal_flush():
+    """把 SIGTERM 转换成 SystemExit，让 finally 和 atexit 有机会把记录写完；只能在主线程调用"""
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+
+def _format_search_results(results, max_chars: int = 300) -> str:
+    """把搜索结果整理成可以直接放进提示里的资料列表，搜索失败或全部重复时返回空字符串"""
+    if not isinstance(results, list):
+        return ""
+    lines = []
+    for item in results:
+        if isinstance(item, dict) and item.get("content"):
+            lines.append(f"- {item['content'][:max_chars]} (来源: {item.get('url', '未知')})")
+    return "\n".join(lines)
+
+
 class DebateManager:
-    def __init__(self, topic, rounds=4):
+    def __init__(self, topic, rounds=4, pro_llm=None, con_llm=None, referee_llm=None,
+                 markdown_filename: Optional[str] = None, verbose: bool = True, prefetch_queries: Optional[int] = None,
+                 scoring: Optional[str] = None, event_sink: Optional[Callable[[Dict[str, Any]], None]] = None):
+        """
+        不传模型时使用模块中默认的裁判和辩手；锦标赛模式为每个对阵传入不同的模型。
+        event_sink 不为空时，记录的每个事件以及辩手发言的token、工具调用和搜索结果都会实时交给它(6_debate_sse.py 直播)。
+        """
         self.topic = topic
         self.rounds = rounds
-        self.history = ""
+        # 每场辩论有自己的搜索会话和工具调用缓存：6_debate_sse.py 中同时进行的多场辩论共享搜索缓存，
+        # 但不会清掉彼此的网页去重记录，统计数据也分开
+        self.search = search_tool.session()
+        self.tool_memo = build_debater_tool_memo()
+        llms = {"pro": pro_llm, "con": con_llm}
+        self.executors = {
+            side: build_debater_executor(llms[side] if llms[side] is not None else default_debater_llms[side],
+                                         verbose, [self.search], self.tool_memo)
+            for side in ("pro", "con")
+        }
+        self.referee_agent = referee_prompt | referee_llm if referee_llm is not None else referee_agent
+        self.summary_chain = summary_prompt | referee_llm if referee_llm is not None else summary_chain
+        self.round_scorer = build_round_scorer(referee_llm) if referee_llm is not None else round_scorer
+        self.scoring = scoring or REFEREE_SCORING
+        if self.scoring not in SCORING_MODES:
+            raise ValueError(f"scoring 只能是 {SCORING_MODES} 之一，而不是 '{self.scoring}'")
+        self.query_chain = query_prompt | referee_llm if referee_llm is not None else query_chain
+        self.prefetch_queries = PREFETCH_QUERIES if prefetch_queries is None else prefetch_queries
+        self.winner: Optional[str] = None
+        self.history = DebateHistory(topic)
         self.scores = {"pro": 0, "con": 0}
         self.pro_stance = ""
         self.con_stance = ""
-        # NEW: 初始化Markdown文件名和写入工具
-        self.markdown_filename = f"debate_log_{time.strftime('%Y%m%d_%H%M%S')}.md"
-        self.markdown_writer = save_to_markdown
+        # NEW: 初始化Markdown文件名和后台记录器，结构化的JSONL记录与Markdown同名
+        self.markdown_filename = markdown_filename or f"debate_log_{time.strftime('%Y%m%d_%H%M%S')}.md"
+        self.transcript_filename = os.path.splitext(self.markdown_filename)[0] + ".jsonl"
+        self.transcript = TranscriptWriter(self.markdown_filename, self.transcript_filename, fsync=TRANSCRIPT_FSYNC)
+        self.checkpoint_filename = os.path.splitext(self.markdown_filename)[0] + ".checkpoint.json"
+        self.finished = False
+        # 搜索预取任务，键为 (轮次, 正反方)，只在异步调度中使用
+        self.research: Dict[tuple, "asyncio.Task"] = {}
+        # 每段发言的耗时、等待预取的时间、预取的搜索词和辩手实际发出的搜索
+        self.turn_log: List[Dict[str, Any]] = []
+        self.summary_tasks: Dict[int, "asyncio.Task"] = {}
+        # 与下一段发言同时进行的评分：(被评分的发言, 评分任务)
+        self.pending_score: Optional[tuple] = None
+        self.token_log: List[TokenUsage] = []
+        self.event_sink = event_sink
 
-    def _call_referee(self, task: str) -> Dict[str, Any]:
-        """调用裁判并解析其JSON输出"""
-        response = referee_agent.invoke({
+    # --- 检查点 ---
+    # 每完成一步(立场、发言、评分、摘要、裁决)就把状态写入一个紧凑的JSON文件，
+    # --resume 从最后完成的一步继续，已经完成的模型调用和搜索不会重复。
+    def _checkpoint(self):
+        state = {
+            "version": 1,
             "topic": self.topic,
-            "history": self.history,
-            "task": task
-        })
+            "rounds": self.rounds,
+            "pro_stance": self.pro_stance,
+            "con_stance": self.con_stance,
+            "scores": self.scores,
+            "winner": self.winner,
+            "finished": self.finished,
+            "turns": [asdict(turn) for turn in self.history.turns],
+            "summaries": self.history.summaries,
+            "calls": [usage.to_dict() for usage in self.token_log],
+            "markdown": self.markdown_filename,
+        }
+        # 和记录一起交给后台线程写入，不阻塞辩论流程
+        self.transcript.snapshot(self.checkpoint_filename, state)
+
+    @classmethod
+    def from_checkpoint(cls, path: str, **kwargs) -> "DebateManager":
+        """从检查点恢复，kwargs 与构造函数相同(例如传入模型)；记录继续追加到原来的文件"""
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        manager = cls(state["topic"], rounds=state["rounds"], markdown_filename=state["markdown"], **kwargs)
+        manager.pro_stance, manager.con_stance = state["pro_stance"], state["con_stance"]
+        if manager.pro_stance:
+            manager.history.set_stances(manager.pro_stance, manager.con_stance)
+        manager.history.turns = [Turn(**turn) for turn in state["turns"]]
+        manager.history.summaries = {int(r): summary for r, summary in state["summaries"].items()}
+        manager.scores, manager.winner, manager.finished = state["scores"], state["winner"], state["finished"]
+        manager.token_log = [TokenUsage.from_dict(call) for call in state["calls"]]
+        print(f"已从 {path} 恢复: 完成 {len(manager.history)} 段发言，得分 {manager.scores}")
+        return manager
+
+    def _unscored_turns(self) -> List[tuple]:
+        """已经发言但没有评分的段落(中断，或者裁判返回的JSON解析失败)，返回 (位置, 发言)"""
+        return [(i, turn) for i, turn in enumerate(self.history.turns) if turn.score is None]
+
+    def _unsummarized_rounds(self) -> List[int]:
+        return [r for r in range(1, self.rounds) if r not in self.history.summaries
+                and all(self.history.find(r, side) is not None for side in SIDE_NAMES)]
+
+    def _usage_config(self, call: str, round_num: int) -> Dict[str, Any]:
+        usage = TokenUsage(call, round_num)
+        self.token_log.append(usage)
+        return {"callbacks": [usage]}
+
+    @staticmethod
+    def _parse_referee(response) -> Dict[str, Any]:
         try:
             cleaned_response = response.content.strip().replace("```json", "").replace("```", "")
             return json.loads(cleaned_response)
@@ -168,55 +688,98 @@ class DebateManager:
             print(f"裁判返回了非JSON格式的回应或错误: {response}")
             return None
 
-    def _record(self, content: str):
-        """调用工具记录内容到Markdown文件"""
-        print(f"\n[记录员] 正在将内容写入 {self.markdown_filename}...")
-        self.markdown_writer.invoke({
-            "filename": self.markdown_filename,
-            "content": content
-        })
+    def _call_referee(self, task: str, call: str = "裁判", round_num: int = 0,
+                      history: Optional[str] = None) -> Dict[str, Any]:
+        """调用裁判并解析其JSON输出"""
+        response = self.referee_agent.invoke({
+            "topic": self.topic,
+            "history": self.history.view() if history is None else history,
+            "task": task
+        }, config=self._usage_config(call, round_num))
+        return self._parse_referee(response)
 
-    def setup_debate(self):
-        """让裁判生成正反方立场，并记录"""
-        print("--- 辩论准备阶段 ---")
-        print(f"裁判正在根据议题 '{self.topic}' 生成双方立场...")
-        
-        task = "请为本次辩论生成正反双方的立场。"
-        stances = self._call_referee(task)
-        
+    async def _acall_referee(self, task: str, history: str, call: str = "裁判", round_num: int = 0) -> Dict[str, Any]:
+        """异步调用裁判；history 在创建任务时确定，不受之后追加的内容影响"""
+        response = await self.referee_agent.ainvoke({
+            "topic": self.topic,
+            "history": history,
+            "task": task
+        }, config=self._usage_config(call, round_num))
+        return self._parse_referee(response)
+
+    @staticmethod
+    def _repair_task(result: Dict[str, Any]) -> str:
+        raw = result["raw"]
+        output = raw.tool_calls[0]["args"] if getattr(raw, "tool_calls", None) else getattr(raw, "content", raw)
+        error = result["parsing_error"] or "没有调用 RoundScores 工具"
+        return f"{ROUND_SCORE_TASK}\n你上一次的输出不符合要求: {error}\n上一次的输出: {output}\n请修正后重新给出双方完整的评分。"
+
+    def _score_round(self, round_num: int, history: Optional[str] = None) -> Optional[RoundScores]:
+        """一次调用为本轮双方评分，校验失败时让裁判修正；全部失败返回 None"""
+        inputs = {"topic": self.topic, "history": self.history.view() if history is None else history,
+                  "task": ROUND_SCORE_TASK}
+        for attempt in range(SCORE_REPAIR_ATTEMPTS + 1):
+            call = "裁判评分(本轮)" if attempt == 0 else "裁判评分(修正)"
+            result = self.round_scorer.invoke(inputs, config=self._usage_config(call, round_num))
+            if result["parsed"] is not None:
+                return result["parsed"]
+            inputs = {**inputs, "task": self._repair_task(result)}
+            print(f"裁判第{round_num}轮的评分不符合格式(第{attempt + 1}次): {result['parsing_error']}")
+        return None
+
+    async def _ascore_round(self, round_num: int, history: str) -> Optional[RoundScores]:
+        inputs = {"topic": self.topic, "history": history, "task": ROUND_SCORE_TASK}
+        for attempt in range(SCORE_REPAIR_ATTEMPTS + 1):
+            call = "裁判评分(本轮)" if attempt == 0 else "裁判评分(修正)"
+            result = await self.round_scorer.ainvoke(inputs, config=self._usage_config(call, round_num))
+            if result["parsed"] is not None:
+                return result["parsed"]
+            inputs = {**inputs, "task": self._repair_task(result)}
+            print(f"裁判第{round_num}轮的评分不符合格式(第{attempt + 1}次): {result['parsing_error']}")
+        return None
+
+    def _record(self, content: str, event: Dict[str, Any]):
+        """交给后台记录器写入Markdown和JSONL，不阻塞辩论流程"""
+        self.transcript.write(content, event)
+        self._emit(event)
+
+    def _emit(self, event: Dict[str, Any]):
+        if self.event_sink is not None:
+            self.event_sink(event)
+
+    def _apply_stances(self, stances: Dict[str, Any]):
         if stances and "pro_stance" in stances and "con_stance" in stances:
             self.pro_stance = stances["pro_stance"]
             self.con_stance = stances["con_stance"]
             
             # 构造初始历史和记录内容
-            header = f"# 辩论议题：{self.topic}\n\n"
-            pro_stance_md = f"**正方立场**: {self.pro_stance}\n"
-            con_stance_md = f"**反方立场**: {self.con_stance}\n"
-            
-            self.history = header + pro_stance_md + con_stance_md
-            self._record(self.history) # 首次记录
+            self.history.set_stances(self.pro_stance, self.con_stance)
+            self._record(self.history.header, {"type": "stances", "topic": self.topic,
+                                               "pro_stance": self.pro_stance, "con_stance": self.con_stance}) # 首次记录
 
             print(f"正方立场: {self.pro_stance}")
             print(f"反方立场: {self.con_stance}")
+            self._checkpoint()
         else:
             raise ValueError("无法从裁判处获得有效的辩题。")
 
-    # MODIFIED: 增强的DebateManager中的run_round方法
-    def run_round(self, round_num: int):
-        """
-        运行一轮辩论，并记录所有步骤。
-        此版本通过构建更具体的输入提示来指导Agent进行相关搜索。
-        """
-        round_header = f"## 第 {round_num} 轮辩论"
-        print(f"\n--- {round_header} ---")
-        self._record(round_header)
+    def setup_debate(self):
+        """让裁判生成正反方立场，并记录"""
+        print("--- 辩论准备阶段 ---")
+        print(f"裁判正在根据议题 '{self.topic}' 生成双方立场...")
+        self._apply_stances(self._call_referee("请为本次辩论生成正反双方的立场。", "生成立场"))
 
-        # --- 正方发言 ---
-        print("\n[正方准备发言...]")
-        
-        # MODIFIED: 创建一个高度具体的、包含所有上下文的输入提示
-        # 这是解决无关搜索问题的关键！我们明确告诉Agent它的角色、议题、立场，并给出搜索关键词的示例。
-        pro_input_prompt = f"""
+    async def asetup_debate(self):
+        print("--- 辩论准备阶段 ---")
+        print(f"裁判正在根据议题 '{self.topic}' 生成双方立场...")
+        self._apply_stances(await self._acall_referee("请为本次辩论生成正反双方的立场。", self.history.view(), "生成立场"))
+
+    # MODIFIED: 创建一个高度具体的、包含所有上下文的输入提示
+    # 这是解决无关搜索问题的关键！我们明确告诉Agent它的角色、议题、立场，并给出搜索关键词的示例。
+    # hub 上的 openai-tools-agent 提示模板没有 history 变量，所以历史视图直接放进 input 里。
+    def _speaker_input(self, side: str, research: str = "") -> str:
+        if side == "pro":
+            prompt = f"""
         现在轮到你作为正方发言。
         议题: "{self.topic}"
         你的立场是: "{self.pro_stance}"
@@ -228,42 +791,8 @@ class DebateManager:
 
         请开始你的思考和行动。
         """
-        
-        # MODIFIED: 调用Agent Executor时，传入这个全新的、信息丰富的input
-        # 我们不再需要单独传递 topic 和 stance，因为它们已经包含在 input 里了。
-        pro_response = pro_agent_executor.invoke({
-            "input": pro_input_prompt,
-            "history": self.history
-        })
-        pro_argument = pro_response['output']
-        print(f"\n[正方辩手]:\n{pro_argument}")
-        pro_record = f"### 正方发言\n\n{pro_argument}"
-        self._record(pro_record)
-        self.history += f"\n第{round_num}轮 - 正方: {pro_argument}\n"
-        
-        # 裁判为正方评分 (这部分逻辑不变)
-        pro_score_result = self._call_referee("请为刚才正方辩手的陈述评分。")
-        print(pro_score_result)
-        if pro_score_result:
-            score = pro_score_result.get('score', 0)
-            if isinstance(score, dict):
-                score = score['逻辑清晰度'] + score["论据支撑力"] + score["说服力与表达"]
-            else:
-                pass
-            reasoning = pro_score_result.get('reasoning', '无理由')
-            self.scores["pro"] += score
-            pro_score_md = f"#### 裁判点评 (正方)\n\n- **得分**: {score}/15\n- **理由**: {reasoning}\n"
-            print(f"\n[裁判点评-正方]:\n分数: {score}/15\n理由: {reasoning}\n")
-            self._record(pro_score_md)
-            self.history += f"裁判评分(正方): {score}/15, 理由: {reasoning}\n"
-
-        time.sleep(2) # 稍微暂停，让流程更清晰
-
-        # --- 反方发言 ---
-        print("\n[反方准备发言...]")
-        
-        # MODIFIED: 为反方也创建一个高度具体的输入提示
-        con_input_prompt = f"""
+        else:
+            prompt = f"""
         现在轮到你作为反方发言，进行反驳和陈述。
         议题: "{self.topic}"
         你的立场是: "{self.con_stance}"
@@ -276,34 +805,306 @@ class DebateManager:
 
         请开始你的思考和行动。
         """
-        
-        con_response = con_agent_executor.invoke({
-            "input": con_input_prompt,
-            "history": self.history
-        })
-        con_argument = con_response['output']
-        print(f"\n[反方辩手]:\n{con_argument}")
-        con_record = f"### 反方发言\n\n{con_argument}"
-        self._record(con_record)
-        self.history += f"\n第{round_num}轮 - 反方: {con_argument}\n"
-
-        # 裁判为反方评分 (这部分逻辑不变)
-        con_score_result = self._call_referee("请为刚才反方辩手的陈述评分。")
-        if con_score_result:
-            score = con_score_result.get('score', 0)
-            if isinstance(score, dict):
-                score = score['逻辑清晰度'] + score["论据支撑力"] + score["说服力与表达"]
-            else:
-                pass
-            reasoning = con_score_result.get('reasoning', '无理由')
-            self.scores["con"] += score
-            con_score_md = f"#### 裁判点评 (反方)\n\n- **得分**: {score}/15\n- **理由**: {reasoning}\n"
-            print(f"\n[裁判点评-反方]:\n分数: {score}/15\n理由: {reasoning}\n")
-            self._record(con_score_md)
-            self.history += f"裁判评分(反方): {score}/15, 理由: {reasoning}\n"
+        if research:
+            prompt += f"""
+        以下是已经为你预先检索到的资料，可以直接引用，不够时再调用 `web_search` 补充:
+{research}
+        """
+        if len(self.history):
+            prompt += f"""
+        # 辩论历史:
+{self.history.view()}
+        """
+        return prompt
 
-    def announce_winner(self):
-        """宣布最终结果并记录"""
+    def _record_argument(self, side: str, round_num: int, argument: str) -> Turn:
+        print(f"\n[{SIDE_NAMES[side]}辩手]:\n{argument}")
+        self._record(f"### {SIDE_NAMES[side]}发言\n\n{argument}",
+                     {"type": "argument", "round": round_num, "side": side, "content": argument})
+        turn = self.history.add_argument(round_num, side, argument)
+        self._checkpoint()
+        return turn
+
+    def _record_score(self, turn: Turn, score_result: Dict[str, Any]):
+        if score_result:
+            try:
+                verdict = SpeechVerdict.model_validate(score_result)
+            except ValidationError as e:
+                # 不计分，这段发言保持未评分，恢复时会重新评分
+                print(f"裁判评分不符合格式，本段发言暂不计分: {score_result}\n{e}")
+                return
+            score, reasoning = verdict.score, verdict.reasoning
+            self.scores[turn.side] += score
+            name = SIDE_NAMES[turn.side]
+            score_md = f"#### 裁判点评 ({name})\n\n- **得分**: {score}/15\n- **理由**: {reasoning}\n"
+            print(f"\n[裁判点评-{name}]:\n分数: {score}/15\n理由: {reasoning}\n")
+            self._record(score_md, {"type": "score", "round": turn.round_num, "side": turn.side,
+                                    "score": score, "reasoning": reasoning})
+            turn.score, turn.reasoning = score, reasoning
+            self._checkpoint()
+
+    def _summary_input(self, round_num: int) -> Dict[str, Any]:
+        turns = "\n".join(turn.render() for turn in self.history.round_turns(round_num))
+        return {"topic": self.topic, "round_num": round_num, "turns": turns}
+
+    def _summarize(self, round_num: int):
+        """一轮结束后生成这一轮的摘要，只生成一次"""
+        response = self.summary_chain.invoke(self._summary_input(round_num),
+                                        config=self._usage_config(f"第{round_num}轮摘要", round_num))
+        self.history.summaries[round_num] = response.content
+        self._checkpoint()
+
+    async def _asummarize(self, round_num: int):
+        try:
+            response = await self.summary_chain.ainvoke(self._summary_input(round_num),
+                                                   config=self._usage_config(f"第{round_num}轮摘要", round_num))
+            self.history.summaries[round_num] = response.content
+            self._checkpoint()
+        except Exception as e:
+            print(f"第{round_num}轮摘要生成失败，将使用原文: {e}")
+
+    async def _await_summaries(self):
+        """生成视图之前，等待视图需要的摘要任务完成"""
+        for round_num in self.history.rounds_needing_summary():
+            if round_num in self.summary_tasks:
+                await self.summary_tasks[round_num]
+
+    # MODIFIED: 增强的DebateManager中的run_round方法
+    def run_round(self, round_num: int):
+        """
+        串行运行一轮辩论，并记录所有步骤。
+        此版本通过构建更具体的输入提示来指导Agent进行相关搜索。
+        """
+        for side, executor in self.executors.items():
+            if self.history.find(round_num, side) is not None:
+                continue  # 从检查点恢复时已经完成的发言
+            if side == "pro":
+                self._record_round_start(round_num)
+            print(f"\n[{SIDE_NAMES[side]}准备发言...]")
+            # MODIFIED: 调用Agent Executor时，传入这个全新的、信息丰富的input
+            # 我们不再需要单独传递 topic 和 stance，因为它们已经包含在 input 里了。
+            response = executor.invoke({
+                "input": self._speaker_input(side)
+            }, config=self._usage_config(f"{SIDE_NAMES[side]}发言", round_num))
+            turn = self._record_argument(side, round_num, response['output'])
+            if self.scoring == "speech":
+                score_result = self._call_referee(f"请为刚才{SIDE_NAMES[side]}辩手的陈述评分。",
+                                                  f"裁判评分({SIDE_NAMES[side]})", round_num)
+                self._record_score(turn, score_result)
+        turns = self.history.round_turns(round_num)
+        if self.scoring == "round" and any(turn.score is None for turn in turns):
+            self._record_round_scores(turns, self._score_round(round_num))
+        if round_num < self.rounds and round_num not in self.history.summaries:
+            self._summarize(round_num)
+
+    def _record_round_start(self, round_num: int):
+        round_header = f"## 第 {round_num} 轮辩论"
+        print(f"\n--- {round_header} ---")
+        self._record(round_header, {"type": "round_start", "round": round_num})
+
+    def _score_speech(self, i: int, turn: Turn):
+        """逐段评分，裁判看到的是第 i 段发言刚结束时的历史视图"""
+        name = SIDE_NAMES[turn.side]
+        self._record_score(turn, self._call_referee(f"请为刚才{name}辩手的陈述评分。", f"裁判评分({name})",
+                                                    turn.round_num, history=self.history.view(upto=i + 1)))
+
+    async def _ascore_speech(self, i: int, turn: Turn):
+        name = SIDE_NAMES[turn.side]
+        self._record_score(turn, await self._acall_referee(f"请为刚才{name}辩手的陈述评分。", self.history.view(upto=i + 1),
+                                                           f"裁判评分({name})", turn.round_num))
+
+    def _apply_round_scores(self, turns: List[Turn], scores: RoundScores) -> List[Turn]:
+        """记录结构化评分，返回没有评上分、需要退回逐段评分的发言"""
+        unscored = [turn for turn in turns if turn.score is None]
+        if scores is None:
+            print("本轮评分多次修正仍不符合格式，退回逐段评分")
+            return unscored
+        for turn in unscored:
+            score = getattr(scores, turn.side)
+            self._record_score(turn, {"score": score.total, "reasoning": score.reasoning})
+        return []
+
+    def _record_round_scores(self, turns: List[Turn], scores: Optional[RoundScores]):
+        for turn in self._apply_round_scores(turns, scores):
+            self._score_speech(self.history.turns.index(turn), turn)
+
+    async def _arecord_round_scores(self, turns: List[Turn], scores: Optional[RoundScores]):
+        for turn in self._apply_round_scores(turns, scores):
+            await self._ascore_speech(self.history.turns.index(turn), turn)
+
+    def _rescore_rounds(self) -> List[int]:
+        """按轮评分时，恢复需要补评分的完整轮次；未完成的轮次等双方发言后照常评分"""
+        rounds = sorted({turn.round_num for _, turn in self._unscored_turns()})
+        return [r for r in rounds if len(self.history.round_turns(r)) == len(SIDE_NAMES)]
+
+    def _round_view(self, round_num: int) -> str:
+        """这一轮反方发言刚结束时的历史视图"""
+        return self.history.view(upto=self.history.turns.index(self.history.find(round_num, "con")) + 1)
+
+    def _rescore_pending(self):
+        """恢复时补上中断前没有完成的评分，裁判看到的是那段发言(那一轮)刚结束时的历史视图"""
+        if self.scoring == "round":
+            for round_num in self._rescore_rounds():
+                self._record_round_scores(self.history.round_turns(round_num),
+                                          self._score_round(round_num, self._round_view(round_num)))
+            return
+        for i, turn in self._unscored_turns():
+            self._score_speech(i, turn)
+
+    async def _arescore_pending(self):
+        if self.scoring == "round":
+            rounds = self._rescore_rounds()
+            results = await asyncio.gather(*(self._ascore_round(r, self._round_view(r)) for r in rounds))
+            for round_num, scores in zip(rounds, results):
+                await self._arecord_round_scores(self.history.round_turns(round_num), scores)
+            return
+        unscored = self._unscored_turns()
+        results = await asyncio.gather(*(
+            self._acall_referee(f"请为刚才{SIDE_NAMES[turn.side]}辩手的陈述评分。", self.history.view(upto=i + 1),
+                                f"裁判评分({SIDE_NAMES[turn.side]})", turn.round_num) for i, turn in unscored))
+        for (_, turn), score_result in zip(unscored, results):
+            self._record_score(turn, score_result)
+
+    async def _search_all(self, queries: List[str]) -> str:
+        results = await asyncio.gather(*(self.search.ainvoke({"query": q}) for q in queries), return_exceptions=True)
+        return "\n".join(text for text in (_format_search_results(r) for r in results) if text)
+
+    async def _prefetch_opening(self, side: str) -> Dict[str, Any]:
+        """用己方立场作为查询词预先搜索，结果放进第一轮发言的提示里"""
+        stance = self.pro_stance if side == "pro" else self.con_stance
+        queries = [f"{self.topic} {stance}"]
+        start = time.perf_counter()
+        try:
+            research = _format_search_results(await self.search.ainvoke({"query": queries[0]}))
+        except Exception as e:
+            print(f"[预取] {SIDE_NAMES[side]}开场搜索失败，由辩手自行搜索: {e}")
+            research = ""
+        return {"queries": queries, "research": research, "seconds": time.perf_counter() - start}
+
+    async def _generate_queries(self, side: str, round_num: int) -> List[str]:
+        stance = self.pro_stance if side == "pro" else self.con_stance
+        opponent = next((t for t in reversed(self.history.turns) if t.side != side), None)
+        response = await self.query_chain.ainvoke({
+            "n": self.prefetch_queries,
+            "topic": self.topic,
+            "stance": stance,
+            "opponent_argument": opponent.argument[:PREFETCH_ARGUMENT_CHARS] if opponent else "(对手还没有发言)",
+        }, config=self._usage_config(f"预取搜索词({SIDE_NAMES[side]})", round_num))
+        try:
+            queries = json.loads(response.content.strip().replace("```json", "").replace("```", ""))
+        except json.JSONDecodeError:
+            queries = None
+        if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+            print(f"[预取] 搜索词不是JSON数组，改用立场作为搜索词: {response.content}")
+            queries = [f"{self.topic} {stance}"]
+        return queries[:self.prefetch_queries]
+
+    async def _prefetch_speculative(self, side: str, round_num: int) -> Dict[str, Any]:
+        """在上一位辩手发言的同时运行：生成可能的搜索词并提前搜索"""
+        start = time.perf_counter()
+        try:
+            queries = await self._generate_queries(side, round_num)
+            research = await self._search_all(queries)
+        except Exception as e:
+            print(f"[预取] {SIDE_NAMES[side]}第{round_num}轮预取失败，由辩手自行搜索: {e}")
+            queries, research = [], ""
+        return {"queries": queries, "research": research, "seconds": time.perf_counter() - start}
+
+    def _schedule_prefetch(self, side: str, round_num: int):
+        """当前这位辩手开始发言时，为下一位辩手启动预取"""
+        next_side, next_round = ("con", round_num) if side == "pro" else ("pro", round_num + 1)
+        if (not self.prefetch_queries or next_round > self.rounds or (next_round, next_side) in self.research
+                or self.history.find(next_round, next_side) is not None):
+            return
+        self.research[(next_round, next_side)] = asyncio.create_task(
+            self._prefetch_speculative(next_side, next_round))
+
+    async def _aspeak(self, side: str, round_num: int) -> str:
+        print(f"\n[{SIDE_NAMES[side]}准备发言...]")
+        self._schedule_prefetch(side, round_num)
+        task = self.research.pop((round_num, side), None)
+        wait_start = time.perf_counter()
+        prefetch = await task if task is not None else None
+        wait = time.perf_counter() - wait_start
+        await self._await_summaries()
+        recorder = SearchRecorder(self.search.name)
+        config = self._usage_config(f"{SIDE_NAMES[side]}发言", round_num)
+        config["callbacks"].append(recorder)
+        start = time.perf_counter()
+        inputs = {"input": self._speaker_input(side, prefetch["research"] if prefetch else "")}
+        if self.event_sink is not None:
+            output = await self._astream_speech(side, round_num, inputs, config)
+        else:
+            output = (await self.executors[side].ainvoke(inputs, config=config))['output']
+        self.turn_log.append({"round": round_num, "side": side, "seconds": time.perf_counter() - start,
+                              "wait": wait, "prefetch": prefetch, "searches": recorder.queries})
+        return output
+
+    async def _astream_speech(self, side: str, round_num: int, inputs: Dict[str, Any], config: Dict[str, Any]) -> str:
+        """通过 astream_events 运行辩手，发言的token、工具调用和搜索结果一产生就交给 event_sink"""
+        where = {"round": round_num, "side": side}
+        self._emit({"type": "speech_start", **where})
+        output = ""
+        executor = self.executors[side]
+        # 只转发辩手自己的工具，CachedSearchTool 内部调用的搜索工具不算
+        tool_names = {t.name for t in executor.tools}
+        async for event in executor.astream_events(inputs, config=config, version="v2"):
+            kind = event["event"]
+            if kind == "on_chat_model_stream":
+                text = event["data"]["chunk"].content
+                if text and isinstance(text, str):
+                    self._emit({"type": "token", **where, "text": text})
+            elif kind == "on_tool_start" and event["name"] in tool_names:
+                self._emit({"type": "tool_call", **where, "tool": event["name"], "input": event["data"].get("input")})
+            elif kind == "on_tool_end" and event["name"] in tool_names:
+                result = event["data"].get("output")
+                result = getattr(result, "content", result)
+                text = _format_search_results(result) if isinstance(result, list) else str(result)[:1000]
+                self._emit({"type": "tool_result", **where, "tool": event["name"], "output": text})
+            elif kind == "on_chain_end" and not event["parent_ids"]:
+                output = event["data"]["output"]["output"]
+        return output
+
+    async def arun_rounds(self):
+        """
+        裁判评分与下一段发言同时进行；评分在下一段发言写入之前落盘。
+        按轮评分时，双方发言结束后一次评完，与下一轮正方的发言重叠；逐段评分时，每段发言之后都评一次。
+        """
+        for round_num in range(1, self.rounds + 1):
+            for side in ("pro", "con"):
+                if self.history.find(round_num, side) is not None:
+                    continue
+                argument = await self._aspeak(side, round_num)
+                if self.pending_score is not None:
+                    await self._finish_score(*self.pending_score)
+                    self.pending_score = None
+                if side == "pro":
+                    self._record_round_start(round_num)
+                turn = self._record_argument(side, round_num, argument)
+                await self._await_summaries()
+                if self.scoring == "speech":
+                    task = f"请为刚才{SIDE_NAMES[side]}辩手的陈述评分。"
+                    self.pending_score = ([turn], asyncio.create_task(self._acall_referee(
+                        task, self.history.view(), f"裁判评分({SIDE_NAMES[side]})", round_num)))
+                elif side == "con":
+                    self.pending_score = (self.history.round_turns(round_num), asyncio.create_task(
+                        self._ascore_round(round_num, self.history.view())))
+        if self.pending_score is not None:
+            await self._finish_score(*self.pending_score)
+            self.pending_score = None
+
+    async def _finish_score(self, turns: List[Turn], score_task: "asyncio.Task"):
+        if self.scoring == "speech":
+            self._record_score(turns[0], await score_task)
+        else:
+            await self._arecord_round_scores(turns, await score_task)
+        last = turns[-1]
+        # 最后一轮的摘要用不上，不再生成
+        if last.side == "con" and last.round_num < self.rounds:
+            # 一轮结束，后台生成这一轮的摘要
+            self.summary_tasks[last.round_num] = asyncio.create_task(self._asummarize(last.round_num))
+
+    def _final_task(self) -> tuple:
         final_header = "## 辩论结束"
         print(f"\n--- {final_header} ---")
         
@@ -312,38 +1113,253 @@ class DebateManager:
 
         if self.scores['pro'] > self.scores['con']:
             winner = "正方"
+            self.winner = "pro"
         elif self.scores['con'] > self.scores['pro']:
             winner = "反方"
+            self.winner = "con"
         else:
             winner = "平局"
+            self.winner = "draw"
         
         final_task = f"辩论已结束，双方总分分别是正方 {self.scores['pro']} 和反方 {self.scores['con']}。请宣布 '{winner}' 获胜，并发表一段最终的总结陈词。"
-        summary_response = referee_agent.invoke({
-            "topic": self.topic,
-            "history": self.history,
-            "task": final_task
-        })
-        summary_content = summary_response.content
+        return final_header, final_scores_text, final_task
+
+    def _record_verdict(self, final_header: str, final_scores_text: str, summary_content: str):
         print("\n[裁判最终裁决]:")
         print(summary_content)
 
         # 记录最终结果
         final_record = f"{final_header}\n\n**{final_scores_text}**\n\n### 裁判最终裁决\n\n{summary_content}"
-        self._record(final_record)
-        print(f"\n完整辩论过程已记录在文件: {self.markdown_filename}")
+        self._record(final_record, {"type": "verdict", "scores": dict(self.scores), "content": summary_content})
+        self.finished = True
+        self._checkpoint()
+        print(f"\n完整辩论过程已记录在文件: {self.markdown_filename} (结构化记录: {self.transcript_filename})")
+
+    def announce_winner(self):
+        """宣布最终结果并记录"""
+        final_header, final_scores_text, final_task = self._final_task()
+        summary_response = self.referee_agent.invoke({
+            "topic": self.topic,
+            "history": self.history.view(),
+            "task": final_task
+        }, config=self._usage_config("最终裁决", self.rounds))
+        self._record_verdict(final_header, final_scores_text, summary_response.content)
+
+    async def aannounce_winner(self):
+        final_header, final_scores_text, final_task = self._final_task()
+        await self._await_summaries()
+        summary_response = await self.referee_agent.ainvoke({
+            "topic": self.topic,
+            "history": self.history.view(),
+            "task": final_task
+        }, config=self._usage_config("最终裁决", self.rounds))
+        self._record_verdict(final_header, final_scores_text, summary_response.content)
 
     def run_debate(self):
-        """完整运行整个辩论"""
-        self.setup_debate()
-        for i in range(1, self.rounds + 1):
-            self.run_round(i)
-            time.sleep(1) # 每轮之间稍作停顿
-        self.announce_winner()
+        """串行运行整个辩论"""
+        try:
+            # 从检查点恢复时，已经完成的步骤全部跳过
+            if not self.pro_stance:
+                self.setup_debate()
+            self._rescore_pending()
+            for i in range(1, self.rounds + 1):
+                self.run_round(i)
+            if not self.finished:
+                self.announce_winner()
+        finally:
+            self.transcript.close()
+        self._print_metrics()
+
+    async def _cancel_background_tasks(self):
+        """出错或被取消时，预取、摘要和评分任务不能在记录关闭之后继续写入：先取消，再等它们结束并取走异常"""
+        tasks = [*self.research.values(), *self.summary_tasks.values()]
+        if self.pending_score is not None:
+            tasks.append(self.pending_score[1])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def arun_debate(self):
+        """异步调度运行整个辩论"""
+        try:
+            if not self.pro_stance:
+                await self.asetup_debate()
+            # 立场一确定就并行预取双方开场的搜索(恢复时只预取还没有第一轮发言的一方)
+            self.research = {(1, side): asyncio.create_task(self._prefetch_opening(side))
+                             for side in SIDE_NAMES if self.history.find(1, side) is None}
+            await self._arescore_pending()
+            for round_num in self._unsummarized_rounds():
+                self.summary_tasks[round_num] = asyncio.create_task(self._asummarize(round_num))
+            await self.arun_rounds()
+            if not self.finished:
+                await self.aannounce_winner()
+        finally:
+            await self._cancel_background_tasks()
+            # 关闭时要等后台线程写完，放到线程池里，避免阻塞事件循环
+            await asyncio.to_thread(self.transcript.close)
+        self._print_metrics()
+
+    def result(self) -> Dict[str, Any]:
+        """辩论结束后的结构化结果，锦标赛模式用它汇总统计"""
+        return {
+            "topic": self.topic,
+            "rounds": self.rounds,
+            "scores": dict(self.scores),
+            "winner": self.winner,
+            "turns": [{"round": t.round_num, "side": t.side, "score": t.score} for t in self.history.turns],
+            "calls": [usage.to_dict() for usage in self.token_log],
+            "markdown": self.markdown_filename,
+            "checkpoint": self.checkpoint_filename,
+            "prefetch": self.prefetch_report() if self.turn_log else None,
+        }
+
+    def token_report(self) -> str:
+        """按轮次汇总输入token：单次调用的输入token应当基本持平，累计值随轮数线性增长"""
+        lines = [f"{'轮次':<6}{'调用次数':>8}{'输入tokens':>12}{'单次最大输入':>14}{'累计输入':>10}"]
+        cumulative = 0
+        for round_num in sorted({usage.round_num for usage in self.token_log}):
+            usages = [usage for usage in self.token_log if usage.round_num == round_num]
+            total = sum(usage.input_tokens for usage in usages)
+            cumulative += total
+            largest = max(usage.input_tokens for usage in usages)
+            lines.append(f"{round_num:<6}{len(usages):>8}{total:>12}{largest:>14}{cumulative:>10}")
+        return "\n".join(lines)
+
+    def prefetch_report(self) -> Dict[str, Any]:
+        """
+        预取命中：辩手拿到预取资料后没有再搜索，或者只搜索了预取过的词(直接命中搜索缓存)。
+        saved_seconds 是命中的发言中已经移出关键路径的预取耗时(预取耗时减去发言开始时还要等待的时间)，
+        辩手省掉的“决定搜索词”那次LLM往返没有计入，实际节省的时间用 --bench-prefetch 对比。
+        """
+        prefetched = [t for t in self.turn_log if t["prefetch"] and t["prefetch"]["research"]]
+        others = [t for t in self.turn_log if t not in prefetched]
+        hits, served, saved = 0, 0, 0.0
+        for t in prefetched:
+            keys = {normalize_query(q) for q in t["prefetch"]["queries"]}
+            matched = sum(normalize_query(q) in keys for q in t["searches"])
+            served += matched
+            if matched == len(t["searches"]):
+                hits += 1
+                saved += max(t["prefetch"]["seconds"] - t["wait"], 0.0)
+        def mean(turns: List[Dict[str, Any]], key: str) -> Optional[float]:
+            return round(sum(t[key] for t in turns) / len(turns), 3) if turns else None
+
+        return {
+            "turns": len(self.turn_log),
+            "prefetched_turns": len(prefetched),
+            "hit_rate": round(hits / len(prefetched), 3) if prefetched else 0.0,
+            "searches": sum(len(t["searches"]) for t in self.turn_log),
+            "searches_served": served,
+            "mean_wait": mean(prefetched, "wait"),
+            "mean_turn_seconds": mean(prefetched, "seconds"),
+            "mean_turn_seconds_without_prefetch": mean(others, "seconds"),
+            "saved_seconds": round(saved, 3),
+        }
+
+    def _print_metrics(self):
+        print(f"搜索缓存统计(本场辩论): {self.search.metrics}")
+        if self.tool_memo is not None:
+            print(f"工具调用缓存统计: {self.tool_memo.metrics}")
+        if self.turn_log:
+            print(f"搜索预取统计: {self.prefetch_report()}")
+        print("token用量(第0轮为生成立场):")
+        print(self.token_report())
+
+
+def benchmark_prefetch(topic: str, rounds: int, queries: int):
+    """
+    比较异步调度在开启和关闭推测式预取时每段发言的耗时。
+    先跑开启预取的一场，它的搜索会留在持久化缓存里，只会让关闭预取的一场更快，得到的节省是保守的。
+    """
+    reports = {}
+    for n in (queries, 0):
+        manager = DebateManager(topic=topic, rounds=rounds, prefetch_queries=n)
+        start = time.perf_counter()
+        asyncio.run(manager.arun_debate())
+        reports[n] = (time.perf_counter() - start, manager)
+
+    print("\n--- 搜索预取对比 ---")
+    print(f"{'预取搜索词':<8}{'总耗时(s)':>10}{'平均发言(s)':>12}{'第2轮起平均发言(s)':>20}{'命中率':>8}")
+    for n, (total, manager) in reports.items():
+        later = [t["seconds"] for t in manager.turn_log if t["round"] > 1]
+        report = manager.prefetch_report()
+        mean_all = sum(t["seconds"] for t in manager.turn_log) / len(manager.turn_log)
+        mean_later = f"{sum(later) / len(later):.2f}" if later else "-"
+        print(f"{n:<8}{total:>10.1f}{mean_all:>12.2f}{mean_later:>20}{report['hit_rate']:>8.2f}")
+
+
+def benchmark_scoring(topic: str, rounds: int):
+    """比较逐段评分和按轮结构化评分：每轮的裁判评分调用次数、评分耗时(包括修正)和辩论总耗时"""
+    results = []
+    for mode in SCORING_MODES[::-1]:
+        manager = DebateManager(topic=topic, rounds=rounds, scoring=mode)
+        start = time.perf_counter()
+        asyncio.run(manager.arun_debate())
+        total = time.perf_counter() - start
+        usages = [usage for usage in manager.token_log if usage.call.startswith("裁判评分")]
+        results.append((mode, len(usages) / rounds, sum(usage.seconds for usage in usages) / rounds,
+                        sum(usage.input_tokens for usage in usages) / rounds, total))
+
+    print("\n--- 裁判评分方式对比 ---")
+    print(f"{'评分方式':<8}{'每轮调用':>10}{'每轮评分耗时(s)':>16}{'每轮评分输入tokens':>20}{'总耗时(s)':>10}")
+    for mode, calls, seconds, tokens, total in results:
+        print(f"{mode:<8}{calls:>10.1f}{seconds:>16.2f}{tokens:>20.0f}{total:>10.1f}")
+
+
+def benchmark_rounds(topic: str, rounds_list=(1, 2, 4, 8)):
+    """
+    比较串行流程和异步调度在不同轮数下的总耗时。
+    两种模式共用持久化的搜索缓存，先跑异步调度，这样缓存带来的好处只会偏向串行流程，得到的加速比是保守的。
+    """
+    results = []
+    for rounds in rounds_list:
+        start = time.perf_counter()
+        asyncio.run(DebateManager(topic=topic, rounds=rounds).arun_debate())
+        concurrent = time.perf_counter() - start
+        start = time.perf_counter()
+        DebateManager(topic=topic, rounds=rounds).run_debate()
+        sequential = time.perf_counter() - start
+        results.append((rounds, sequential, concurrent))
+
+    print("\n--- 辩论耗时对比 ---")
+    print(f"{'轮数':<6}{'串行(s)':>10}{'异步调度(s)':>14}{'加速比':>8}")
+    for rounds, sequential, concurrent in results:
+        print(f"{rounds:<6}{sequential:>10.1f}{concurrent:>14.1f}{sequential / concurrent:>8.2f}x")
 
 
 if __name__ == "__main__":
-    debate_topic = "社交媒体对青少年的心理健康是积极影响大于消极影响，还是消极影响大于积极影响？"
-    
-    # 为了演示，我们只进行1轮，你可以增加轮数
-    manager = DebateManager(topic=debate_topic, rounds=1) 
-    manager.run_debate()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="三个Agent组成的自动辩论")
+    parser.add_argument("--topic", default="社交媒体对青少年的心理健康是积极影响大于消极影响，还是消极影响大于积极影响？")
+    # 为了演示，默认只进行1轮，你可以增加轮数
+    parser.add_argument("--rounds", type=int, default=1)
+    parser.add_argument("--sequential", action="store_true", help="使用原来的串行流程")
+    parser.add_argument("--bench-rounds", metavar="N1,N2,...",
+                        help="比较串行流程和异步调度的总耗时，例如 1,2,4,8")
+    parser.add_argument("--prefetch", type=int, metavar="N", default=None,
+                        help="上一位辩手发言时为下一位辩手预取 N 个搜索词的结果(默认读取 DEBATE_PREFETCH_QUERIES，0为关闭)")
+    parser.add_argument("--bench-prefetch", action="store_true", help="比较开启和关闭搜索预取时的发言耗时")
+    parser.add_argument("--per-speech-scoring", action="store_true",
+                        help="裁判逐段评分(原来的方式)，默认每轮一次结构化评分，也可以设置 REFEREE_SCORING=speech")
+    parser.add_argument("--bench-scoring", action="store_true", help="比较逐段评分和按轮评分的调用次数与耗时")
+    parser.add_argument("--resume", metavar="CHECKPOINT",
+                        help="从 debate_log_*.checkpoint.json 继续中断的辩论，辩题和轮数以检查点为准")
+    args = parser.parse_args()
+    install_signal_flush()
+
+    if args.bench_rounds:
+        benchmark_rounds(args.topic, [int(n) for n in args.bench_rounds.split(",")])
+    elif args.bench_prefetch:
+        benchmark_prefetch(args.topic, args.rounds, args.prefetch or PREFETCH_QUERIES or 2)
+    elif args.bench_scoring:
+        benchmark_scoring(args.topic, args.rounds)
+    else:
+        scoring = "speech" if args.per_speech_scoring else None
+        if args.resume:
+            manager = DebateManager.from_checkpoint(args.resume, prefetch_queries=args.prefetch, scoring=scoring)
+        else:
+            manager = DebateManager(topic=args.topic, rounds=args.rounds, prefetch_queries=args.prefetch,
+                                    scoring=scoring)
+        if args.sequential:
+            manager.run_debate()
+        else:
+            asyncio.run(manager.arun_debate())
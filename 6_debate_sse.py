@@ -0,0 +1,212 @@
+'''
+Descripttion: 辩论直播(SSE)
+6_agent_debate.py 只会在每段发言完全结束后打印出来，一场辩论要等好几分钟才能看到内容。
+这里用 FastAPI 提供 Server-Sent Events 接口(事件格式与 mcp/mcp_server_sse.py 相同)：
+1. 辩论通过 astream_events 运行，辩手发言的token、工具调用、搜索结果、评分和裁决一产生就推送出去。
+2. 一场辩论只运行一次，任意多个观众可以订阅同一场辩论，不会产生额外的模型调用；
+   中途加入或断线重连(Last-Event-ID)的观众会先收到之前的事件。
+3. 背压：事件追加到每场辩论的事件日志里，每个观众按自己的速度读取，慢的观众不会拖慢辩论和其他观众；
+   落后太多时，连续的token合并成一条再发送，让它尽快追上。
+用法示例:
+    python 6_debate_sse.py
+    curl -X POST "http://127.0.0.1:8001/debates?topic=人工智能会取代大部分白领工作吗？&rounds=2"
+    curl -N http://127.0.0.1:8001/debates/<debate_id>/events
+'''
+import os
+import json
+import time
+import uuid
+import asyncio
+import importlib.util
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+DEBATE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "6_agent_debate.py")
+LOG_DIR = "debate_sse_logs"
+# 同时运行的辩论数上限，超过时新建辩论返回 429
+MAX_ACTIVE_DEBATES = int(os.getenv("DEBATE_SSE_MAX_ACTIVE", "4"))
+# 已经结束的辩论最多保留多少场，供之后加入的观众回放
+MAX_FINISHED_DEBATES = 32
+# 观众落后超过这么多条事件时，连续的token合并后再发送
+COALESCE_LAG = 64
+# 没有新事件时每隔多少秒发送一次注释行，防止代理和浏览器断开空闲连接
+HEARTBEAT_SECONDS = 15
+
+
+def _load_debate_module():
+    """文件名以数字开头，不能直接 import"""
+    spec = importlib.util.spec_from_file_location("agent_debate", DEBATE_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+debate = _load_debate_module()
+
+
+# --- 1. 一场辩论的事件日志和订阅 ---
+class DebateBroadcast:
+    """
+    辩论(生产者)只往日志末尾追加事件，从不等待观众；每个订阅只是日志中的一个读取位置。
+    事件编号就是它在日志中的位置，用作SSE的 id，断线重连时从 Last-Event-ID 之后继续。
+    """
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+        self.closed = False
+        self._waiter = asyncio.Event()
+
+    def publish(self, event: Dict[str, Any]):
+        """只能在事件循环线程里调用(DebateManager 的 event_sink)"""
+        self.events.append(event)
+        waiter, self._waiter = self._waiter, asyncio.Event()
+        waiter.set()
+
+    def close(self):
+        self.closed = True
+        self._waiter.set()
+
+    @staticmethod
+    def _coalesce(batch: List[tuple]) -> List[tuple]:
+        """把同一段发言中连续的token事件合并成一条，编号取合并后最后一条的编号"""
+        merged: List[tuple] = []
+        for index, event in batch:
+            if (merged and event["type"] == "token" and merged[-1][1]["type"] == "token"
+                    and merged[-1][1]["round"] == event["round"] and merged[-1][1]["side"] == event["side"]):
+                merged[-1] = (index, {**merged[-1][1], "text": merged[-1][1]["text"] + event["text"]})
+            else:
+                merged.append((index, event))
+        return merged
+
+    async def subscribe(self, start: int = 0) -> AsyncIterator[Optional[tuple]]:
+        """依次产出 (编号, 事件)；等待超过 HEARTBEAT_SECONDS 没有新事件时产出 None"""
+        cursor = start
+        while True:
+            if cursor < len(self.events):
+                batch = list(enumerate(self.events[cursor:], start=cursor))
+                cursor = len(self.events)
+                for item in self._coalesce(batch) if len(batch) > COALESCE_LAG else batch:
+                    yield item
+                continue
+            if self.closed:
+                return
+            waiter = self._waiter
+            try:
+                await asyncio.wait_for(waiter.wait(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield None
+
+
+class DebateSession:
+    def __init__(self, topic: str, rounds: int, prefetch: Optional[int] = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.topic = topic
+        self.rounds = rounds
+        self.broadcast = DebateBroadcast()
+        self.viewers = 0
+        self.started = time.time()
+        self.finished: Optional[float] = None
+        self.error: Optional[str] = None
+        self.manager = debate.DebateManager(
+            topic, rounds=rounds, verbose=False, prefetch_queries=prefetch,
+            markdown_filename=os.path.join(LOG_DIR, f"{self.id}.md"), event_sink=self.broadcast.publish,
+        )
+        self.task: Optional[asyncio.Task] = None
+
+    async def run(self):
+        try:
+            await self.manager.arun_debate()
+            self.broadcast.publish({"type": "end", "result": self.manager.result()})
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            self.broadcast.publish({"type": "error", "error": self.error})
+        finally:
+            self.finished = time.time()
+            self.broadcast.close()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "debate_id": self.id,
+            "topic": self.topic,
+            "rounds": self.rounds,
+            "running": self.finished is None,
+            "events": len(self.broadcast.events),
+            "viewers": self.viewers,
+            "error": self.error,
+            "result": self.manager.result() if self.finished and not self.error else None,
+        }
+
+
+# --- 2. FastAPI应用 ---
+app = FastAPI()
+sessions: Dict[str, DebateSession] = {}
+
+
+def _evict_finished():
+    finished = sorted((s for s in sessions.values() if s.finished), key=lambda s: s.finished)
+    for session in finished[:max(len(finished) - MAX_FINISHED_DEBATES, 0)]:
+        del sessions[session.id]
+
+
+def _get_session(debate_id: str) -> DebateSession:
+    session = sessions.get(debate_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"辩论 {debate_id} 不存在")
+    return session
+
+
+@app.post("/debates")
+async def create_debate(topic: str, rounds: int = 2, prefetch: Optional[int] = None):
+    """开始一场新的辩论，返回之后订阅事件流用的编号"""
+    if sum(s.finished is None for s in sessions.values()) >= MAX_ACTIVE_DEBATES:
+        raise HTTPException(status_code=429, detail=f"同时进行的辩论已达到上限 {MAX_ACTIVE_DEBATES}")
+    os.makedirs(LOG_DIR, exist_ok=True)
+    _evict_finished()
+    session = DebateSession(topic, rounds, prefetch)
+    sessions[session.id] = session
+    session.task = asyncio.create_task(session.run())
+    return {"debate_id": session.id, "events": f"/debates/{session.id}/events"}
+
+
+@app.get("/debates")
+async def list_debates():
+    return [session.status() for session in sessions.values()]
+
+
+@app.get("/debates/{debate_id}")
+async def get_debate(debate_id: str):
+    return _get_session(debate_id).status()
+
+
+async def stream_generator(session: DebateSession, start: int):
+    """把事件格式化为SSE消息；客户端断开时 StreamingResponse 会取消这个生成器，辩论本身不受影响"""
+    session.viewers += 1
+    try:
+        async for item in session.broadcast.subscribe(start):
+            if item is None:
+                yield ": keep-alive\n\n"
+                continue
+            index, event = item
+            yield f"id: {index}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+    finally:
+        session.viewers -= 1
+
+
+@app.get("/debates/{debate_id}/events")
+async def debate_events(debate_id: str, request: Request, start: int = 0):
+    """订阅一场辩论的事件流；断线重连时浏览器会带上 Last-Event-ID，从它之后继续"""
+    session = _get_session(debate_id)
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id is not None and last_event_id.isdigit():
+        start = int(last_event_id) + 1
+    return StreamingResponse(stream_generator(session, start), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# --- 3. 运行服务器 ---
+if __name__ == "__main__":
+    print("启动辩论直播服务器，访问 http://127.0.0.1:8001")
+    print("先 POST /debates?topic=...&rounds=2 创建辩论，再用 GET /debates/<debate_id>/events 订阅事件流")
+    uvicorn.run(app, host="127.0.0.1", port=8001)
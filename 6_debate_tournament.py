@@ -0,0 +1,288 @@
+'''
+Descripttion: 辩论锦标赛
+6_agent_debate.py 一次只能跑一场辩论，用来比较不同的模型接入点(pro_llm 和 con_llm 使用不同的ARK模型)效率很低。
+锦标赛模式：
+1. 输入一组辩题和一组模型，每两个模型之间在每个辩题上各打两场，交换正反方，消除立场本身带来的偏差。
+2. 多场辩论在进程池中同时进行，--workers 是全局并发上限；
+   所有进程的LLM请求共享一个速率预算(--rpm，每分钟请求数)，在达到服务商限流之前吞吐接近线性增长。
+3. 每场辩论的结果追加写入 results.jsonl，最后汇总每个模型的胜率、得分分布、token用量和发言延迟，写入 report.json。
+用法示例:
+    python 6_debate_tournament.py --topics topics.txt --models ep-a,ep-b,ep-c --workers 4 --rpm 120
+    python 6_debate_tournament.py --topic "人工智能会取代大部分白领工作吗？" --models ep-a,ep-b --rounds 2
+'''
+import os
+import re
+import json
+import time
+import hashlib
+import asyncio
+import argparse
+import itertools
+import statistics
+import contextlib
+import importlib.util
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+
+from langchain_core.rate_limiters import BaseRateLimiter
+
+DEBATE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "6_agent_debate.py")
+DEFAULT_REFEREE_MODEL = "ep-m-20250719172710-9zfxx"
+SPEECH_CALLS = {"pro": "正方发言", "con": "反方发言"}
+
+
+# --- 1. 跨进程共享的速率预算 ---
+class SharedRateLimiter(BaseRateLimiter):
+    """
+    所有工作进程共享一个“下一个可用时间点”，每个LLM请求在上面预约一个位置，然后睡到那个时间点，
+    这样无论有多少个进程，合计的请求速率都不超过 requests_per_minute。
+    """
+    def __init__(self, requests_per_minute: float, next_slot, lock):
+        self.interval = 60.0 / requests_per_minute
+        self._next_slot = next_slot
+        self._lock = lock
+
+    def _reserve(self, blocking: bool) -> Optional[float]:
+        """返回需要等待的秒数；非阻塞模式下没有空位时返回 None"""
+        with self._lock:
+            now = time.time()
+            if not blocking and self._next_slot.value > now:
+                return None
+            slot = max(now, self._next_slot.value)
+            self._next_slot.value = slot + self.interval
+        return slot - now
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        wait = self._reserve(blocking)
+        if wait is None:
+            return False
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        wait = self._reserve(blocking)
+        if wait is None:
+            return False
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return True
+
+
+# --- 2. 工作进程 ---
+_debate_module = None
+_rate_limiter: Optional[SharedRateLimiter] = None
+
+
+def _init_worker(requests_per_minute: float, next_slot, lock):
+    global _rate_limiter
+    _rate_limiter = SharedRateLimiter(requests_per_minute, next_slot, lock) if requests_per_minute else None
+
+
+def _load_debate_module():
+    """文件名以数字开头，不能直接 import，每个进程只加载一次"""
+    global _debate_module
+    if _debate_module is None:
+        spec = importlib.util.spec_from_file_location("agent_debate", DEBATE_SCRIPT)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _debate_module = module
+    return _debate_module
+
+
+def run_match(match: Dict[str, Any]) -> Dict[str, Any]:
+    """在工作进程中运行一场辩论，辩论过程的输出写入单独的日志文件，返回结构化结果"""
+    start = time.perf_counter()
+    base = os.path.join(match["out_dir"], match["id"])
+    result: Dict[str, Any] = {}
+    error = None
+    with open(base + ".log", "w", encoding="utf-8") as log, contextlib.redirect_stdout(log):
+        try:
+            debate = _load_debate_module()
+            llm_kwargs = {"rate_limiter": _rate_limiter} if _rate_limiter else {}
+            manager = debate.DebateManager(
+                match["topic"], rounds=match["rounds"],
+                pro_llm=debate.build_llm(match["pro_model"], **llm_kwargs),
+                con_llm=debate.build_llm(match["con_model"], **llm_kwargs),
+                referee_llm=debate.build_llm(match["referee_model"], **llm_kwargs),
+                markdown_filename=base + ".md", verbose=False,
+            )
+            try:
+                asyncio.run(manager.arun_debate())
+            finally:
+                result = manager.result()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            print(f"辩论失败: {error}")
+    result.update({
+        "id": match["id"],
+        "topic": match["topic"],
+        "pro_model": match["pro_model"],
+        "con_model": match["con_model"],
+        "seconds": round(time.perf_counter() - start, 2),
+        "error": error,
+    })
+    return result
+
+
+# --- 3. 赛程 ---
+def _slug(name: str) -> str:
+    """截断后的名字可能重复(例如只有前缀不同的两个模型)，后面加上完整名字的短哈希"""
+    digest = hashlib.sha1(name.encode("utf-8")).hexdigest()[:6]
+    return re.sub(r"\W+", "_", name).strip("_")[-24:] + "_" + digest
+
+
+def build_matches(topics: List[str], models: List[str], rounds: int, repeats: int,
+                  referee_model: str, out_dir: str) -> List[Dict[str, Any]]:
+    """每两个模型在每个辩题上交换正反方各打 repeats 场"""
+    matches = []
+    for topic_index, topic in enumerate(topics):
+        for a, b in itertools.combinations(models, 2):
+            for repeat in range(repeats):
+                for pro_model, con_model in ((a, b), (b, a)):
+                    matches.append({
+                        "id": f"t{topic_index}_{_slug(pro_model)}_vs_{_slug(con_model)}_{repeat}",
+                        "topic": topic,
+                        "pro_model": pro_model,
+                        "con_model": con_model,
+                        "referee_model": referee_model,
+                        "rounds": rounds,
+                        "out_dir": out_dir,
+                    })
+    return matches
+
+
+# --- 4. 汇总 ---
+def _distribution(values: List[float]) -> Dict[str, Any]:
+    if not values:
+        return {}
+    return {
+        "mean": round(statistics.mean(values), 2),
+        "stdev": round(statistics.stdev(values), 2) if len(values) > 1 else 0.0,
+        "min": round(min(values), 2),
+        "median": round(statistics.median(values), 2),
+        "max": round(max(values), 2),
+    }
+
+
+def aggregate(results: List[Dict[str, Any]], wall_seconds: float) -> Dict[str, Any]:
+    finished = [r for r in results if not r["error"] and r.get("winner")]
+    models: Dict[str, Dict[str, Any]] = {}
+    for result in finished:
+        for side, opponent_side in (("pro", "con"), ("con", "pro")):
+            stats = models.setdefault(result[f"{side}_model"], {
+                "debates": 0, "wins": 0, "losses": 0, "draws": 0, "wins_as_pro": 0, "wins_as_con": 0,
+                "speech_scores": [], "input_tokens": 0, "output_tokens": 0, "speech_seconds": [],
+            })
+            stats["debates"] += 1
+            if result["winner"] == side:
+                stats["wins"] += 1
+                stats[f"wins_as_{side}"] += 1
+            elif result["winner"] == opponent_side:
+                stats["losses"] += 1
+            else:
+                stats["draws"] += 1
+            stats["speech_scores"] += [t["score"] for t in result["turns"] if t["side"] == side and t["score"] is not None]
+            for call in result["calls"]:
+                if call["call"] == SPEECH_CALLS[side]:
+                    stats["input_tokens"] += call["input_tokens"]
+                    stats["output_tokens"] += call["output_tokens"]
+                    stats["speech_seconds"].append(call["seconds"])
+
+    report_models = {}
+    for model, stats in models.items():
+        report_models[model] = {
+            "debates": stats["debates"],
+            "wins": stats["wins"], "losses": stats["losses"], "draws": stats["draws"],
+            "win_rate": round((stats["wins"] + 0.5 * stats["draws"]) / stats["debates"], 3),
+            "wins_as_pro": stats["wins_as_pro"], "wins_as_con": stats["wins_as_con"],
+            "speech_score": _distribution(stats["speech_scores"]),
+            "input_tokens": stats["input_tokens"],
+            "output_tokens": stats["output_tokens"],
+            "speech_seconds": _distribution(stats["speech_seconds"]),
+        }
+
+    busy_seconds = sum(r["seconds"] for r in results)
+    return {
+        "matches": len(results),
+        "errors": len(results) - len(finished),
+        "wall_seconds": round(wall_seconds, 1),
+        # 所有辩论耗时之和 / 实际总耗时，接近 --workers 说明并发是线性扩展的
+        "effective_parallelism": round(busy_seconds / wall_seconds, 2) if wall_seconds else 0.0,
+        "debates_per_minute": round(len(results) / wall_seconds * 60, 2) if wall_seconds else 0.0,
+        "referee_input_tokens": sum(c["input_tokens"] for r in finished for c in r["calls"]
+                                    if c["call"] not in SPEECH_CALLS.values()),
+        "models": report_models,
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    print("\n--- 锦标赛结果 ---")
+    print(f"共 {report['matches']} 场(失败 {report['errors']} 场)，总耗时 {report['wall_seconds']}s，"
+          f"{report['debates_per_minute']} 场/分钟，有效并行度 {report['effective_parallelism']}")
+    ranking = sorted(report["models"].items(), key=lambda item: item[1]["win_rate"], reverse=True)
+    for model, stats in ranking:
+        score = stats["speech_score"]
+        latency = stats["speech_seconds"]
+        print(f"{model}: 胜率 {stats['win_rate']:.1%} ({stats['wins']}胜 {stats['losses']}负 {stats['draws']}平，"
+              f"正方 {stats['wins_as_pro']} 胜 / 反方 {stats['wins_as_con']} 胜) | "
+              f"单段得分 {score.get('mean', '-')}±{score.get('stdev', '-')} | "
+              f"tokens 输入 {stats['input_tokens']} 输出 {stats['output_tokens']} | "
+              f"发言LLM耗时中位数 {latency.get('median', '-')}s")
+
+
+def run_tournament(args) -> Dict[str, Any]:
+    topics = list(args.topic or [])
+    if args.topics:
+        with open(args.topics, "r", encoding="utf-8") as f:
+            topics += [line.strip() for line in f if line.strip()]
+    models = [m.strip() for m in args.models.split(",") if m.strip()]
+    if not topics:
+        raise ValueError("请通过 --topic 或 --topics 提供至少一个辩题")
+    if len(models) < 2:
+        raise ValueError("--models 至少需要两个模型")
+
+    os.makedirs(args.out, exist_ok=True)
+    matches = build_matches(topics, models, args.rounds, args.repeats, args.referee_model, args.out)
+    print(f"{len(topics)} 个辩题 x {len(models)} 个模型，共 {len(matches)} 场辩论，"
+          f"并发上限 {args.workers}，速率预算 {args.rpm or '不限'} 次/分钟")
+
+    results = []
+    next_slot, lock = mp.Value("d", 0.0), mp.Lock()
+    start = time.perf_counter()
+    with open(os.path.join(args.out, "results.jsonl"), "a", encoding="utf-8") as results_file, \
+            ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                                initargs=(args.rpm, next_slot, lock)) as pool:
+        futures = [pool.submit(run_match, match) for match in matches]
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            results.append(result)
+            results_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+            results_file.flush()
+            outcome = result["error"] or f"{result.get('winner')} 胜 {result.get('scores')}"
+            print(f"[{done}/{len(matches)}] {result['id']}: {outcome} ({result['seconds']}s)")
+
+    report = aggregate(results, time.perf_counter() - start)
+    with open(os.path.join(args.out, "report.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print_report(report)
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="在多个辩题和模型之间运行辩论锦标赛")
+    parser.add_argument("--topic", action="append", help="辩题，可以重复指定")
+    parser.add_argument("--topics", help="辩题文件，每行一个")
+    parser.add_argument("--models", required=True, help="参赛的模型接入点，逗号分隔")
+    parser.add_argument("--referee-model", default=DEFAULT_REFEREE_MODEL, help="裁判使用的模型")
+    parser.add_argument("--rounds", type=int, default=2, help="每场辩论的轮数")
+    parser.add_argument("--repeats", type=int, default=1, help="每个对阵(交换正反方后)重复的场数")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="同时进行的辩论数量上限(进程数)")
+    parser.add_argument("--rpm", type=float, default=0, help="所有进程合计每分钟最多发出的LLM请求数，0 表示不限")
+    parser.add_argument("--out", default="tournament_results", help="输出目录")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    run_tournament(parse_args())
@@ -0,0 +1,49 @@
+'''
+Description: openai-tools-agent 提示模板的本地副本
+hub.pull("hwchase17/openai-tools-agent") 每次启动服务器都要联网，网络慢或者 LangChain Hub 不可用时服务器就起不来。
+load_agent_prompt 按下面的顺序加载，默认完全不联网：
+1. 设置 MCP_REFRESH_PROMPT=1 时从 Hub 拉取最新版本，并写入本地缓存；
+2. 本地缓存(.hub_cache/openai-tools-agent.json)；
+3. 内置的副本，内容与 Hub 上的模板相同。
+'''
+import os
+import logging
+
+PROMPT_NAME = "hwchase17/openai-tools-agent"
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".hub_cache", "openai-tools-agent.json")
+
+
+def bundled_prompt():
+    """与 Hub 上 hwchase17/openai-tools-agent 相同的提示模板"""
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    return ChatPromptTemplate.from_messages([
+        ("system", "You are a helpful assistant"),
+        MessagesPlaceholder("chat_history", optional=True),
+        ("human", "{input}"),
+        MessagesPlaceholder("agent_scratchpad"),
+    ])
+
+
+def load_agent_prompt(refresh: bool = None):
+    from langchain_core.load import dumps, loads
+
+    if refresh is None:
+        refresh = os.getenv("MCP_REFRESH_PROMPT") == "1"
+    if refresh:
+        try:
+            from langchain import hub
+            prompt = hub.pull(PROMPT_NAME)
+            os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+            with open(CACHE_PATH, "w", encoding="utf-8") as f:
+                f.write(dumps(prompt))
+            logging.info(f"已从 Hub 拉取 {PROMPT_NAME} 并写入缓存 {CACHE_PATH}")
+            return prompt
+        except Exception as e:
+            logging.warning(f"从 Hub 拉取 {PROMPT_NAME} 失败，使用本地副本: {e}")
+    if os.path.exists(CACHE_PATH):
+        try:
+            with open(CACHE_PATH, "r", encoding="utf-8") as f:
+                return loads(f.read())
+        except Exception as e:
+            logging.warning(f"读取缓存的提示模板 {CACHE_PATH} 失败，使用内置副本: {e}")
+    return bundled_prompt()
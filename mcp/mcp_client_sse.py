@@ -2,7 +2,11 @@
 
 import requests
 import json
+import time
+import argparse
+import statistics
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from sseclient import SSEClient
 
 class SSE_MCPClient:
@@ -30,7 +34,16 @@ class SSE_MCPClient:
             client = SSEClient(response)
 
             print("--- 开始接收事件流 ---\n")
+            streaming = False
             for event in client.events():
+                if event.event == "token":
+                    # token 接着上一个token打印，不换行
+                    print(json.loads(event.data)["text"], end="", flush=True)
+                    streaming = True
+                    continue
+                if streaming:
+                    print("\n")
+                    streaming = False
                 print(f"EVENT: [{event.event}]")
                 
                 # 美化打印JSON数据
@@ -46,6 +59,9 @@ class SSE_MCPClient:
                     print("--- 事件流结束 ---")
                     break
 
+        except requests.exceptions.HTTPError as e:
+            # 例如 429：服务器上同时进行的流已达到上限
+            print(f"\n错误：服务器拒绝了请求: {e.response.status_code} {e.response.text}")
         except requests.exceptions.RequestException as e:
             print(f"\n错误：无法连接到服务器。请确保服务器正在运行。")
             print(f"详细信息: {e}")
@@ -53,10 +69,74 @@ class SSE_MCPClient:
             print(f"\n处理事件流时发生未知错误: {e}")
 
 
+    def measure(self, command: str) -> dict:
+        """完整接收一个流，返回首个token时间(TTFT)、事件数和总用时；不打印事件
+        TTFT 取第一个 token 或 final_answer 事件的时间，即用户第一次看到回答内容的时间"""
+        url = f"{self.base_url}/mcp-stream?command={urllib.parse.quote_plus(command)}"
+        start = time.perf_counter()
+        result = {"status": None, "ttft": None, "first_event": None, "events": 0, "seconds": None, "error": None}
+        try:
+            with requests.get(url, stream=True) as response:
+                result["status"] = response.status_code
+                if response.status_code != 200:
+                    return result
+                for event in SSEClient(response).events():
+                    now = time.perf_counter() - start
+                    result["events"] += 1
+                    if result["first_event"] is None:
+                        result["first_event"] = now
+                    if event.event in ["token", "final_answer"] and result["ttft"] is None:
+                        result["ttft"] = now
+                    if event.event in ["final_answer", "error"]:
+                        break
+        except requests.exceptions.RequestException as e:
+            # 连接失败或流中途断开：记录下来，不影响其它并发的客户端
+            result["error"] = str(e)
+            return result
+        result["seconds"] = time.perf_counter() - start
+        return result
+
+
+def benchmark_streams(command: str, clients: int = 16, base_url: str = "http://127.0.0.1:8000"):
+    """
+    同时打开 clients 个流，统计首个token时间(TTFT)、首个事件时间和每秒事件数。
+    服务器的流数上限(MCP_SSE_MAX_STREAMS)小于 clients 时，多出的请求会收到 429。
+    """
+    client = SSE_MCPClient(base_url)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(client.measure, [command] * clients))
+    elapsed = time.perf_counter() - start
+
+    done = [r for r in results if r["status"] == 200 and r["error"] is None]
+    rejected = sum(r["status"] == 429 for r in results)
+    failed = [r["error"] for r in results if r["error"] is not None]
+    print(f"\n--- {clients} 个并发客户端: 成功 {len(done)}，被拒绝(429) {rejected}，连接失败 {len(failed)}，"
+          f"总用时 {elapsed:.2f}s ---")
+    if failed:
+        print(f"连接失败示例: {failed[0]}")
+    if not done:
+        return
+    for name, key in (("TTFT", "ttft"), ("首个事件", "first_event"), ("整个流", "seconds")):
+        values = sorted(r[key] for r in done if r[key] is not None)
+        if values:
+            p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+            print(f"{name:<8} 中位数 {statistics.median(values):.3f}s  p95 {p95:.3f}s")
+    events = sum(r["events"] for r in done)
+    print(f"事件总数 {events}，每秒 {events / elapsed:.1f} 个；"
+          f"单个流平均每秒 {statistics.mean(r['events'] / r['seconds'] for r in done):.1f} 个")
+
+
 if __name__ == "__main__":
-    client = SSE_MCPClient()
-    
-    # --- 运行一个测试命令 ---
-    # 这个命令会触发Agent调用工具
-    user_command = "帮我看看 project_alpha 文件夹里有什么，然后告诉我里面最重要的文件是什么？"
-    client.stream_command(user_command)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="SSE MCP 客户端示例")
+    parser.add_argument("--bench", type=int, metavar="N", help="同时打开 N 个流，测量TTFT和每秒事件数")
+    parser.add_argument("--command", default="帮我看看 project_alpha 文件夹里有什么，然后告诉我里面最重要的文件是什么？")
+    args = parser.parse_args()
+    if args.bench:
+        benchmark_streams(args.command, args.bench)
+    else:
+        client = SSE_MCPClient()
+
+        # --- 运行一个测试命令 ---
+        # 这个命令会触发Agent调用工具
+        client.stream_command(args.command)
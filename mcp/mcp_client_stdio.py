@@ -12,33 +12,99 @@ Description:
 
 # client.py
 
+import os
+import sys
 import subprocess
+import threading
+import argparse
+import asyncio
 import json
 import uuid
 import time
+import statistics
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError, as_completed
+
+# 等待服务器就绪消息的最长时间(秒)
+READY_TIMEOUT = float(os.getenv("MCP_READY_TIMEOUT", "30"))
 
 class MCPClient:
     """
     一个用于与基于stdio的MCP服务器交互的客户端。
+    服务器会并发处理请求，响应按完成顺序返回，所以客户端不能再“写一行、读一行”：
+    每个请求在 _pending 中登记一个以 id 为键的 Future，后台线程读取stdout，按响应的 id 完成对应的 Future，
+    同一个管道上可以同时有任意多个请求在进行。
     """
-    def __init__(self, server_script_path="mcp_server_stdio.py"):
+    def __init__(self, server_script_path="mcp_server_stdio.py", env: dict = None):
         self.server_script_path = server_script_path
+        self.env = env  # 额外的环境变量，例如 {"MCP_AGENT_BUILD": "lazy"}
         self.process = None
+        self.server_info = None  # 服务器就绪消息的内容
+        self.spawned_at = None
+        self._ready = threading.Event()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._reader = None
 
-    def start_server(self):
-        """启动服务器子进程。"""
+    def start_server(self, timeout: float = READY_TIMEOUT):
+        """启动服务器子进程，并等待它发出就绪消息。"""
         print("正在启动MCP服务器子进程...")
+        self.server_info = None
+        self._ready.clear()
+        self.spawned_at = time.perf_counter()
         self.process = subprocess.Popen(
             ["python", "-u", self.server_script_path],
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE, # 捕获服务器的错误输出以供调试
             text=True, # 以文本模式处理流
-            encoding='utf-8'
+            encoding='utf-8',
+            env={**os.environ, **self.env} if self.env else None,
         )
-        # 等待一小段时间确保服务器完全启动
-        time.sleep(2) 
-        print("服务器已启动。")
+        self._reader = threading.Thread(target=self._read_responses, name="mcp-client-reader", daemon=True)
+        self._reader.start()
+        # 等待服务器的就绪消息，而不是固定 sleep 一段时间再碰运气
+        if not self._ready.wait(timeout):
+            self.stop_server()
+            raise TimeoutError(f"服务器在 {timeout} 秒内没有就绪。")
+        if self.server_info is None:
+            # 就绪之前 stdout 就关闭了：服务器启动失败
+            stderr_output = self.process.stderr.read()
+            self.process.wait()
+            raise ConnectionError(f"服务器启动失败(退出码 {self.process.returncode}):\n{stderr_output}")
+        print(f"服务器已就绪，用时 {time.perf_counter() - self.spawned_at:.2f}s: {self.server_info}")
+
+    def _read_responses(self):
+        """后台线程：读取服务器的每一行响应，按 id 完成对应的 Future"""
+        for response_line in self.process.stdout:
+            try:
+                response = json.loads(response_line)
+            except json.JSONDecodeError:
+                print(f"错误：无法解析服务器的响应: {response_line.strip()}")
+                continue
+            if response.get("type") == "ready":
+                self.server_info = response
+                self._ready.set()
+                continue
+            with self._pending_lock:
+                future = self._pending.pop(response.get("id"), None)
+            if future is None:
+                # 例如服务器无法解析的请求，响应的 id 为 "unknown"
+                print(f"[服务器 -> 客户端] 收到没有对应请求的响应: {response}")
+                continue
+            # 调用方可能已经取消了这个 Future(例如 asyncio.wait_for 超时)；再 set_result 会抛异常并让读取线程退出
+            if future.set_running_or_notify_cancel():
+                future.set_result(response)
+        # stdout 关闭：服务器已经退出，所有还在等待的请求都失败，还在等待就绪的 start_server 也不再等待
+        self._fail_pending(ConnectionAbortedError("与服务器的连接已断开。"))
+        self._ready.set()
+
+    def _fail_pending(self, error: Exception):
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
 
     def stop_server(self):
         """停止服务器子进程。"""
@@ -55,53 +121,131 @@ class MCPClient:
                 print("----------------------")
 
 
-    def send_command(self, command: str) -> dict:
-        """向服务器发送一个命令并获取响应。"""
+    def submit_command(self, command: str) -> Future:
+        """发送一个命令后立即返回 Future，响应到达时完成；可以在多个线程中同时调用。"""
+        return self._submit({"command": command})
+
+    def ping(self, timeout: float = None) -> dict:
+        """不经过Agent的请求，用于检查连通性"""
+        return self._submit({"type": "ping"}).result(timeout)
+
+    def _submit(self, fields: dict) -> Future:
         if not self.process:
             raise ConnectionError("服务器未启动。请先调用 start_server()。")
 
         request_id = str(uuid.uuid4())
         request = {
             "id": request_id,
-            "command": command
+            **fields
         }
-        
+        future = Future()
+        future.request_id = request_id
+        # 先登记再写入，避免响应比登记先到
+        with self._pending_lock:
+            self._pending[request_id] = future
+        future.add_done_callback(self._forget_cancelled)
+
         json_request = json.dumps(request)
         print(f"\n[客户端 -> 服务器] 发送: {json_request}")
-
         try:
-            # 写入服务器的stdin
-            self.process.stdin.write(json_request + '\n')
-            self.process.stdin.flush()
+            # 写入服务器的stdin，整行写入不能与其他线程交错
+            with self._write_lock:
+                self.process.stdin.write(json_request + '\n')
+                self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+            future.set_exception(ConnectionAbortedError(f"与服务器的连接已断开: {e}"))
+        return future
 
-            # 从服务器的stdout读取响应
-            response_line = self.process.stdout.readline()
-            if not response_line:
-                raise ConnectionAbortedError("与服务器的连接已断开。")
+    def _forget_cancelled(self, future: Future):
+        """调用方取消请求时从 _pending 中移除，之后迟到的响应会被当作没有对应请求的响应丢弃"""
+        if future.cancelled():
+            with self._pending_lock:
+                self._pending.pop(future.request_id, None)
 
-            response = json.loads(response_line)
+    def send_command(self, command: str, timeout: float = None) -> dict:
+        """向服务器发送一个命令并等待它的响应；其他线程中的命令不受影响。"""
+        future = self.submit_command(command)
+        try:
+            response = future.result(timeout)
             print(f"[服务器 -> 客户端] 收到: {json.dumps(response, indent=2, ensure_ascii=False)}")
             return response
-        
-        except (BrokenPipeError, ConnectionAbortedError) as e:
+        except FutureTimeoutError:
+            # 不再等待这个请求：从 _pending 中移除，之后迟到的响应会被当作没有对应请求的响应丢弃
+            with self._pending_lock:
+                self._pending.pop(future.request_id, None)
+            print(f"错误：等待服务器响应超过 {timeout} 秒。")
+            return {"status": "error", "payload": f"等待服务器响应超过 {timeout} 秒"}
+        except ConnectionAbortedError as e:
             print(f"错误：与服务器的连接中断。 {e}")
             self.stop_server()
             return {"status": "error", "payload": str(e)}
 
+    async def asend_command(self, command: str) -> dict:
+        """在asyncio中使用：await 期间不阻塞事件循环"""
+        return await asyncio.wrap_future(self.submit_command(command))
+
+
+def benchmark_startup(runs: int = 5, command: str = None):
+    """
+    从启动子进程到就绪消息、到第一个 ping 响应的时间，按三种Agent构建方式分别统计；
+    指定 command 时还统计到第一个Agent响应的时间(包括构建Agent和一次模型调用)。
+    原来的客户端无论服务器多快都固定等待2秒，服务器在导入全部 LangChain 并从 Hub 拉取提示之后才开始读取请求。
+    """
+    rows = []
+    for build in ("eager", "prewarm", "lazy"):
+        timings = {"ready": [], "ping": [], "command": []}
+        for _ in range(runs):
+            client = MCPClient(env={"MCP_AGENT_BUILD": build})
+            try:
+                client.start_server()
+                timings["ready"].append(time.perf_counter() - client.spawned_at)
+                client.ping()
+                timings["ping"].append(time.perf_counter() - client.spawned_at)
+                if command:
+                    client.submit_command(command).result()
+                    timings["command"].append(time.perf_counter() - client.spawned_at)
+            finally:
+                client.stop_server()
+        rows.append((build, timings))
+
+    print("\n--- 启动时间(从启动子进程开始，中位数，秒) ---")
+    print(f"{'构建方式':<10}{'就绪':>8}{'首个ping':>10}{'首个命令':>10}")
+    for build, timings in rows:
+        cells = [f"{statistics.median(timings[k]):.2f}" if timings[k] else "-" for k in ("ready", "ping", "command")]
+        print(f"{build:<10}{cells[0]:>8}{cells[1]:>10}{cells[2]:>10}")
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="stdio MCP 客户端示例")
+    parser.add_argument("--bench-startup", action="store_true", help="测量服务器从启动到第一个响应的时间")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--command", help="--bench-startup 时额外测量到第一个Agent响应的时间")
+    args = parser.parse_args()
+    if args.bench_startup:
+        benchmark_startup(args.runs, args.command)
+        sys.exit(0)
+
     client = MCPClient()
     try:
         client.start_server()
         
         # --- 运行一些测试命令 ---
-        client.send_command("你好，你是谁？")
-        
-        # 使用工具的命令
-        client.send_command("帮我看看 'project_alpha' 文件夹里有什么。")
-        
-        # 触发安全限制的命令
-        client.send_command("我想看看沙箱外面的 '../' 目录。")
+        # 三个命令同时发出，服务器并发处理，先完成的先返回
+        commands = [
+            "你好，你是谁？",
+            # 使用工具的命令
+            "帮我看看 'project_alpha' 文件夹里有什么。",
+            # 触发安全限制的命令
+            "我想看看沙箱外面的 '../' 目录。",
+        ]
+        start = time.perf_counter()
+        futures = {client.submit_command(command): command for command in commands}
+        for future in as_completed(futures):
+            response = future.result()
+            print(f"[服务器 -> 客户端] {time.perf_counter() - start:.1f}s 收到 '{futures[future]}' 的响应: "
+                  f"{json.dumps(response, indent=2, ensure_ascii=False)}")
         
         # 发送一个格式错误的命令 (不是JSON) - 这将由服务器的顶级异常处理捕获
         # print("\n[客户端 -> 服务器] 发送一个非JSON的无效请求...")
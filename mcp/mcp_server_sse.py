@@ -5,7 +5,7 @@ import uvicorn
 import json
 import os
 import asyncio
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import StreamingResponse
 
 # --- LangChain 和工具相关模块 ---
@@ -13,8 +13,8 @@ from langchain.tools import tool
 from pydantic import BaseModel, Field
 from langchain_openai import ChatOpenAI
 from langchain.agents import create_openai_tools_agent, AgentExecutor
-from langchain import hub
 from dotenv import load_dotenv
+from agent_prompt import load_agent_prompt
 
 # --- 1. 环境准备与安全沙箱 ---
 load_dotenv()
@@ -44,60 +44,102 @@ app = FastAPI()
 # Agent只在服务器启动时构建一次，以提高效率
 llm = ChatOpenAI(model="gpt-4-turbo", temperature=0, streaming=True)
 tools = [list_directory_contents]
-prompt = hub.pull("hwchase17/openai-tools-agent")
+prompt = load_agent_prompt() # 缓存或内置的提示模板，启动时不访问 LangChain Hub
 agent = create_openai_tools_agent(llm, tools, prompt)
 agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True) # Verbose设为True可以在服务器端看到详细日志
 
 # --- 3. SSE核心逻辑 ---
+# 原来用 astream 只能拿到完整的工具调用、工具结果和最终答案，最终答案要等模型全部生成完才出现，
+# 而且每个事件后还固定 sleep 0.1 秒。现在用 astream_events 转发模型生成的每个token：
+# - Agent 在单独的任务里运行，事件放进有上限的队列；客户端读得慢时Agent暂停，事件不会在服务器内存里无限堆积；
+# - 没有新事件时每隔 HEARTBEAT_SECONDS 秒发送一次注释行，防止代理和浏览器断开空闲连接；
+# - 客户端断开时取消Agent任务，不再为没人接收的结果调用模型；
+# - 同时进行的流超过 MCP_SSE_MAX_STREAMS 个时，新的请求直接返回 429。
+MAX_STREAMS = int(os.getenv("MCP_SSE_MAX_STREAMS", "32"))
+HEARTBEAT_SECONDS = 15
+STREAM_BUFFER = 256
+active_streams = 0
+
+
+async def run_agent(command: str, queue: asyncio.Queue):
+    """运行Agent，把 (事件类型, 数据) 放进队列，结束时放入 None"""
+    # 只转发Agent自己的工具，忽略工具内部可能产生的嵌套事件
+    tool_names = {t.name for t in agent_executor.tools}
+    try:
+        async for event in agent_executor.astream_events({"input": command}, version="v2"):
+            kind = event["event"]
+            if kind == "on_chat_model_stream":
+                # 模型决定调用工具时 content 为空，参数在 tool_call_chunks 里，由 tool_call 事件给出
+                text = event["data"]["chunk"].content
+                if text and isinstance(text, str):
+                    await queue.put(("token", {"text": text}))
+            elif kind == "on_tool_start" and event["name"] in tool_names:
+                await queue.put(("tool_call", {"tool": event["name"], "tool_input": event["data"].get("input")}))
+            elif kind == "on_tool_end" and event["name"] in tool_names:
+                output = event["data"].get("output")
+                await queue.put(("tool_output", {"tool": event["name"], "tool_output": str(getattr(output, "content", output))}))
+            elif kind == "on_chain_end" and not event["parent_ids"]:
+                await queue.put(("final_answer", {"answer": event["data"]["output"]["output"]}))
+    except Exception as e:
+        # 如果在流处理中发生错误，发送一个错误事件
+        await queue.put(("error", {"error": str(e)}))
+    await queue.put(None)
 
-async def stream_generator(command: str):
+
+async def stream_generator(command: str, request: Request):
     """
-    这是一个异步生成器，它调用Agent的astream，处理每个事件块，
-    并将其格式化为SSE消息后yield出去。
+    这是一个异步生成器，它从队列中取出Agent的事件，并将其格式化为SSE消息后yield出去。
+    客户端断开时 StreamingResponse 会取消这个生成器，finally 中随之取消Agent任务。
     """
+    queue = asyncio.Queue(maxsize=STREAM_BUFFER)
+    agent_task = asyncio.create_task(run_agent(command, queue))
     try:
-        # 使用异步流 astream
-        async for chunk in agent_executor.astream({"input": command}):
-            event_type = ""
-            data = {}
-
-            # 解析LangChain流的不同事件类型
-            if "actions" in chunk:
-                action = chunk["actions"][0]
-                event_type = "tool_call"
-                data = {"tool": action.tool, "tool_input": action.tool_input, "log": action.log}
-            elif "steps" in chunk:
-                step = chunk["steps"][0]
-                event_type = "tool_output"
-                data = {"tool_output": step.observation}
-            elif "output" in chunk:
-                event_type = "final_answer"
-                data = {"answer": chunk["output"]}
-            else:
-                # 忽略其他中间事件或继续处理
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected() or (agent_task.done() and queue.empty()):
+                    break
+                yield ": keep-alive\n\n"
                 continue
-            
+            if item is None:
+                break
+            event_type, data = item
             # 格式化为SSE消息
             # event: <event_name>
             # data: <json_string>
             # \n\n
-            sse_message = f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
-            yield sse_message
-            await asyncio.sleep(0.1) # 短暂休眠，防止CPU占用过高
+            yield f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+    finally:
+        agent_task.cancel()
+
+class StreamSlotResponse(StreamingResponse):
+    """
+    发送结束时释放端点里占用的名额。放在 __call__ 的 finally 中而不是生成器的 finally 中：
+    客户端在响应开始之前就断开、或者发送响应头时出错，生成器根本不会开始执行，它的 finally 也就不会运行。
+    """
+    async def __call__(self, scope, receive, send):
+        global active_streams
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            active_streams -= 1
 
-    except Exception as e:
-        # 如果在流处理中发生错误，发送一个错误事件
-        error_data = {"error": str(e)}
-        sse_message = f"event: error\ndata: {json.dumps(error_data)}\n\n"
-        yield sse_message
 
 @app.get("/mcp-stream")
-async def mcp_stream_endpoint(command: str):
+async def mcp_stream_endpoint(command: str, request: Request):
     """
     接收客户端命令，返回一个Server-Sent Events (SSE)流。
     """
+    global active_streams
+    if active_streams >= MAX_STREAMS:
+        raise HTTPException(status_code=429, detail=f"同时进行的流已达到上限 {MAX_STREAMS}")
     # StreamingResponse是FastAPI用于处理流式响应的关键
-    return StreamingResponse(stream_generator(command), media_type="text/event-stream")
+    response = StreamSlotResponse(stream_generator(command, request), media_type="text/event-stream",
+                                  headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # 在这里占用名额，响应发送结束时(包括生成器没有开始执行的情况)释放
+    active_streams += 1
+    return response
 
 
 # --- 4. 运行服务器 ---
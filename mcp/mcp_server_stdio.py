@@ -12,16 +12,20 @@ Description: 创建一个简单的ＭＣＰ服务器示例
 import sys
 import json
 import os
+import time
+import asyncio
 import logging
 from datetime import datetime
 
+# 就绪消息中的 startup_seconds 从这里开始计时，要包含下面第三方模块的导入时间，所以它们只能放在计时之后
+_STARTED = time.perf_counter()
+
 # --- LangChain 和工具相关模块 ---
-from langchain.tools import tool
-from pydantic import BaseModel, Field
-from langchain_openai import ChatOpenAI
-from langchain.agents import create_openai_tools_agent, AgentExecutor
-from langchain import hub
-from dotenv import load_dotenv
+# 启动时只导入定义工具需要的轻量模块；ChatOpenAI、AgentExecutor 等在 build_agent 中才导入，
+# 服务器在它们加载完成之前就可以发出就绪消息并开始接收请求
+from langchain_core.tools import tool  # noqa: E402
+from pydantic import BaseModel, Field  # noqa: E402
+from dotenv import load_dotenv  # noqa: E402
 
 # --- 1. 配置日志记录 ---
 # 将日志输出到文件，保持stdout干净，用于IPC通信
@@ -72,63 +76,133 @@ def list_directory_contents(directory_path: str) -> str:
 def build_agent():
     """构建并返回一个配置好的LangChain Agent Executor。"""
     logging.info("正在构建Agent...")
+    from langchain_openai import ChatOpenAI
+    from langchain.agents import create_openai_tools_agent, AgentExecutor
+    from agent_prompt import load_agent_prompt
+
     llm = ChatOpenAI(model="gpt-4-turbo", temperature=0)
     tools = [list_directory_contents]
-    prompt = hub.pull("hwchase17/openai-tools-agent")
+    # 使用缓存或内置的提示模板，启动时不再访问 LangChain Hub
+    prompt = load_agent_prompt()
     agent = create_openai_tools_agent(llm, tools, prompt)
     agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=False) # 在服务器模式下通常关闭verbose
     logging.info("Agent构建完成。")
     return agent_executor
 
+
+# MCP_AGENT_BUILD 决定什么时候构建Agent：
+# - prewarm(默认): 先发出就绪消息，然后立即在后台构建，第一个请求等待同一次构建；
+# - lazy: 第一个请求到达时才构建；
+# - eager: 构建完成后才发出就绪消息(与原来的启动顺序相同)。
+AGENT_BUILD = os.getenv("MCP_AGENT_BUILD", "prewarm")
+
+
+class LazyAgent:
+    """在线程中构建Agent，并发的请求共享同一次构建；构建失败时下一个请求会重新尝试"""
+    def __init__(self, builder=build_agent):
+        self._builder = builder
+        self._task = None
+
+    def start(self):
+        # 构建被取消时 exception() 会抛出 CancelledError，要先判断 cancelled()；失败或取消都重新构建
+        if self._task is None or (self._task.done() and (self._task.cancelled() or self._task.exception() is not None)):
+            self._task = asyncio.ensure_future(asyncio.to_thread(self._builder))
+
+    async def get(self):
+        self.start()
+        return await self._task
+
 # --- 4. 主服务器循环 ---
-def main_loop(agent_executor):
+# 原来的循环读一行、把 agent_executor.invoke 运行完才读下一行，一个慢请求会卡住后面所有的请求。
+# 现在每个请求作为一个asyncio任务并发处理，响应在完成时立即写回，客户端按 id 把响应对应到请求上：
+# - 最多同时处理 MCP_MAX_CONCURRENCY 个请求；达到上限时暂停读取stdin，背压通过管道传回客户端；
+# - stdin 在线程中读取(Windows的管道不支持asyncio读取)，stdout 只在事件循环线程里整行写入，响应不会交错；
+# - stdin 关闭后等正在处理的请求全部完成再退出。
+MAX_CONCURRENCY = int(os.getenv("MCP_MAX_CONCURRENCY", "8"))
+
+
+def write_response(response: dict):
+    """整行写入并立即刷新，只在事件循环线程中调用"""
+    sys.stdout.write(json.dumps(response) + '\n')
+    # **关键**: 刷新输出缓冲区，确保客户端立即收到消息
+    sys.stdout.flush()
+    logging.info(f"已发送响应 [ID: {response.get('id', response.get('type', 'unknown'))}]")
+
+
+async def handle_request(agent: LazyAgent, request_id, command: str, semaphore: asyncio.Semaphore):
+    try:
+        # 使用Agent处理命令
+        agent_executor = await agent.get()
+        agent_response = await agent_executor.ainvoke({"input": command})
+        payload = agent_response.get("output", "Agent没有提供输出。")
+        response = {"id": request_id, "status": "success", "payload": payload}
+    except Exception as e:
+        logging.error(f"Agent执行时出错 [ID: {request_id}]: {e}", exc_info=True)
+        response = {"id": request_id, "status": "error", "payload": str(e)}
+    finally:
+        semaphore.release()
+    write_response(response)
+
+
+async def main_loop(agent: LazyAgent, max_concurrency: int = MAX_CONCURRENCY, build: str = AGENT_BUILD):
     """
-    监听stdin，处理请求，并通过stdout响应。
+    监听stdin，并发处理请求，并通过stdout响应。
+    可以接收请求时先发出一条就绪消息 {"type": "ready", ...}，客户端等它而不是固定 sleep。
     """
-    logging.info("MCP服务器已启动，正在监听stdin...")
+    if build == "eager":
+        await agent.get()
+    write_response({"type": "ready", "pid": os.getpid(), "max_concurrency": max_concurrency, "agent_build": build,
+                    "startup_seconds": round(time.perf_counter() - _STARTED, 3)})
+    if build == "prewarm":
+        agent.start()
+    logging.info(f"MCP服务器已启动，正在监听stdin(最多同时处理 {max_concurrency} 个请求)...")
+    semaphore = asyncio.Semaphore(max_concurrency)
+    tasks = set()
     while True:
-        try:
-            # 从标准输入读取一行
-            line = sys.stdin.readline()
+        # 达到并发上限时在这里等待，不再读取新的请求
+        await semaphore.acquire()
+        # 从标准输入读取一行
+        line = await asyncio.to_thread(sys.stdin.readline)
 
-            # 如果读取到空行，意味着客户端可能已关闭连接，退出循环
-            if not line:
-                logging.info("检测到空的输入流，服务器正在关闭。")
-                break
+        # 如果读取到空行，意味着客户端可能已关闭连接，退出循环
+        if not line:
+            semaphore.release()
+            logging.info("检测到空的输入流，等待正在处理的请求完成后关闭。")
+            break
 
+        try:
             # 解析JSON请求
             request = json.loads(line)
             request_id = request.get("id", "no-id")
             command = request.get("command")
             logging.info(f"收到请求 [ID: {request_id}]: {command}")
-
+            if request.get("type") == "ping":
+                # 不经过Agent，用于检查连通性和测量启动时间
+                write_response({"id": request_id, "status": "success", "payload": "pong"})
+                semaphore.release()
+                continue
             if not command:
-                raise ValueError("请求中缺少 'command' 字段。")
-
-            # 使用Agent处理命令
-            try:
-                agent_response = agent_executor.invoke({"input": command})
-                payload = agent_response.get("output", "Agent没有提供输出。")
-                response = {"id": request_id, "status": "success", "payload": payload}
-            except Exception as e:
-                logging.error(f"Agent执行时出错 [ID: {request_id}]: {e}", exc_info=True)
-                response = {"id": request_id, "status": "error", "payload": str(e)}
-
+                write_response({"id": request_id, "status": "error", "payload": "请求中缺少 'command' 字段。"})
+                semaphore.release()
+                continue
         except json.JSONDecodeError:
             logging.error(f"无法解析收到的行: {line.strip()}")
-            response = {"id": "unknown", "status": "error", "payload": "无效的JSON请求。"}
+            write_response({"id": "unknown", "status": "error", "payload": "无效的JSON请求。"})
+            semaphore.release()
+            continue
         except Exception as e:
             logging.error(f"处理请求时发生未知错误: {e}", exc_info=True)
-            response = {"id": "unknown", "status": "error", "payload": str(e)}
+            write_response({"id": "unknown", "status": "error", "payload": str(e)})
+            semaphore.release()
+            continue
+
+        task = asyncio.create_task(handle_request(agent, request_id, command, semaphore))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
 
-        # 将JSON响应写入标准输出
-        json_response = json.dumps(response)
-        sys.stdout.write(json_response + '\n')
-        # **关键**: 刷新输出缓冲区，确保客户端立即收到消息
-        sys.stdout.flush()
-        logging.info(f"已发送响应 [ID: {response.get('id', 'unknown')}]")
+    if tasks:
+        await asyncio.gather(*tasks)
 
 
 if __name__ == "__main__":
-    agent_executor = build_agent()
-    main_loop(agent_executor)
\ No newline at end of file
+    asyncio.run(main_loop(LazyAgent()))
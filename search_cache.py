@@ -0,0 +1,288 @@
+'''
+Descripttion: 带缓存和去重功能的搜索工具封装
+4_my_tool.py 和 6_agent_debate.py 中的 Agent 经常在一次运行内、甚至多次运行之间发出几乎相同的搜索，
+每次都要付出一次网络往返和 Tavily 的调用额度。CachedSearchTool 包装任意搜索工具(默认是 TavilySearchResults)：
+1. 按规范化后的查询词持久化缓存结果(SQLite)，跨进程、跨运行复用。
+2. 同一时刻正在进行中的相同查询只真正请求一次，其余调用等待并共享结果。
+3. 同一个会话内已经返回过的URL不再重复返回，减少Agent上下文中的重复内容；
+   session() 返回独立的会话，多场辩论同时进行时各自去重，互不影响。
+4. 通过 metrics 暴露命中、未命中、合并、去重等统计数据。
+'''
+import json
+import time
+import logging
+import asyncio
+import sqlite3
+import threading
+import unicodedata
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Union
+
+from pydantic import BaseModel, Field, PrivateAttr
+from langchain_core.tools import BaseTool
+
+
+class _SearchAbandoned(Exception):
+    """负责真正搜索的调用被取消了，合并在它上面的调用重新认领这次查询"""
+
+
+class SearchInput(BaseModel):
+    query: str = Field(description="搜索查询词")
+
+
+def normalize_query(query: str) -> str:
+    """缓存键：统一全半角和大小写、合并连续空白，并去掉句末标点"""
+    text = unicodedata.normalize("NFKC", query).lower()
+    text = " ".join(text.split())
+    return text.rstrip("?？。.!！~～ ")
+
+
+class CachedSearchTool(BaseTool):
+    name: str = "web_search"
+    description: str = "一个搜索引擎，用于查找与时事、数据、研究报告相关的最新信息。输入应该是一个搜索查询词。"
+    args_schema: type[BaseModel] = SearchInput
+
+    search_tool: BaseTool                      # 真正执行搜索的工具，例如 TavilySearchResults
+    cache_path: Optional[str] = ".search_cache.sqlite"  # 为 None 时只使用进程内缓存
+    ttl_seconds: float = 24 * 3600
+    dedupe_urls: bool = True
+    busy_timeout: float = 10.0                 # 缓存文件被其它进程锁住时等待的秒数
+
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _memory_cache: Dict[str, tuple] = PrivateAttr(default_factory=dict)
+    _inflight: Dict[str, Future] = PrivateAttr(default_factory=dict)
+    _seen_urls: set = PrivateAttr(default_factory=set)
+    _conn: Optional[sqlite3.Connection] = PrivateAttr(default=None)
+    _metrics: Dict[str, int] = PrivateAttr(
+        default_factory=lambda: {"hits": 0, "misses": 0, "coalesced": 0, "deduped_urls": 0, "errors": 0,
+                                 "cache_write_errors": 0}
+    )
+
+    def model_post_init(self, __context: Any) -> None:
+        if self.cache_path:
+            # 锦标赛模式下多个进程共用同一个缓存文件：WAL 让读写互不阻塞，写冲突时最多等待 busy_timeout 秒
+            self._conn = sqlite3.connect(self.cache_path, timeout=self.busy_timeout, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS search_cache (key TEXT PRIMARY KEY, results TEXT, created REAL)"
+            )
+            self._conn.commit()
+
+    # --- 缓存读写 ---
+    def _cache_get(self, key: str) -> Optional[list]:
+        """必须在持有 _lock 时调用"""
+        entry = self._memory_cache.get(key)
+        if entry is None and self._conn is not None:
+            try:
+                row = self._conn.execute("SELECT results, created FROM search_cache WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                # 读不到持久化缓存时当作未命中处理
+                logging.warning(f"读取搜索缓存失败: {e}")
+                row = None
+            if row:
+                entry = (json.loads(row[0]), row[1])
+                self._memory_cache[key] = entry
+        if entry is None or time.time() - entry[1] > self.ttl_seconds:
+            return None
+        return entry[0]
+
+    def _cache_put(self, key: str, results: list) -> float:
+        """写入进程内缓存，必须在持有 _lock 时调用；返回写入时间，供 _persist 使用"""
+        created = time.time()
+        self._memory_cache[key] = (results, created)
+        return created
+
+    def _persist(self, key: str, results: list, created: float):
+        """写入SQLite。失败(例如多个进程同时写入导致 database is locked)只影响跨进程复用，不影响本次查询"""
+        if self._conn is None:
+            return
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO search_cache (key, results, created) VALUES (?, ?, ?)",
+                    (key, json.dumps(results, ensure_ascii=False), created),
+                )
+                self._conn.commit()
+        except sqlite3.Error as e:
+            logging.warning(f"搜索结果写入缓存失败: {e}")
+            with self._lock:
+                self._metrics["cache_write_errors"] += 1
+
+    def _claim(self, key: str):
+        """返回 (缓存结果, 正在进行中的Future, 是否由当前调用负责真正搜索)"""
+        with self._lock:
+            cached = self._cache_get(key)
+            if cached is not None:
+                self._metrics["hits"] += 1
+                return cached, None, False
+            future = self._inflight.get(key)
+            if future is not None:
+                self._metrics["coalesced"] += 1
+                return None, future, False
+            self._metrics["misses"] += 1
+            future = Future()
+            self._inflight[key] = future
+            return None, future, True
+
+    def _settle(self, key: str, future: Future, results: Union[list, str, BaseException]):
+        """
+        先移出进行中的查询并让等待的调用拿到结果，再持久化；
+        任何一步都不能在 future 完成之前抛出异常，否则后来的相同查询会合并到它上面永远等下去。
+        """
+        created = None
+        with self._lock:
+            self._inflight.pop(key, None)
+            # 只缓存正常的结果列表，搜索服务返回的错误字符串和异常都不缓存
+            if isinstance(results, list):
+                created = self._cache_put(key, results)
+            elif not isinstance(results, _SearchAbandoned):
+                self._metrics["errors"] += 1
+        # 正常情况下 future 只会在这里完成；万一已经被取消，也不能让 set_result 抛出 InvalidStateError 打断持久化
+        if not future.done():
+            if isinstance(results, BaseException):
+                future.set_exception(results)
+            else:
+                future.set_result(results)
+        if created is not None:
+            self._persist(key, results, created)
+
+    def _dedupe(self, results: Union[list, str], seen_urls: Optional[set] = None,
+                metrics: Optional[Dict[str, int]] = None, lock: Optional[threading.Lock] = None) -> Union[list, str]:
+        """去掉 seen_urls 中已经返回过的网页；不传时使用这个工具自己的会话记录"""
+        if not self.dedupe_urls or not isinstance(results, list):
+            return results
+        if seen_urls is None:
+            seen_urls, metrics, lock = self._seen_urls, self._metrics, self._lock
+        fresh = []
+        with lock:
+            for item in results:
+                url = item.get("url") if isinstance(item, dict) else None
+                if url and url in seen_urls:
+                    metrics["deduped_urls"] += 1
+                    continue
+                if url:
+                    seen_urls.add(url)
+                fresh.append(item)
+        if results and not fresh:
+            return "这次搜索到的网页在之前的搜索中都已经返回过，请参考之前的搜索结果，或者换一个关键词。"
+        return fresh
+
+    # --- 查询：缓存、合并进行中的相同查询，必要时真正搜索 ---
+    # 返回 (结果, "hits"/"misses"/"coalesced")，不做网页去重
+    def _search(self, query: str) -> tuple:
+        key = normalize_query(query)
+        while True:
+            cached, future, leader = self._claim(key)
+            if cached is not None:
+                return cached, "hits"
+            if leader:
+                try:
+                    results = self.search_tool.invoke({"query": query})
+                except Exception as e:
+                    self._settle(key, future, e)
+                    raise
+                except BaseException:
+                    # 被中断时让等待中的相同查询重新发起，而不是永远等下去
+                    self._settle(key, future, _SearchAbandoned())
+                    raise
+                self._settle(key, future, results)
+            try:
+                return future.result(), "misses" if leader else "coalesced"
+            except _SearchAbandoned:
+                continue
+
+    async def _asearch(self, query: str) -> tuple:
+        key = normalize_query(query)
+        while True:
+            cached, future, leader = self._claim(key)
+            if cached is not None:
+                return cached, "hits"
+            if leader:
+                try:
+                    results = await self.search_tool.ainvoke({"query": query})
+                except Exception as e:
+                    self._settle(key, future, e)
+                    raise
+                except BaseException:
+                    # asyncio.CancelledError：例如SSE客户端断开或预取任务被取消
+                    self._settle(key, future, _SearchAbandoned())
+                    raise
+                self._settle(key, future, results)
+            try:
+                # future 由所有合并在一起的调用共享：一个等待者被取消时只取消它自己的等待，不能取消共享的 future
+                return await asyncio.shield(asyncio.wrap_future(future)), "misses" if leader else "coalesced"
+            except _SearchAbandoned:
+                continue
+
+    # --- 工具入口 ---
+    def _run(self, query: str, run_manager=None) -> Union[List[Dict[str, Any]], str]:
+        return self._dedupe(self._search(query)[0])
+
+    async def _arun(self, query: str, run_manager=None) -> Union[List[Dict[str, Any]], str]:
+        return self._dedupe((await self._asearch(query))[0])
+
+    # --- 会话与统计 ---
+    def new_session(self):
+        """开始一个新的会话，清空已返回URL的记录。多个会话同时进行时请改用 session()"""
+        with self._lock:
+            self._seen_urls.clear()
+
+    def session(self) -> "SearchSession":
+        """返回一个独立的会话：共享这个工具的缓存和进行中查询的合并，网页去重和统计只属于这个会话"""
+        return SearchSession(cache=self, name=self.name, description=self.description)
+
+    @property
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return _with_hit_rate(dict(self._metrics))
+
+
+def _with_hit_rate(metrics: Dict[str, Any]) -> Dict[str, Any]:
+    lookups = metrics["hits"] + metrics["misses"] + metrics["coalesced"]
+    metrics["hit_rate"] = round((metrics["hits"] + metrics["coalesced"]) / lookups, 3) if lookups else 0.0
+    return metrics
+
+
+class SearchSession(BaseTool):
+    """
+    例如 6_debate_sse.py 中同时进行的多场辩论：每场辩论一个会话，
+    一场辩论开始时不会清掉另一场辩论的网页去重记录，统计数据也分开。
+    """
+    name: str = "web_search"
+    description: str = CachedSearchTool.model_fields["description"].default
+    args_schema: type[BaseModel] = SearchInput
+
+    cache: CachedSearchTool
+
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _seen_urls: set = PrivateAttr(default_factory=set)
+    _metrics: Dict[str, int] = PrivateAttr(
+        default_factory=lambda: {"hits": 0, "misses": 0, "coalesced": 0, "deduped_urls": 0, "errors": 0}
+    )
+
+    def _count(self, outcome: str):
+        with self._lock:
+            self._metrics[outcome] += 1
+
+    def _finish(self, results: Union[list, str], outcome: str) -> Union[List[Dict[str, Any]], str]:
+        self._count(outcome)
+        return self.cache._dedupe(results, self._seen_urls, self._metrics, self._lock)
+
+    def _run(self, query: str, run_manager=None) -> Union[List[Dict[str, Any]], str]:
+        try:
+            return self._finish(*self.cache._search(query))
+        except Exception:
+            self._count("errors")
+            raise
+
+    async def _arun(self, query: str, run_manager=None) -> Union[List[Dict[str, Any]], str]:
+        try:
+            return self._finish(*(await self.cache._asearch(query)))
+        except Exception:
+            self._count("errors")
+            raise
+
+    @property
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return _with_hit_rate(dict(self._metrics))
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 仓库中的模块都是根目录下的独立脚本，测试直接从根目录导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
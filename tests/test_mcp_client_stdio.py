@@ -0,0 +1,56 @@
+'''
+mcp/mcp_client_stdio.MCPClient 的测试：用一个只回显命令的标准库服务器代替Agent，不调用LLM
+'''
+import os
+import sys
+import asyncio
+import importlib.util
+
+import pytest
+
+CLIENT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "mcp", "mcp_client_stdio.py")
+
+# 每个请求在线程中处理："sleep 秒数" 等待后再响应，其余命令立即回显
+ECHO_SERVER = '''
+import sys, json, time, threading
+lock = threading.Lock()
+
+def respond(request):
+    command = request.get("command", "")
+    if command.startswith("sleep"):
+        time.sleep(float(command.split()[1]))
+    with lock:
+        print(json.dumps({"id": request["id"], "status": "success", "payload": command}), flush=True)
+
+print(json.dumps({"type": "ready"}), flush=True)
+for line in sys.stdin:
+    threading.Thread(target=respond, args=(json.loads(line),)).start()
+'''
+
+
+@pytest.fixture
+def client(tmp_path):
+    server_path = tmp_path / "echo_server.py"
+    server_path.write_text(ECHO_SERVER, encoding="utf-8")
+    spec = importlib.util.spec_from_file_location("mcp_client_stdio", CLIENT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    client = module.MCPClient(str(server_path), env={"PATH": os.path.dirname(sys.executable) + os.pathsep + os.environ["PATH"]})
+    client.start_server(timeout=10)
+    yield client
+    client.stop_server()
+
+
+def test_cancelled_request_does_not_stop_the_reader(client):
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(client.asend_command("sleep 0.3"), 0.05)
+        # 被取消的请求不再登记在 _pending 中
+        assert client._pending == {}
+        # 等迟到的响应到达，读取线程仍然在处理之后的请求
+        await asyncio.sleep(0.5)
+        return await asyncio.wait_for(client.asend_command("after"), 5)
+
+    response = asyncio.run(run())
+    assert response["payload"] == "after"
+    assert client._reader.is_alive()
@@ -0,0 +1,54 @@
+'''
+5_agent_sql_db2excel.QueryGuard 的测试：只改写SQL并在内存SQLite中执行，不调用LLM
+'''
+import os
+import sqlite3
+import importlib.util
+
+import pytest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "5_agent_sql_db2excel.py")
+
+
+@pytest.fixture(scope="module")
+def module(tmp_path_factory):
+    db_path = tmp_path_factory.mktemp("guard") / "agent.db"
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("ARK_API_KEY", "test")
+        monkeypatch.setenv("SQL_AGENT_DB_URL", f"sqlite:///{db_path}")
+        spec = importlib.util.spec_from_file_location("sql_agent", SCRIPT)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    yield module
+    module.engine.dispose()
+    module.read_engine.dispose()
+
+
+def run(sql: str) -> list:
+    connection = sqlite3.connect(":memory:")
+    try:
+        connection.execute("CREATE TABLE t (name TEXT)")
+        connection.executemany("INSERT INTO t VALUES (?)", [(f"n{i}",) for i in range(10)])
+        return connection.execute(sql).fetchall()
+    finally:
+        connection.close()
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT name FROM t -- 全部名字",
+    "SELECT name FROM t; -- 全部名字",
+    "SELECT name FROM t /* 全部 */",
+    "SELECT name FROM t WHERE name <> '--'",
+])
+def test_inject_limit_after_trailing_comment(module, sql):
+    guard = module.QueryGuard(default_limit=3)
+    rewritten, limited = guard.inject_limit(sql)
+    assert limited
+    assert len(run(rewritten)) == 3
+
+
+def test_existing_limit_before_comment_is_kept(module):
+    guard = module.QueryGuard(default_limit=3)
+    sql = "SELECT name FROM t LIMIT 5 -- 前五个"
+    assert guard.inject_limit(sql) == (sql, False)
+    assert len(run(sql)) == 5
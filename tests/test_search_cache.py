@@ -0,0 +1,227 @@
+'''
+search_cache.CachedSearchTool 的测试：用本地的假搜索工具代替 Tavily，不访问网络
+'''
+import time
+import asyncio
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain_core.tools import BaseTool
+
+import search_cache
+from search_cache import CachedSearchTool, normalize_query
+
+
+class FakeSearch(BaseTool):
+    """每个查询返回两条结果，URL由查询词决定；查询词以 error 开头时抛出异常"""
+    name: str = "fake_search"
+    description: str = "fake"
+    delay: float = 0.0
+    calls: list = []
+
+    def _results(self, query: str) -> list:
+        self.calls.append(query)
+        if query.startswith("error"):
+            raise RuntimeError("搜索服务不可用")
+        slug = normalize_query(query).replace(" ", "-")
+        return [{"url": f"https://example.com/{slug}/{i}", "content": f"{query} {i}"} for i in range(2)]
+
+    def _run(self, query: str) -> list:
+        time.sleep(self.delay)
+        return self._results(query)
+
+    async def _arun(self, query: str) -> list:
+        await asyncio.sleep(self.delay)
+        return self._results(query)
+
+
+def make_tool(cache_path=None, delay=0.0, **kwargs) -> CachedSearchTool:
+    return CachedSearchTool(search_tool=FakeSearch(delay=delay, calls=[]), cache_path=cache_path, **kwargs)
+
+
+def test_normalized_queries_share_one_cache_entry():
+    tool = make_tool(dedupe_urls=False)
+    first = tool.invoke("盘古大模型是造假么")
+    second = tool.invoke("  盘古大模型是造假么？ ")
+    assert first == second
+    assert tool.search_tool.calls == ["盘古大模型是造假么"]
+    assert tool.metrics["hits"] == 1 and tool.metrics["misses"] == 1
+
+
+def test_cache_persists_across_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    make_tool(path, dedupe_urls=False).invoke("LangChain")
+    tool = make_tool(path, dedupe_urls=False)
+    assert len(tool.invoke("langchain")) == 2
+    assert tool.search_tool.calls == []
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = {"t": 1000.0}
+    monkeypatch.setattr(search_cache.time, "time", lambda: now["t"])
+    tool = make_tool(ttl_seconds=60, dedupe_urls=False)
+    tool.invoke("q")
+    now["t"] += 59
+    tool.invoke("q")
+    assert tool.search_tool.calls == ["q"]
+    now["t"] += 2
+    tool.invoke("q")
+    assert tool.search_tool.calls == ["q", "q"]
+
+
+def test_errors_are_not_cached():
+    tool = make_tool()
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            tool.invoke("error query")
+    assert len(tool.search_tool.calls) == 2
+    assert tool.metrics["errors"] == 2
+
+
+def test_concurrent_identical_queries_are_coalesced_in_threads():
+    tool = make_tool(delay=0.2, dedupe_urls=False)
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        results = list(pool.map(tool.invoke, ["AI 芯片"] * 5))
+    assert all(r == results[0] for r in results)
+    assert tool.search_tool.calls == ["AI 芯片"]
+    assert tool.metrics["coalesced"] == 4
+
+
+def test_concurrent_identical_queries_are_coalesced_in_asyncio():
+    tool = make_tool(delay=0.2, dedupe_urls=False)
+
+    async def run():
+        return await asyncio.gather(*(tool.ainvoke("AI 芯片") for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert all(r == results[0] for r in results)
+    assert tool.search_tool.calls == ["AI 芯片"]
+
+
+def test_cancelled_leader_does_not_strand_waiting_queries():
+    tool = make_tool(delay=0.2, dedupe_urls=False)
+
+    async def run():
+        leader = asyncio.create_task(tool.ainvoke("q"))
+        await asyncio.sleep(0.05)
+        follower = asyncio.create_task(tool.ainvoke("q"))
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        result = await asyncio.wait_for(follower, 2)
+        # 之后相同的查询直接命中缓存
+        return result, await asyncio.wait_for(tool.ainvoke("q"), 2)
+
+    result, again = asyncio.run(run())
+    assert result == again
+    # 被取消的调用没有完成搜索，等待它的调用重新发起了一次
+    assert tool.search_tool.calls == ["q"]
+    assert tool.metrics["misses"] == 2 and tool.metrics["coalesced"] == 1
+
+
+def test_cancelled_follower_does_not_cancel_the_shared_search(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    tool = make_tool(path, delay=0.2, dedupe_urls=False)
+
+    async def run():
+        leader = asyncio.create_task(tool.ainvoke("q"))
+        await asyncio.sleep(0.05)
+        followers = [asyncio.create_task(tool.ainvoke("q")) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        followers[0].cancel()
+        results = await asyncio.wait_for(asyncio.gather(leader, *followers, return_exceptions=True), 2)
+        return results
+
+    leader_result, cancelled, *others = asyncio.run(run())
+    assert isinstance(cancelled, asyncio.CancelledError)
+    assert len(leader_result) == 2 and all(r == leader_result for r in others)
+    assert tool.search_tool.calls == ["q"]
+    assert tool.metrics["cache_write_errors"] == 0
+    # 结果已经持久化
+    reader = make_tool(path, dedupe_urls=False)
+    assert reader.invoke("q") == leader_result and reader.search_tool.calls == []
+
+
+class LockedConnection:
+    """模拟另一个进程正在写入：读取正常，写入时报 database is locked"""
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, *args):
+        if sql.startswith("INSERT"):
+            raise sqlite3.OperationalError("database is locked")
+        return self.conn.execute(sql, *args)
+
+    def commit(self):
+        self.conn.commit()
+
+
+def test_cache_write_failure_still_resolves_coalesced_queries(tmp_path):
+    tool = make_tool(str(tmp_path / "cache.sqlite"), delay=0.2, dedupe_urls=False)
+    tool._conn = LockedConnection(tool._conn)
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [pool.submit(tool.invoke, "q") for _ in range(3)]
+        results = [f.result(timeout=2) for f in futures]
+    assert all(len(r) == 2 for r in results)
+    assert tool.metrics["cache_write_errors"] == 1
+    # 进程内缓存不受影响
+    tool.invoke("q")
+    assert tool.search_tool.calls == ["q"]
+
+
+def test_shared_cache_file_waits_for_other_writers(tmp_path):
+    """另一个连接(锦标赛中的其它进程)短暂持有写锁时，等它释放后写入，而不是丢掉这次缓存"""
+    path = str(tmp_path / "cache.sqlite")
+    tool = make_tool(path, dedupe_urls=False)
+    assert tool._conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    other = sqlite3.connect(path, check_same_thread=False)
+    other.execute("BEGIN IMMEDIATE")
+    release = threading.Timer(0.3, other.commit)
+    release.start()
+    tool.invoke("q")
+    release.join()
+    other.close()
+    assert tool.metrics["cache_write_errors"] == 0
+    reader = make_tool(path, dedupe_urls=False)
+    assert len(reader.invoke("q")) == 2
+    assert reader.search_tool.calls == []
+
+
+def test_urls_are_deduplicated_within_a_session():
+    tool = make_tool()
+    assert len(tool.invoke("q")) == 2
+    repeated = tool.invoke("q")
+    assert isinstance(repeated, str) and "之前的搜索" in repeated
+    assert tool.metrics["deduped_urls"] == 2
+    tool.new_session()
+    assert len(tool.invoke("q")) == 2
+
+
+def test_sessions_share_the_cache_but_not_deduplication():
+    tool = make_tool()
+    first, second = tool.session(), tool.session()
+    assert first.name == "web_search"
+    assert len(first.invoke("q")) == 2
+    # 另一场辩论第一次看到这些网页，不受 first 的去重记录影响，也不会清掉它
+    assert len(second.invoke("q")) == 2
+    assert isinstance(first.invoke("q"), str)
+    assert tool.search_tool.calls == ["q"]
+    assert first.metrics["misses"] == 1 and first.metrics["hits"] == 1 and first.metrics["deduped_urls"] == 2
+    assert second.metrics["hits"] == 1 and second.metrics["deduped_urls"] == 0
+    assert tool.metrics["hits"] == 2 and tool.metrics["misses"] == 1
+
+
+def test_concurrent_sessions_coalesce_and_count_errors():
+    tool = make_tool(delay=0.2)
+    sessions = [tool.session() for _ in range(3)]
+
+    async def run():
+        return await asyncio.gather(*(s.ainvoke("q") for s in sessions))
+
+    assert all(len(r) == 2 for r in asyncio.run(run()))
+    assert tool.search_tool.calls == ["q"]
+    assert sorted(s.metrics["misses"] for s in sessions) == [0, 0, 1]
+    with pytest.raises(RuntimeError):
+        sessions[0].invoke("error query")
+    assert sessions[0].metrics["errors"] == 1 and sessions[1].metrics["errors"] == 0
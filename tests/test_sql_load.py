@@ -0,0 +1,78 @@
+'''
+5_agent_sql_db2excel.load_file 的测试：导入临时的文件型SQLite，不调用LLM
+'''
+import os
+import sys
+import sqlite3
+import subprocess
+import importlib.util
+
+import pandas as pd
+import pytest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "5_agent_sql_db2excel.py")
+ROWS = 10
+CHUNK_ROWS = 3
+
+# 在子进程中导入，第 kill_at 次写入分块时直接终止进程：不回滚、不关闭连接，模拟导入中途被杀掉
+KILLED = 9
+KILLED_LOAD = f'''
+KILLED = {KILLED}
+import os, sys, importlib.util
+sys.path.insert(0, os.path.dirname(sys.argv[1]))
+spec = importlib.util.spec_from_file_location("sql_agent", sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+insert_chunk, calls = module._insert_chunk, []
+
+def killed_insert(connection, table, rows):
+    calls.append(rows)
+    if len(calls) == int(sys.argv[3]):
+        os._exit(KILLED)
+    insert_chunk(connection, table, rows)
+
+module._insert_chunk = killed_insert
+module.load_file(sys.argv[2], "people", chunk_rows=int(sys.argv[4]))
+'''
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    db_path = tmp_path / "agent.db"
+    monkeypatch.setenv("ARK_API_KEY", "test")
+    monkeypatch.setenv("SQL_AGENT_DB_URL", f"sqlite:///{db_path}")
+    monkeypatch.chdir(tmp_path)
+    csv_path = tmp_path / "people.csv"
+    pd.DataFrame({"id": range(1, ROWS + 1), "name": [f"员工{i}" for i in range(1, ROWS + 1)]}).to_csv(csv_path, index=False)
+    return db_path, csv_path
+
+
+def count_rows(db_path) -> int:
+    connection = sqlite3.connect(db_path)
+    try:
+        return connection.execute("SELECT COUNT(*) FROM people").fetchone()[0]
+    finally:
+        connection.close()
+
+
+def test_load_file_imports_all_chunks(env):
+    db_path, csv_path = env
+    spec = importlib.util.spec_from_file_location("sql_agent", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    try:
+        assert module.load_file(str(csv_path), "people", chunk_rows=CHUNK_ROWS) == ROWS
+    finally:
+        module.engine.dispose()
+        module.read_engine.dispose()
+    assert count_rows(db_path) == ROWS
+
+
+def test_killed_load_keeps_committed_chunks(env):
+    db_path, csv_path = env
+    kill_at = 3
+    process = subprocess.run([sys.executable, "-c", KILLED_LOAD, SCRIPT, str(csv_path), str(kill_at), str(CHUNK_ROWS)],
+                             capture_output=True, text=True, timeout=120)
+    assert process.returncode == KILLED, process.stderr
+    # 被终止之前的两块都已经提交
+    assert count_rows(db_path) == (kill_at - 1) * CHUNK_ROWS
@@ -0,0 +1,109 @@
+'''
+tool_memo.MemoizingAgentExecutor 的测试：用固定的动作序列代替模型，不访问网络
+'''
+import asyncio
+
+from langchain_core.agents import AgentAction, AgentFinish
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import RunnableLambda
+from langchain_core.tools import tool
+
+from tool_memo import MemoizingAgentExecutor, ToolMemo, canonical_args
+
+calls = []
+
+
+@tool
+def lookup(key: str) -> str:
+    """按键查找一个值"""
+    calls.append(key)
+    if key == "broken":
+        return f"查找失败: {key} 暂时不可用"
+    return f"value of {key}"
+
+
+def scripted_agent(keys: list):
+    """依次用 keys 中的参数调用 lookup，全部调用完后结束"""
+    def plan(inputs):
+        steps = inputs["intermediate_steps"]
+        if len(steps) < len(keys):
+            return AgentAction(tool="lookup", tool_input={"key": keys[len(steps)]}, log="")
+        return AgentFinish({"output": [observation for _, observation in steps]}, "")
+    return RunnableLambda(plan)
+
+
+def make_executor(keys: list, **memo_options) -> MemoizingAgentExecutor:
+    calls.clear()
+    memo = ToolMemo(purity={"lookup": True}, scope="run", **memo_options)
+    return MemoizingAgentExecutor(agent=scripted_agent(keys), tools=[lookup], tool_memo=memo)
+
+
+class RecordingHandler(BaseCallbackHandler):
+    def __init__(self):
+        self.events = []
+
+    def on_tool_start(self, serialized, input_str, *, tags=None, metadata=None, **kwargs):
+        self.events.append(("start", serialized["name"], "cached" in (tags or []), (metadata or {}).get("cached", False)))
+
+    def on_tool_end(self, output, **kwargs):
+        self.events.append(("end", str(output)))
+
+
+def test_memo_hit_reuses_observation():
+    executor = make_executor(["a", "a", "b"])
+    output = executor.invoke({"input": "x"})["output"]
+    assert output == ["value of a", "value of a", "value of b"]
+    assert calls == ["a", "b"]
+    assert executor.tool_memo.metrics["hits"] == 1
+
+
+def test_values_are_not_normalized_by_default():
+    executor = make_executor(["a", " a "])
+    executor.invoke({"input": "x"})
+    assert calls == ["a", " a "]
+
+
+def test_tool_can_opt_in_to_value_normalization():
+    executor = make_executor(["a", " a "], canonicalizers={"lookup": lambda tool_input: canonical_args(tool_input, str.strip)})
+    assert executor.invoke({"input": "x"})["output"] == ["value of a", "value of a"]
+    assert calls == ["a"]
+
+
+def test_errors_are_not_cached():
+    executor = make_executor(["broken", "broken"])
+    executor.invoke({"input": "x"})
+    assert calls == ["broken", "broken"]
+    assert executor.tool_memo.metrics["uncached_errors"] == 2
+
+
+def test_cacheable_predicate_per_tool():
+    executor = make_executor(["a", "a"], cacheable={"lookup": lambda observation: False})
+    executor.invoke({"input": "x"})
+    assert calls == ["a", "a"]
+
+
+def test_memo_hit_emits_tool_callbacks():
+    executor = make_executor(["a", "a"])
+    handler = RecordingHandler()
+    executor.invoke({"input": "x"}, config={"callbacks": [handler]})
+    assert calls == ["a"]
+    assert handler.events == [
+        ("start", "lookup", False, False), ("end", "value of a"),
+        ("start", "lookup", True, True), ("end", "value of a"),
+    ]
+
+
+def test_memo_hit_appears_in_astream_events():
+    executor = make_executor(["a", "a"])
+
+    async def collect():
+        return [event async for event in executor.astream_events({"input": "x"}, version="v2")
+                if event["event"] in ("on_tool_start", "on_tool_end")]
+
+    events = asyncio.run(collect())
+    assert calls == ["a"]
+    assert [(e["event"], e["name"], "cached" in e["tags"]) for e in events] == [
+        ("on_tool_start", "lookup", False), ("on_tool_end", "lookup", False),
+        ("on_tool_start", "lookup", True), ("on_tool_end", "lookup", True),
+    ]
+    assert events[-1]["data"]["output"] == "value of a"
@@ -0,0 +1,130 @@
+'''
+weather_tool 的测试：用本地的 HTTP 服务代替 OpenWeather API，不访问网络
+'''
+import json
+import time
+import asyncio
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import httpx
+import pytest
+from cachetools import TTLCache
+
+import weather_tool
+
+RESPONSE_DELAY = 0.2
+
+
+class FakeOpenWeather(BaseHTTPRequestHandler):
+    """按城市名返回固定结果：Nowhere 返回404，Proxy 返回HTML错误页，Slow 很久才返回"""
+    requests = []
+
+    def do_GET(self):
+        city = parse_qs(urlparse(self.path).query)["q"][0]
+        self.requests.append(city)
+        time.sleep(5 if city == "Slow" else RESPONSE_DELAY)
+        if city == "Proxy":
+            status, content_type, body = 502, "text/html", b"<html><body>502 Bad Gateway</body></html>"
+        else:
+            status = 404 if city == "Nowhere" else 200
+            content_type = "application/json"
+            body = json.dumps({"cod": status, "name": city, "main": {"temp": 20}}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def openweather(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOpenWeather)
+    server.daemon_threads = True  # 关闭时不等待还在 sleep 的请求
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    FakeOpenWeather.requests = []
+    monkeypatch.setattr(weather_tool, "OPENWEATHER_API_URL", f"http://127.0.0.1:{server.server_port}/weather")
+    # 每个测试使用新的缓存，时钟可以手动拨动
+    clock = {"now": 0.0}
+    monkeypatch.setattr(weather_tool, "weather_cache", TTLCache(maxsize=16, ttl=600, timer=lambda: clock["now"]))
+    yield FakeOpenWeather.requests, clock
+    server.shutdown()
+    server.server_close()
+
+
+def test_cache_is_keyed_by_normalized_city(openweather):
+    requests, _ = openweather
+    first = json.loads(weather_tool.get_weather.invoke({"loc": "New York"}))
+    second = json.loads(weather_tool.get_weather.invoke({"loc": "  new   york "}))
+    assert first == second == {"cod": 200, "name": "New York", "main": {"temp": 20}}
+    assert requests == ["New York"]
+
+
+def test_cache_entries_expire_after_ttl(openweather):
+    requests, clock = openweather
+    weather_tool.get_weather.invoke({"loc": "Beijing"})
+    clock["now"] = 599
+    weather_tool.get_weather.invoke({"loc": "Beijing"})
+    assert requests == ["Beijing"]
+    clock["now"] = 601
+    weather_tool.get_weather.invoke({"loc": "Beijing"})
+    assert requests == ["Beijing", "Beijing"]
+
+
+def test_failed_lookups_are_not_cached(openweather):
+    requests, _ = openweather
+    for _ in range(2):
+        assert json.loads(weather_tool.get_weather.invoke({"loc": "Nowhere"}))["cod"] == 404
+    assert requests == ["Nowhere", "Nowhere"]
+
+
+def test_non_json_body_returns_error_string(openweather):
+    result = json.loads(weather_tool.get_weather.invoke({"loc": "Proxy"}))
+    assert result["cod"] == "error"
+    assert result["loc"] == "Proxy"
+    assert "502" in result["message"]
+
+
+def test_timeout_returns_error_string(openweather, monkeypatch):
+    monkeypatch.setattr(weather_tool, "weather_client", httpx.Client(timeout=0.3))
+    start = time.perf_counter()
+    result = json.loads(weather_tool.get_weather.invoke({"loc": "Slow"}))
+    assert result["cod"] == "error"
+    assert time.perf_counter() - start < 2
+
+
+def test_batch_fetches_cities_concurrently_and_once(openweather):
+    requests, _ = openweather
+    weather_tool.get_weather.invoke({"loc": "Beijing"})  # 已缓存
+    start = time.perf_counter()
+    result = json.loads(weather_tool.get_weather_batch.invoke(
+        {"locs": ["Shanghai", "Nanjing", "Shanghai", "Nowhere", "Beijing"]}))
+    elapsed = time.perf_counter() - start
+    assert list(result) == ["Shanghai", "Nanjing", "Nowhere", "Beijing"]
+    assert result["Nowhere"]["cod"] == 404
+    assert sorted(requests[1:]) == ["Nanjing", "Nowhere", "Shanghai"]
+    # 三个城市并发请求，总时间接近一次请求而不是三次
+    assert elapsed < RESPONSE_DELAY * 2.5
+
+
+def test_async_batch_shares_the_cache(openweather):
+    requests, _ = openweather
+
+    async def run():
+        start = time.perf_counter()
+        result = json.loads(await weather_tool.get_weather_batch.ainvoke({"locs": ["Wuhan", "Xian", "Chengdu"]}))
+        elapsed = time.perf_counter() - start
+        cached = json.loads(await weather_tool.get_weather.ainvoke({"loc": "wuhan"}))
+        return result, elapsed, cached
+
+    result, elapsed, cached = asyncio.run(run())
+    assert set(result) == {"Wuhan", "Xian", "Chengdu"}
+    assert elapsed < RESPONSE_DELAY * 2.5
+    assert cached == result["Wuhan"]
+    # 同步调用也能命中异步调用写入的缓存
+    weather_tool.get_weather.invoke({"loc": "Xian"})
+    assert sorted(requests) == ["Chengdu", "Wuhan", "Xian"]
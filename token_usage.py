@@ -0,0 +1,21 @@
+'''
+Descripttion: 从 LLM 回调的结果中读取token用量
+不同模型返回用量的位置和字段名不同：大多数 ChatModel 在 usage_metadata 中给出 input_tokens/output_tokens，
+ChatTongyi 等只在 response_metadata['token_usage'] 中给出 prompt_tokens/completion_tokens。
+2_batch_review_runner.py 的 CostTracker 和 6_agent_debate.py 的 TokenUsage 都通过 iter_token_usage 统计。
+'''
+from typing import Iterator, Tuple
+
+from langchain_core.outputs import LLMResult
+
+
+def iter_token_usage(response: LLMResult) -> Iterator[Tuple[int, int]]:
+    """逐条产出每个消息的 (输入token数, 输出token数)，没有消息的生成结果(纯文本LLM)跳过"""
+    for generations in response.generations:
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            if message is None:
+                continue
+            usage = getattr(message, "usage_metadata", None) or message.response_metadata.get("token_usage") or {}
+            yield (usage.get("input_tokens", usage.get("prompt_tokens", 0)) or 0,
+                   usage.get("output_tokens", usage.get("completion_tokens", 0)) or 0)
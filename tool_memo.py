@@ -0,0 +1,215 @@
+'''
+Descripttion: AgentExecutor 工具调用结果的记忆化
+5_agent_sql_db2excel.py 和 6_agent_debate.py 中的 Agent 经常用完全相同的参数重复调用同一个工具，
+例如为了“再确认一下”重新执行同一条 SELECT，或者重新发出同一个 web_search，每次都要付出真实的I/O和时间。
+MemoizingAgentExecutor 在 AgentExecutor 分发工具调用的地方加了一层可选的记忆化：
+1. 缓存键 = 工具名 + 规范化后的参数。默认只统一键的顺序，不改动参数的值；需要按值归一化的工具自己指定规范化函数。
+2. 每个工具都要声明是否“纯”(相同参数总是得到相同结果且没有副作用)，可以是布尔值，也可以是根据参数判断的函数；
+   没有声明的工具一律不缓存，write_to_excel、save_to_markdown 这类有副作用的工具永远不会被缓存。
+3. scope="run" 时缓存只在一次 invoke 内有效，scope="session" 时在 ToolMemo 的整个生命周期内有效。
+4. 只缓存成功的结果：工具返回的错误(SQL错误、超时等)下一次调用可能就不会再出现，不能被复用。
+   可以按工具指定判断结果能否缓存的函数，没有指定时异常对象和第一行带有错误提示的文本不缓存。
+5. 命中缓存时仍然发出工具的 on_tool_start/on_tool_end 回调(带 cached 标签)，astream_events 和追踪里能看到这一步。
+'''
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Union
+
+from langchain.agents import AgentExecutor
+from langchain_core.agents import AgentAction, AgentStep
+from langchain_core.callbacks import AsyncCallbackManager, CallbackManager
+from langchain_core.tools import BaseTool
+
+# True/False，或者接收工具参数、返回是否可以缓存的函数
+Purity = Union[bool, Callable[[Any], bool]]
+
+# 没有指定 cacheable 的工具，第一行含有这些词的文本输出视为错误
+ERROR_MARKERS = ("出错", "失败", "错误", "超时", "被拒绝", "无效", "Error", "error", "Exception")
+
+
+def canonical_args(tool_input: Union[str, Dict[str, Any]], normalize: Optional[Callable[[str], str]] = None) -> str:
+    """
+    参数规范化：字典按键排序，去掉值为 None 的参数(与不传等价)。
+    参数的值默认原样保留，" a " 和 "a" 对很多工具是不同的输入；normalize 不为空时用它处理字符串值，
+    例如 canonicalizers={"lookup": lambda tool_input: canonical_args(tool_input, str.strip)}
+    """
+    if isinstance(tool_input, str):
+        return normalize(tool_input) if normalize else tool_input
+    args = {k: normalize(v) if normalize and isinstance(v, str) else v for k, v in tool_input.items() if v is not None}
+    return json.dumps(args, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def is_success(observation: Any) -> bool:
+    """默认的 cacheable：异常对象、第一行带有错误提示的文本都不缓存"""
+    if isinstance(observation, BaseException):
+        return False
+    if isinstance(observation, str):
+        first_line = observation.lstrip().split("\n", 1)[0]
+        return not any(marker in first_line for marker in ERROR_MARKERS)
+    return True
+
+
+class ToolMemo:
+    def __init__(self, purity: Dict[str, Purity], scope: str = "run",
+                 canonicalizers: Optional[Dict[str, Callable[[Any], Any]]] = None, max_entries: int = 512,
+                 cacheable: Optional[Dict[str, Callable[[Any], bool]]] = None):
+        if scope not in ("run", "session"):
+            raise ValueError(f"scope 只能是 'run' 或 'session'，而不是 '{scope}'")
+        self.purity = purity
+        self.scope = scope
+        self.canonicalizers = canonicalizers or {}
+        # 按工具判断输出是否成功、能否缓存
+        self.cacheable = cacheable or {}
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._metrics = {"hits": 0, "misses": 0, "bypassed": 0, "invalidated": 0, "uncached_errors": 0}
+
+    def key_for(self, scope_id: Any, tool_name: str, tool_input: Any) -> Optional[tuple]:
+        """可以缓存时返回缓存键，否则返回 None"""
+        policy = self.purity.get(tool_name, False)
+        pure = policy(tool_input) if callable(policy) else bool(policy)
+        if not pure:
+            with self._lock:
+                self._metrics["bypassed"] += 1
+            # 按参数判断纯度的工具(例如 query_database)出现一次有副作用的调用(例如 UPDATE)，
+            # 它之前缓存的结果都可能已经过期
+            if callable(policy):
+                self.invalidate(tool_name)
+            return None
+        canonical = self.canonicalizers.get(tool_name, canonical_args)(tool_input)
+        if canonical is None:
+            with self._lock:
+                self._metrics["bypassed"] += 1
+            return None
+        return (scope_id if self.scope == "run" else None, tool_name, canonical)
+
+    def get(self, key: tuple) -> tuple:
+        """返回 (是否命中, 缓存的工具输出)"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._metrics["hits"] += 1
+                return True, self._entries[key]
+            self._metrics["misses"] += 1
+            return False, None
+
+    def put(self, key: tuple, observation: Any):
+        """只缓存成功的输出，错误下一次调用时应该重新执行"""
+        if not self.cacheable.get(key[1], is_success)(observation):
+            with self._lock:
+                self._metrics["uncached_errors"] += 1
+            return
+        with self._lock:
+            self._entries[key] = observation
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, tool_name: Optional[str] = None):
+        """清除某个工具(或全部工具)的缓存"""
+        with self._lock:
+            stale = [key for key in self._entries if tool_name is None or key[1] == tool_name]
+            for key in stale:
+                del self._entries[key]
+            self._metrics["invalidated"] += len(stale)
+
+    def end_run(self, run_id: Any):
+        """一次 invoke 结束，scope="run" 时丢弃这次运行的缓存"""
+        if self.scope != "run":
+            return
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == run_id]:
+                del self._entries[key]
+
+    @property
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["entries"] = len(self._entries)
+        lookups = metrics["hits"] + metrics["misses"]
+        metrics["hit_rate"] = round(metrics["hits"] / lookups, 3) if lookups else 0.0
+        return metrics
+
+
+class MemoizingAgentExecutor(AgentExecutor):
+    """tool_memo 为 None 时与 AgentExecutor 完全一致"""
+    tool_memo: Optional[ToolMemo] = None
+
+    def _memo_key(self, name_to_tool_map, agent_action: AgentAction, run_manager) -> Optional[tuple]:
+        if self.tool_memo is None or agent_action.tool not in name_to_tool_map:
+            return None
+        run_id = run_manager.run_id if run_manager else None
+        return self.tool_memo.key_for(run_id, agent_action.tool, agent_action.tool_input)
+
+    def _memo_hit(self, agent_action: AgentAction, observation: Any) -> AgentStep:
+        if self.verbose:
+            print(f"\n[工具缓存] {agent_action.tool} 使用相同的参数调用过，直接复用之前的结果")
+        return AgentStep(action=agent_action, observation=observation)
+
+    def _memo_callback_args(self, tool: BaseTool, agent_action: AgentAction, color: Optional[str]) -> tuple:
+        """
+        命中缓存时工具没有真正执行，但仍然要像 BaseTool.run 那样发出 on_tool_start/on_tool_end，
+        否则 astream_events、追踪和 verbose 输出里都看不到这一步。回调带有 cached 标签和 metadata["cached"]=True。
+        返回 (configure 的参数, on_tool_start 的参数, on_tool_end 的关键字参数)
+        """
+        tool_input = agent_action.tool_input
+        configure = dict(local_tags=[*(tool.tags or []), "cached"],
+                         local_metadata={**(tool.metadata or {}), "cached": True})
+        start = dict(serialized={"name": tool.name, "description": tool.description},
+                     input_str=tool_input if isinstance(tool_input, str) else str(tool_input),
+                     color=color, name=tool.name, inputs=tool_input if isinstance(tool_input, dict) else None)
+        end = dict(color=color, name=tool.name, **self._action_agent.tool_run_logging_kwargs())
+        return configure, start, end
+
+    def _perform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None) -> AgentStep:
+        key = self._memo_key(name_to_tool_map, agent_action, run_manager)
+        if key is not None:
+            found, observation = self.tool_memo.get(key)
+            if found:
+                if run_manager:
+                    run_manager.on_agent_action(agent_action, color="green")
+                configure, start, end = self._memo_callback_args(
+                    name_to_tool_map[agent_action.tool], agent_action, color_mapping.get(agent_action.tool))
+                callback_manager = CallbackManager.configure(
+                    run_manager.get_child() if run_manager else None, None, self.verbose, **configure)
+                callback_manager.on_tool_start(**start).on_tool_end(observation, **end)
+                return self._memo_hit(agent_action, observation)
+        step = super()._perform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+        if key is not None:
+            self.tool_memo.put(key, step.observation)
+        return step
+
+    async def _aperform_agent_action(self, name_to_tool_map, color_mapping, agent_action,
+                                     run_manager=None) -> AgentStep:
+        key = self._memo_key(name_to_tool_map, agent_action, run_manager)
+        if key is not None:
+            found, observation = self.tool_memo.get(key)
+            if found:
+                if run_manager:
+                    await run_manager.on_agent_action(agent_action, color="green")
+                configure, start, end = self._memo_callback_args(
+                    name_to_tool_map[agent_action.tool], agent_action, color_mapping.get(agent_action.tool))
+                callback_manager = AsyncCallbackManager.configure(
+                    run_manager.get_child() if run_manager else None, None, self.verbose, **configure)
+                tool_run_manager = await callback_manager.on_tool_start(**start)
+                await tool_run_manager.on_tool_end(observation, **end)
+                return self._memo_hit(agent_action, observation)
+        step = await super()._aperform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+        if key is not None:
+            self.tool_memo.put(key, step.observation)
+        return step
+
+    def _call(self, inputs, run_manager=None):
+        try:
+            return super()._call(inputs, run_manager)
+        finally:
+            if self.tool_memo is not None and run_manager:
+                self.tool_memo.end_run(run_manager.run_id)
+
+    async def _acall(self, inputs, run_manager=None):
+        try:
+            return await super()._acall(inputs, run_manager)
+        finally:
+            if self.tool_memo is not None and run_manager:
+                self.tool_memo.end_run(run_manager.run_id)
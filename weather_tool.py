@@ -0,0 +1,145 @@
+'''
+Descripttion: 天气查询工具
+基于 httpx 连接池，同时提供同步和异步实现，设置严格的超时，并按规范化后的城市名做TTL缓存：
+1. get_weather 查询一个城市，invoke 走同步连接池，ainvoke 走异步连接池。
+2. get_weather_batch 一次并发查询多个城市，同一批次中重复的城市只请求一次。
+3. 查询失败(网络错误、超时、返回的不是JSON)时返回 {"cod": "error", ...} 形式的JSON字符串，不会抛出异常。
+设置 OPENWEATHER_API_URL 可以指向本地的模拟服务，tests/test_weather_tool.py 就是这样测试的。
+'''
+import os
+import json
+import asyncio
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import httpx
+from cachetools import TTLCache
+from langchain_core.tools import StructuredTool
+
+# 天气查询的HTTP客户端：复用连接池，并设置严格的超时时间
+# OPENWEATHER_API_URL 可以指向本地的模拟服务，方便离线调试
+OPENWEATHER_API_URL = os.getenv("OPENWEATHER_API_URL", "https://api.openweathermap.org/data/2.5/weather")
+WEATHER_TIMEOUT = httpx.Timeout(5.0, connect=2.0)
+WEATHER_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10)
+weather_client = httpx.Client(timeout=WEATHER_TIMEOUT, limits=WEATHER_LIMITS)
+# httpx.AsyncClient 绑定在创建它的事件循环上，所以每个事件循环各自持有一个
+_async_weather_clients = weakref.WeakKeyDictionary()
+
+# 同一个城市10分钟内的重复查询直接返回缓存结果
+weather_cache = TTLCache(maxsize=512, ttl=600)
+_weather_cache_lock = threading.Lock()
+
+
+def _normalize_city(loc: str) -> str:
+    """缓存键：去掉首尾空白、合并中间空白并转为小写，'  new  York' 和 'New York' 视为同一个城市"""
+    return " ".join(str(loc).split()).lower()
+
+
+def _weather_params(loc: str) -> dict:
+    return {
+        "q": loc,
+        "appid": os.getenv("OPENWEATHER_API_KEY"),    # 输入API key
+        "units": "metric",            # 使用摄氏度而不是华氏度
+        "lang": "zh_cn"               # 输出语言为简体中文
+    }
+
+
+def _cache_get(key: str):
+    with _weather_cache_lock:
+        return weather_cache.get(key)
+
+
+def _weather_error(loc: str, message: str) -> str:
+    return json.dumps({"cod": "error", "message": f"天气查询失败: {message}", "loc": loc}, ensure_ascii=False)
+
+
+def _handle_weather_response(loc: str, key: str, response: httpx.Response) -> str:
+    try:
+        data = response.json()
+    except ValueError:
+        # 例如网关或代理返回的HTML错误页
+        return _weather_error(loc, f"HTTP {response.status_code}，返回的内容不是JSON: {response.text[:200]!r}")
+    result = json.dumps(data)
+    # 只缓存查询成功的结果，城市名错误、限流等情况下次仍然重新请求
+    if response.status_code == 200:
+        with _weather_cache_lock:
+            weather_cache[key] = result
+    return result
+
+
+def fetch_weather(loc: str) -> str:
+    key = _normalize_city(loc)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+    try:
+        response = weather_client.get(OPENWEATHER_API_URL, params=_weather_params(loc))
+        return _handle_weather_response(loc, key, response)
+    except httpx.HTTPError as e:
+        return _weather_error(loc, repr(e))
+
+
+def _get_async_weather_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _async_weather_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(timeout=WEATHER_TIMEOUT, limits=WEATHER_LIMITS)
+        _async_weather_clients[loop] = client
+    return client
+
+
+async def afetch_weather(loc: str) -> str:
+    key = _normalize_city(loc)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+    try:
+        response = await _get_async_weather_client().get(OPENWEATHER_API_URL, params=_weather_params(loc))
+        return _handle_weather_response(loc, key, response)
+    except httpx.HTTPError as e:
+        return _weather_error(loc, repr(e))
+
+
+def _get_weather(loc: str) -> str:
+    """
+    查询即时天气函数
+    :param loc: 必要参数，字符串类型，用于表示查询天气的具体城市名称，\
+    注意，中国的城市需要用对应城市的英文名称代替，例如如果需要查询北京市天气，则loc参数需要输入'Beijing'；
+    :return：OpenWeather API查询即时天气的结果，具体URL请求地址为：https://api.openweathermap.org/data/2.5/weather\
+    返回结果对象类型为解析之后的JSON格式对象，并用字符串形式进行表示，其中包含了全部重要的天气信息
+    """
+    return fetch_weather(loc)
+
+
+async def _aget_weather(loc: str) -> str:
+    return await afetch_weather(loc)
+
+
+# 同时提供同步和异步实现：invoke 走同步连接池，ainvoke 走异步连接池
+get_weather = StructuredTool.from_function(func=_get_weather, coroutine=_aget_weather, name="get_weather")
+
+
+def _get_weather_batch(locs: List[str]) -> str:
+    """
+    一次查询多个城市的即时天气
+    :param locs: 必要参数，城市名称列表，中国的城市同样需要使用英文名称，例如 ['Beijing', 'Shanghai']；
+    :return：以城市名称为键、OpenWeather API查询结果为值的JSON字符串
+    """
+    # 同一批次中重复的城市只请求一次
+    unique = list(dict.fromkeys(locs, None))
+    with ThreadPoolExecutor(max_workers=min(len(unique), 10) or 1) as pool:
+        results = dict(zip(unique, pool.map(fetch_weather, unique)))
+    return json.dumps({loc: json.loads(results[loc]) for loc in locs}, ensure_ascii=False)
+
+
+async def _aget_weather_batch(locs: List[str]) -> str:
+    unique = list(dict.fromkeys(locs, None))
+    results = dict(zip(unique, await asyncio.gather(*(afetch_weather(loc) for loc in unique))))
+    return json.dumps({loc: json.loads(results[loc]) for loc in locs}, ensure_ascii=False)
+
+
+get_weather_batch = StructuredTool.from_function(
+    func=_get_weather_batch, coroutine=_aget_weather_batch, name="get_weather_batch"
+)